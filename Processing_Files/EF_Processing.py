@@ -0,0 +1,303 @@
+import os
+import numpy as np
+import pandas as pd
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+
+# ACE Explorer task exports scored by this stage: (task, file)
+EF_TASKS = [
+    ('STROOP', 'STROOP.csv'),
+    ('TASKSWITCH', 'TASKSWITCH_V2.csv'),
+    ('BRT', 'BRT.csv'),
+    ('BACKWARDSSPATIALSPAN', 'BACKWARDSSPATIALSPAN.csv'),
+]
+DEMOGRAPHICS_FILE = 'demographics.csv'
+
+# Per-session device metadata, repeated on every trial row of the exports
+SESSION_COLUMNS = {
+    'Time Gameplayed Utc': str, 'Finish Status': 'category', 'OS Version': 'category',
+    'Screen Height': 'int32', 'Screen Width': 'int32', 'Client Time Zone': 'category',
+    'Graphics Device Name': 'category', 'Processor Frequency': 'int32', 'Runtime Platform': 'int16',
+    'I18n': 'int16', 'Processor Count': 'int16', 'System Memory Size': 'int32', 'Build': 'category',
+    'Device DPI': 'int32', 'Device Model': 'category', 'Device Type': 'int16',
+}
+
+# Trial columns every task is scored from, plus the task-specific ones
+TRIAL_COLUMNS = {
+    'Participant Id': str, 'Times Finished Game': 'int16', 'Session Type': 'category',
+    'Trial Number': 'int32', 'Response Time': 'float64', 'Correct Button': 'int8',
+}
+TASK_COLUMNS = {
+    'BRT': {'Condition': 'category'},
+    'BACKWARDSSPATIALSPAN': {'Object Count': 'int16'},
+}
+
+# Scoring rules for the ACE Explorer exports: responses faster than
+# MIN_RESPONSE_TIME (ms) are anticipations and are dropped, except that
+# rate correct scores keep the correctness of responses under
+# MIN_RECORDED_RESPONSE_TIME (mostly 0, no response) without adding their
+# time; a BRT session needs at least MIN_VALID_PROPORTION of its trials
+# left, and a span needs at least MIN_SPAN_TRIALS trials. With these rules
+# every session of the full ACE export scores as in the R script's
+# EF_data_combined.csv
+MIN_RESPONSE_TIME = 200
+MIN_RECORDED_RESPONSE_TIME = 100
+MIN_VALID_PROPORTION = 0.5
+MIN_SPAN_TRIALS = 10
+
+# Relative tolerance of the comparison with a reference EF_data_combined.csv
+# (R writes 15 significant digits)
+PARITY_TOLERANCE = 1e-9
+
+# Output columns of EF_data_combined.csv, in the order the R script wrote them
+SCORE_COLUMNS = [
+    'STROOP.rcs.overall', 'TASKSWITCH.rcs.overall',
+    'BRT.rt_mean.correct', 'BRT.rt_mean.correct.dominant', 'BRT.rt_mean.correct.nondominant',
+    'BACKWARDSSPATIALSPAN.object_count_span.overall',
+]
+OUTPUT_COLUMNS = ['pid', 'age', 'handedness', 'bid'] + SCORE_COLUMNS
+
+def normalize_pid(participant_ids):
+    """Turn ACE participant IDs (e.g. WPI6_173b04029437i39) into pids (wpi6173b04029437i39)"""
+    return participant_ids.str.lower().str.replace(r'[^a-z0-9]', '', regex=True)
+
+def read_task_export(file_path, task):
+    """
+    Read the columns of one ACE task export this stage needs, with explicit
+    dtypes, and split it into trials and per-session metadata.
+    Returns (trials_df, sessions_df), both keyed by pid and bid
+    (pid.session<n>, n being the number of times the game was finished before).
+    """
+    dtypes = {**TRIAL_COLUMNS, **TASK_COLUMNS.get(task, {}), **SESSION_COLUMNS}
+    df = pd.read_csv(file_path, usecols=list(dtypes), dtype=dtypes)
+    df['pid'] = normalize_pid(df['Participant Id'])
+    df['bid'] = df['pid'] + '.session' + df['Times Finished Game'].astype(str)
+
+    # A trial appearing twice (e.g. an export appended to itself) counts once
+    df = df.drop_duplicates(['bid', 'Time Gameplayed Utc', 'Session Type', 'Trial Number'])
+
+    sessions_df = df.drop_duplicates(['bid', 'Time Gameplayed Utc'])[['pid', 'bid'] + list(SESSION_COLUMNS)]
+    sessions_df.insert(2, 'task', task)
+    trials_df = df[['pid', 'bid'] + [c for c in dtypes if c not in SESSION_COLUMNS and c != 'Participant Id']]
+    return trials_df, sessions_df
+
+def read_demographics(file_path):
+    """Get age and handedness per pid from the ACE demographics export"""
+    df = pd.read_csv(file_path, usecols=['PID', 'Age', 'Handedness'],
+                     dtype={'PID': str, 'Age': 'float64', 'Handedness': str})
+    df['pid'] = normalize_pid(df['PID'])
+    df = df.drop_duplicates('pid', keep='last')
+    return df.set_index('pid').rename(columns={'Age': 'age', 'Handedness': 'handedness'})[['age', 'handedness']]
+
+def score_rcs(trials_df):
+    """
+    Rate correct score per session: correct responses per second of total
+    response time over the real (non-practice) trials.
+    """
+    response_times = trials_df['Response Time']
+    unrecorded = response_times < MIN_RECORDED_RESPONSE_TIME
+    trials_df = trials_df.assign(**{'Response Time': response_times.where(~unrecorded, 0)})
+    trials_df = trials_df[(trials_df['Session Type'] == 'Real') & (unrecorded | (response_times >= MIN_RESPONSE_TIME))]
+    totals = trials_df.groupby('bid')[['Correct Button', 'Response Time']].sum()
+    return totals['Correct Button'] / (totals['Response Time'] / 1000)
+
+def score_brt(trials_df, handedness):
+    """
+    Mean correct response time per session, overall and for the dominant
+    and non-dominant hand (Condition is the hand the trial asked for).
+    handedness: Series of LEFT/RIGHT per pid
+    Returns a DataFrame with the three BRT columns, indexed by bid.
+    """
+    real = trials_df[trials_df['Session Type'] == 'Real']
+    is_valid = real['Response Time'] >= MIN_RESPONSE_TIME
+    valid_proportion = is_valid.groupby(real['bid']).mean()
+
+    # Participants without a known handedness get no hand-specific scores
+    correct = real[is_valid & (real['Correct Button'] == 1)]
+    hands = correct['pid'].map(handedness.str.upper())
+    is_dominant = correct['Condition'].astype(str) == hands
+    is_nondominant = hands.notna() & ~is_dominant
+    scores = pd.DataFrame({
+        'BRT.rt_mean.correct': correct.groupby('bid')['Response Time'].mean(),
+        'BRT.rt_mean.correct.dominant': correct[is_dominant].groupby('bid')['Response Time'].mean(),
+        'BRT.rt_mean.correct.nondominant': correct[is_nondominant].groupby('bid')['Response Time'].mean(),
+    }).reindex(valid_proportion.index)
+    scores[valid_proportion < MIN_VALID_PROPORTION] = np.nan
+    return scores
+
+def score_span(trials_df):
+    """Longest sequence (object count) reached in the real trials of each session"""
+    real = trials_df[trials_df['Session Type'] == 'Real']
+    spans = real.groupby('bid')['Object Count'].agg(['max', 'size'])
+    return spans['max'].where(spans['size'] >= MIN_SPAN_TRIALS).astype('float64')
+
+def score_tasks(task_trials, demographics_df):
+    """
+    Compute every session's task scores.
+    task_trials: dict mapping task to its trials_df
+    Returns one row per bid with pid and the SCORE_COLUMNS.
+    """
+    scores = []
+    if 'STROOP' in task_trials:
+        scores.append(score_rcs(task_trials['STROOP']).rename('STROOP.rcs.overall'))
+    if 'TASKSWITCH' in task_trials:
+        scores.append(score_rcs(task_trials['TASKSWITCH']).rename('TASKSWITCH.rcs.overall'))
+    if 'BRT' in task_trials:
+        scores.append(score_brt(task_trials['BRT'], demographics_df['handedness']))
+    if 'BACKWARDSSPATIALSPAN' in task_trials:
+        scores.append(score_span(task_trials['BACKWARDSSPATIALSPAN']).rename(
+            'BACKWARDSSPATIALSPAN.object_count_span.overall'))
+
+    scores_df = pd.concat(scores, axis=1).reindex(columns=SCORE_COLUMNS).sort_index()
+    scores_df.index.name = 'bid'
+    scores_df = scores_df.reset_index()
+    scores_df.insert(0, 'pid', scores_df['bid'].str.rsplit('.', n=1).str[0])
+    return scores_df
+
+def compare_ef_scores(scores_df, reference_df):
+    """
+    Compare scores with a reference EF_data_combined.csv, such as the one the
+    R script wrote.
+    Returns a list of differences as text (sessions missing or extra, row
+    counts, and values differing beyond PARITY_TOLERANCE), empty if they match.
+    """
+    differences = []
+    if list(reference_df.columns) != OUTPUT_COLUMNS:
+        return [f"reference columns {list(reference_df.columns)} are not {OUTPUT_COLUMNS}"]
+    missing = sorted(set(reference_df['bid']) - set(scores_df['bid']))
+    extra = sorted(set(scores_df['bid']) - set(reference_df['bid']))
+    if missing:
+        differences.append(f"{len(missing)} sessions of the reference are not scored: {missing}")
+    if extra:
+        differences.append(f"{len(extra)} scored sessions are not in the reference: {extra}")
+    if len(scores_df) != len(reference_df):
+        differences.append(f"{len(scores_df)} rows, the reference has {len(reference_df)}")
+
+    joined = scores_df.drop_duplicates('bid').merge(reference_df.drop_duplicates('bid'), on='bid',
+                                                    suffixes=('', '_reference'))
+    for column in [column for column in OUTPUT_COLUMNS if column != 'bid']:
+        values, reference = joined[column], joined[column + '_reference']
+        if column in ('pid', 'handedness'):
+            same = values.astype(str) == reference.astype(str)
+        else:
+            same = np.isclose(values.astype('float64'), reference.astype('float64'), rtol=PARITY_TOLERANCE, atol=0)
+        same |= values.isna() & reference.isna()
+        for bid, value, expected in zip(joined['bid'][~same], values[~same], reference[~same]):
+            differences.append(f"{bid} {column}: {value} (reference {expected})")
+    return differences
+
+def process_ef_data(force=False, paths=None, input_path=None, replace=False):
+    """
+    Score the ACE executive-function tasks of every participant.
+    Writes one row per participant session with age, handedness and the
+    task scores to Output_Files/EF_data_combined.csv, and the per-session
+    device metadata to Processing_Files/EF_sessions.csv. As in the R script,
+    the scores are inner-joined with participant_ids.csv.
+    An EF_data_combined.csv this stage did not write (the R script's) is a
+    reference: it is replaced only if the scores match it, and otherwise the
+    scores go to Processing_Files/EF_data_combined_candidate.csv and the
+    differences are printed.
+    input_path: directory of the ACE exports (default: EF ACE raw files)
+    force: rebuild even if the build manifest says the output is up to date
+    replace: overwrite a reference EF_data_combined.csv that does not match
+    """
+    paths = paths or get_pipeline_paths()
+    input_path = input_path or paths.ef_raw_data
+    output_file = paths.ef_combined
+
+    print("\nStarting EF data processing...")
+
+    task_files = [(task, file) for task, file in EF_TASKS if os.path.exists(os.path.join(input_path, file))]
+    missing = [file for _, file in EF_TASKS if file not in dict(task_files).values()]
+    if missing:
+        print(f"Missing ACE exports (their scores will be empty): {missing}")
+    if not task_files or not os.path.exists(os.path.join(input_path, DEMOGRAPHICS_FILE)):
+        print(f"No ACE exports with {DEMOGRAPHICS_FILE} found in {input_path}")
+        return
+
+    try:
+        participants_df = pd.read_csv(paths.participant_ids, usecols=['pid'], dtype=str)
+        participants_df['pid'] = normalize_pid(participants_df['pid'])
+    except Exception as e:
+        print(f"Error reading participant IDs: {e}")
+        return
+
+    # The scores depend on every export, so the output is rebuilt when any changed
+    input_files = [file for _, file in task_files] + [DEMOGRAPHICS_FILE]
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {'code': code_version(__file__), 'participant_ids': hash_file(paths.participant_ids),
+                    'input_path': os.path.abspath(input_path)}
+    if not force and not manifest.stale_files('ef', input_path, input_files, dependencies) \
+            and os.path.exists(paths.ef_sessions):
+        print(f"{os.path.basename(output_file)} is up to date")
+        return
+
+    try:
+        with timed_phase('read'):
+            demographics_df = read_demographics(os.path.join(input_path, DEMOGRAPHICS_FILE))
+            task_trials = {}
+            sessions = []
+            for task, file in task_files:
+                trials_df, sessions_df = read_task_export(os.path.join(input_path, file), task)
+                task_trials[task] = trials_df
+                sessions.append(sessions_df)
+                add_count('trials', len(trials_df))
+    except Exception as e:
+        print(f"Error reading EF data: {e}")
+        return
+
+    with timed_phase('score'):
+        scores_df = score_tasks(task_trials, demographics_df)
+        scores_df = scores_df.join(demographics_df, on='pid')
+        scores_df = scores_df.merge(participants_df, on='pid')[OUTPUT_COLUMNS]
+        sessions_df = pd.concat(sessions, ignore_index=True).sort_values(['bid', 'task', 'Time Gameplayed Utc'])
+
+    # Check the scores against an EF_data_combined.csv not written by this stage
+    scores_file = output_file
+    differences = []
+    if os.path.exists(output_file) and 'ef' not in manifest.entries and not replace:
+        try:
+            differences = compare_ef_scores(scores_df, pd.read_csv(output_file, dtype={'pid': str, 'bid': str}))
+        except Exception as e:
+            differences = [f"cannot read it: {e}"]
+        if differences:
+            print(f"Scores do not match the existing {os.path.basename(output_file)}, which is kept "
+                  f"(--replace overwrites it):")
+            for difference in differences[:20]:
+                print(f"  {difference}")
+            if len(differences) > 20:
+                print(f"  ... and {len(differences) - 20} more differences")
+            scores_file = paths.ef_candidate
+        else:
+            # Keep the reference's own formatting
+            print(f"Scores match the existing {os.path.basename(output_file)}")
+            scores_file = None
+
+    try:
+        with timed_phase('write'):
+            os.makedirs(os.path.dirname(paths.ef_sessions), exist_ok=True)
+            if scores_file is not None:
+                os.makedirs(os.path.dirname(scores_file), exist_ok=True)
+                scores_df.to_csv(scores_file, index=False)
+            sessions_df.to_csv(paths.ef_sessions, index=False)
+    except Exception as e:
+        print(f"Error writing EF data: {e}")
+        return
+
+    print(f"Scored {scores_df['bid'].nunique()} sessions of {scores_df['pid'].nunique()} listed participants "
+          f"({len(demographics_df)} in the ACE exports)")
+    saved = f"{os.path.basename(scores_file)} and " if scores_file is not None else ""
+    print(f"Saved {saved}{os.path.basename(paths.ef_sessions)} ({len(sessions_df)} task sessions)")
+
+    # Until the scores match, every run compares them with the reference again
+    if differences:
+        return
+    manifest.entries.pop('ef', None)
+    for file in input_files:
+        manifest.record('ef', os.path.join(input_path, file), dependencies, output_file)
+    manifest.save()
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('ef')
@@ -0,0 +1,199 @@
+import os
+import json
+import shutil
+import pandas as pd
+import gaze_arrays
+import Processing_1_Cleaning_trials
+from gaze_arrays import find_malformed_gaze_arrays
+from Processing_1_Cleaning_trials import (TRIAL_COLUMNS, PARTICIPANT_FIELDS, IMAGE_METADATA, read_participant_ids,
+                                          normalize_participant_id)
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import read_if_path
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+
+# Raw export columns the cleaning stage reads (Condition is derived, not read)
+REQUIRED_COLUMNS = [column for column in TRIAL_COLUMNS if column != 'Condition'] + \
+    list(dict.fromkeys(source for _, source, _ in PARTICIPANT_FIELDS))
+
+# Number of non-missing answers each participant-level source column needs
+REQUIRED_ANSWERS = {}
+for _, source, position in PARTICIPANT_FIELDS:
+    REQUIRED_ANSWERS[source] = max(REQUIRED_ANSWERS.get(source, 0), position + 1)
+
+# Per-trial checks: Processing_1 and 4 skip the affected trials and process
+# the rest of the file, so these are reported as warnings, not quarantined
+WARNING_CHECKS = {'unknown_images', 'malformed_gaze_array'}
+
+# File in the quarantine directory listing why each file was moved there,
+# and the warnings of files that were checked but kept
+REASONS_FILE = 'quarantine_reasons.json'
+
+def read_raw_columns(file_path):
+    """Read the REQUIRED_COLUMNS a raw Pavlovia export has, as text"""
+    header = pd.read_csv(file_path, encoding='latin-1', nrows=0).columns
+    return pd.read_csv(file_path, encoding='latin-1', dtype=str,
+                       usecols=[column for column in header if column in REQUIRED_COLUMNS])
+
+def check_raw_export(df, all_IDs):
+    """
+    Check the invariants the cleaning and AOI labelling stages rely on.
+    df: raw export read with (at least) the REQUIRED_COLUMNS present in it,
+    or its path
+    Returns a list of problems, each a dict with the failed 'check' and a
+    'detail' message, empty if every trial can be processed (the file is
+    still processed if only WARNING_CHECKS fail).
+    """
+    df = read_if_path(df, read_raw_columns)
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        return [{'check': 'missing_columns', 'detail': f"missing columns {missing}"}]
+
+    problems = []
+
+    # Processing_1 takes the PID from the second row
+    PID = normalize_participant_id(df.at[1, 'pid']) if len(df) > 1 else None
+    if PID is None:
+        problems.append({'check': 'missing_pid', 'detail': "no pid in the second row"})
+    elif PID not in all_IDs:
+        problems.append({'check': 'unknown_pid', 'detail': f"PID {PID} not in participant_ids.csv"})
+
+    for source, needed in REQUIRED_ANSWERS.items():
+        answers = df[source].notna().sum()
+        if answers < needed:
+            problems.append({'check': 'too_few_answers',
+                             'detail': f"{source} has {answers} answers, {needed} needed"})
+
+    for column in ('win_width', 'win_height'):
+        values = pd.to_numeric(df[column].dropna(), errors='coerce')
+        if not len(values) or pd.isna(values.iloc[0]) or values.iloc[0] <= 0:
+            problems.append({'check': 'invalid_window', 'detail': f"{column} is missing or not a positive number"})
+
+    images = df['Image'].astype(str)
+    png_rows = df.index[images.str.contains('png', na=False)]
+    if len(png_rows) == 0:
+        problems.append({'check': 'no_trials', 'detail': "no rows with a .png image"})
+        return problems
+    trials = df.loc[png_rows.min():png_rows.max()]
+    trials = trials[trials['Image'].notna()]
+
+    unknown_images = sorted(set(trials['Image']) - set(IMAGE_METADATA['Image']))
+    if unknown_images:
+        problems.append({'check': 'unknown_images', 'detail': f"images not in IMAGE_METADATA {unknown_images}"})
+
+    for position, error in find_malformed_gaze_arrays(trials['TaskGazeArray']):
+        problems.append({'check': 'malformed_gaze_array',
+                         'detail': f"trial {position + 1} ({trials['Image'].iloc[position]}): {error}"})
+    return problems
+
+def validate_raw_file(filename, input_path, all_IDs):
+    """
+    Read the needed columns of one raw Pavlovia export and check them.
+    Returns {'processed': whether the file passed, 'problems': the failed
+    checks that quarantine it, 'warnings': the failed WARNING_CHECKS}, with
+    problems and warnings as check_raw_export gives them.
+    """
+    file_path = os.path.join(input_path, filename)
+    try:
+        with timed_phase('read'):
+            df = read_raw_columns(file_path)
+        add_count('rows', len(df))
+        with timed_phase('check'):
+            problems = check_raw_export(df, all_IDs)
+    except Exception as e:
+        problems = [{'check': 'unreadable', 'detail': str(e)}]
+    for problem in problems:
+        kind = " (warning)" if problem['check'] in WARNING_CHECKS else ""
+        print(f"  {filename}: {problem['check']}{kind}: {problem['detail']}")
+    warnings = [problem for problem in problems if problem['check'] in WARNING_CHECKS]
+    problems = [problem for problem in problems if problem['check'] not in WARNING_CHECKS]
+    return {'processed': not problems, 'problems': problems, 'warnings': warnings}
+
+def quarantine_file(filename, input_path, quarantine_path, result, reasons):
+    """Move a raw export into the quarantine directory and record why"""
+    os.makedirs(quarantine_path, exist_ok=True)
+    shutil.move(os.path.join(input_path, filename), os.path.join(quarantine_path, filename))
+    reasons[filename] = {'source': os.path.abspath(input_path), 'quarantined': True,
+                         'problems': result['problems'], 'warnings': result['warnings']}
+
+def read_quarantine_reasons(quarantine_path):
+    """Get the recorded reasons of the quarantined files, by file name"""
+    reasons_file = os.path.join(quarantine_path, REASONS_FILE)
+    if not os.path.exists(reasons_file):
+        return {}
+    with open(reasons_file) as f:
+        return json.load(f)
+
+def validate_raw_exports(jobs=1, force=False, paths=None, dry_run=False, report=None):
+    """
+    Check every raw Pavlovia export before the expensive stages read it,
+    reading only the columns Processing_1 uses, and move the files that
+    would fail or be skipped as a whole to Input_Files/Quarantine. Each
+    problem is recorded in Quarantine/quarantine_reasons.json as a check
+    name (missing_columns, missing_pid, unknown_pid, too_few_answers,
+    invalid_window, no_trials or unreadable) and a detail message.
+    Per-trial problems (unknown_images, malformed_gaze_array) are recorded
+    there as warnings, and the file is kept.
+    dry_run: only report the problems, leaving the files in place
+    force: recheck files that passed with the same code and participant IDs
+    Returns the names of the files that failed.
+    """
+    paths = paths or get_pipeline_paths()
+    input_path = paths.raw_data
+
+    print("\nValidating raw exports...")
+    try:
+        all_IDs = read_participant_ids(paths.participant_ids)
+    except Exception as e:
+        print(f"Error reading participant IDs: {e}")
+        return []
+
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {
+        'participant_ids': hash_file(paths.participant_ids),
+        'code': code_version(__file__, Processing_1_Cleaning_trials.__file__, gaze_arrays.__file__),
+    }
+    all_files = list_participant_files(input_path)
+    files = all_files if force else manifest.stale_files('validate', input_path, all_files, dependencies)
+    print(f"{len(all_files) - len(files)} of {len(all_files)} files passed before and are unchanged")
+
+    results = run_participant_files(validate_raw_file, files, jobs=jobs, report=report,
+                                    input_path=input_path, all_IDs=all_IDs)
+
+    failed = [(filename, result) for filename, result in zip(files, results) if result['problems']]
+    warned = [(filename, result) for filename, result in zip(files, results)
+              if result['warnings'] and not result['problems']]
+    reasons = read_quarantine_reasons(paths.quarantine)
+    # Warnings of an earlier check of a kept file are replaced by this check's
+    outdated = [filename for filename in files if not reasons.get(filename, {}).get('quarantined', True)]
+    for filename in outdated:
+        del reasons[filename]
+    for filename, result in failed:
+        if not dry_run:
+            quarantine_file(filename, input_path, paths.quarantine, result, reasons)
+    for filename, result in warned:
+        reasons[filename] = {'source': os.path.abspath(input_path), 'quarantined': False,
+                             'problems': [], 'warnings': result['warnings']}
+    for filename, result in zip(files, results):
+        if not result['problems']:
+            input_file = os.path.join(input_path, filename)
+            manifest.record('validate', input_file, dependencies, input_file)
+    manifest.forget_missing('validate', list_participant_files(input_path))
+    manifest.save()
+
+    if (failed or warned or outdated) and not dry_run:
+        os.makedirs(paths.quarantine, exist_ok=True)
+        with open(os.path.join(paths.quarantine, REASONS_FILE), 'w') as f:
+            json.dump(reasons, f, indent=2)
+
+    print(f"{len(files) - len(failed)} of {len(files)} checked files passed"
+          + (f" ({len(warned)} with warnings)" if warned else ""))
+    if failed:
+        action = "would be quarantined" if dry_run else f"moved to {paths.quarantine}"
+        print(f"{len(failed)} files {action}: {[filename for filename, _ in failed]}")
+    return [filename for filename, _ in failed]
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('validate')
@@ -1,298 +1,256 @@
 import os
-from pathlib import Path
+from functools import partial
 import pandas as pd
 import numpy as np
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import PREFETCH_DEPTH, read_input_file, read_if_path, write_behind
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
 
-def generate_eye_tracking_data():
-    # Generate gaze dataset 
-    parent_path = str(Path(__file__).resolve().parent.parent)  # get the Code directory path
-    
-    input_path = os.path.join(parent_path, 'Input_files/Raw_di-data')
+# Trial-level columns kept from the raw export, in output order
+TRIAL_COLUMNS = [
+    # Basic Info
+    'pid', 'date', 'OS', 'frameRate',
+    # Trial Data
+    'Image', 'finalNumerator', 'finalDenominator', 'trialElapsedTime', 
+    'TaskGazeArray', 
+    'Condition',
+]
 
-    output_path = os.path.join(parent_path, 'Processing_files/Pavlovia_Data')
+# Participant-level fields added to every trial row, in output order:
+# (output column, source column, position among the source column's non-missing values)
+PARTICIPANT_FIELDS = [
+    # Math Anxiety
+    ('MA_EM_1', 'key_MA.keys', 0), ('MA_EM_2', 'key_MA.keys', 1),
+    ('MA_EM_3', 'key_MA.keys', 2), ('MA_EM_4', 'key_MA.keys', 3),
+    ('MA_WO_1', 'key_MA.keys', 4), ('MA_WO_2', 'key_MA.keys', 5),
+    ('MA_WO_3', 'key_MA.keys', 6), ('MA_WO_4', 'key_MA.keys', 7),
+    ('MA_EV_1', 'key_MA.keys', 8), ('MA_EV_2', 'key_MA.keys', 9),
+    ('MA_EV_3', 'key_MA.keys', 10),
+    # Demo
+    ('age', 'DemoResp', 0), ('gender', 'DemoResp', 1), ('race_ethnicity', 'DemoResp', 2),
+    # Window Info
+    ('win_height', 'win_height', 0), ('win_width', 'win_width', 0),
+    # Arousal Data (pre pretest, then pretest and experimental)
+    ('arousal_PrePre', 'key_Pretest_Arousal.keys', 0), ('arousal_Time_PrePre', 'key_Pretest_Arousal.rt', 0),
+    ('arousal_Pretest_3', 'key_Arousal.keys', 0), ('arousal_Time_Pretest_3', 'key_Arousal.rt', 0),
+    ('arousal_Pretest_7', 'key_Arousal.keys', 1), ('arousal_Time_Pretest_7', 'key_Arousal.rt', 1),
+    ('arousal_Pretest_12', 'key_Arousal.keys', 2), ('arousal_Time_Pretest_12', 'key_Arousal.rt', 2),
+    ('arousal_Exp_2', 'key_Arousal.keys', 3), ('arousal_Time_Exp_2', 'key_Arousal.rt', 3),
+    ('arousal_Exp_12', 'key_Arousal.keys', 4), ('arousal_Time_Exp_12', 'key_Arousal.rt', 4),
+    # Valence Data (pre pretest, then pretest and experimental)
+    ('valence_PrePre', 'key_Pretest_Valence.keys', 0), ('valence_Time_PrePre', 'key_Pretest_Valence.rt', 0),
+    ('valence_Pretest_3', 'key_Valence.keys', 0), ('valence_Time_Pretest_3', 'key_Valence.rt', 0),
+    ('valence_Pretest_7', 'key_Valence.keys', 1), ('valence_Time_Pretest_7', 'key_Valence.rt', 1),
+    ('valence_Pretest_12', 'key_Valence.keys', 2), ('valence_Time_Pretest_12', 'key_Valence.rt', 2),
+    ('valence_Exp_2', 'key_Valence.keys', 3), ('valence_Time_Exp_2', 'key_Valence.rt', 3),
+    ('valence_Exp_12', 'key_Valence.keys', 4), ('valence_Time_Exp_12', 'key_Valence.rt', 4),
+]
 
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+# Image-level metadata: true final numerators and denominators, HOO position
+# and whether the answer could be simplified
+IMAGE_METADATA = pd.DataFrame({
+    'Image': ["P1.png", "P2.png", "P3.png", "P4.png", "P5.png", "P6.png", 
+        "P7.png", "P8.png", "P9.png", "P10.png", "P11.png", "P12.png", 
+        "CC1.png", "CC2.png", "CC3.png", "CC4.png", "CC5.png", "CC6.png", 
+        "CC7.png", "CC8.png", "CC9.png", "CC10.png", "CC11.png", "CC12.png", 
+        "IC1.png", "IC2.png", "IC3.png", "IC4.png", "IC5.png", "IC6.png", 
+        "IC7.png", "IC8.png", "IC9.png", "IC10.png", "IC11.png", "IC12.png"],
+    'true_final_numerator': [31, 28, 21, 71, 31, 49, 67, 41, 33, 43, 23, 51,
+                   29, 41, 89, 49, 29, 37, 19, 25, 43, 37, 19, 73,
+                   29, 41, 89, 49, 29, 37, 19, 25, 43, 37, 19, 73],
+    'true_final_denominator': [20, 15, 20, 12, 24, 24, 9, 20, 14, 12, 18, 28,
+                     4, 21, 36, 16, 18, 30, 10, 21, 14, 16, 24, 12,
+                     4, 21, 36, 16, 18, 30, 10, 21, 14, 16, 24, 12],
+    'HOO_Position': ["Left", "Left", "Left", "Left", "Left", "Left", 
+        "Right", "Right", "Right", "Right", "Right", "Right",
+        "Left", "Left", "Left", "Left", "Left", "Left", 
+        "Right", "Right", "Right", "Right", "Right", "Right",
+        "Left", "Left", "Left", "Left", "Left", "Left", 
+        "Right", "Right", "Right", "Right", "Right", "Right"],
+    'Simplification': ["Yes", "Yes", "Yes", "No", "No", "No", 
+        "Yes", "Yes", "Yes", "No", "No", "No", 
+        "Yes", "Yes", "Yes", "No", "No", "No", 
+        "Yes", "Yes", "Yes", "No", "No", "No", 
+        "Yes", "Yes", "Yes", "No", "No", "No",
+        "Yes", "Yes", "Yes", "No", "No", "No"]
+})
 
-    # Get IDs
-    IDs_path = os.path.join(parent_path, 'Input_files/participant_ids.csv')
-    
-    IDs_df = pd.read_csv(IDs_path)
-    all_IDs = IDs_df['pid'].tolist()
+def read_raw_export(file_path):
+    """Read one raw Pavlovia export"""
+    return pd.read_csv(file_path, encoding='latin-1')  # Use latin-1 encoding to handle special characters
 
-    for filename in os.listdir(input_path):
-        # Skip non-CSV files
-        if not filename.endswith('.csv'):
-            continue
+def extract_participant_fields(df, fields=PARTICIPANT_FIELDS):
+    """
+    Extract the participant-level values defined by fields from a raw export.
+    Each source column's missing values are dropped only once.
+    Raises IndexError if a source column has too few answers.
+    """
+    non_missing = {source: df[source].dropna().to_numpy()
+                   for source in dict.fromkeys(source for _, source, _ in fields)}
+    return {column: non_missing[source][position] for column, source, position in fields}
 
-        file_path = os.path.join(input_path, filename)
-        print(f"\nProcessing file: {filename}")
-        
-        try:
-            df = pd.read_csv(file_path, encoding='latin-1')  # Use latin-1 encoding to handle special characters
-            print(f"Successfully read file, shape: {df.shape}")
-        except Exception as e:
-            print(f"Error reading file {filename}: {str(e)}")
-            continue
-            
-        PID = str(df.at[1,'pid']).strip()  # Add strip() to remove any whitespace
-        
-        if PID not in all_IDs:
-            print(f"PID {PID} not in participant_ids.csv, skipping...")
-            continue
+def get_condition(images):
+    """Get a participant's condition from the images they saw (CC images: Congruent)"""
+    if images.astype(str).str.contains('CC', na=False).any():
+        return "Congruent"
+    return "Incongruent"
 
-        # Assign win sizes values
-        win_height = df['win_height'].dropna().iloc[0]
-        win_width = df['win_width'].dropna().iloc[0]
+def normalize_participant_id(pid):
+    """
+    Participant ID as matched against participant_ids.csv: the text without
+    surrounding whitespace, or None if missing. Used by every stage that
+    compares IDs, so they accept and skip the same participants.
+    """
+    if pd.isna(pid):
+        return None
+    return str(pid).strip() or None
 
-        # Assign condition value
-        if df['Image'].astype(str).str.contains('CC', na=False).any():
-            Condition = "Congruent"  
-        else:
-            Condition = "Incongruent"
+def clean_participant(df, all_IDs):
+    """
+    Clean one participant's raw Pavlovia export in memory.
+    df: the raw export, or its path
+    Returns (PID, trial rows with participant-level columns), or None if the
+    participant is skipped.
+    """
+    df = read_if_path(df, read_raw_export)
+    PID = normalize_participant_id(df.at[1,'pid'])
+    
+    if PID not in all_IDs:
+        print(f"PID {PID} not in participant_ids.csv, skipping...")
+        return
 
-        # Assign math anxiety values
-        MA_EM_1 = df['key_MA.keys'].dropna().iloc[0]
-        MA_EM_2 = df['key_MA.keys'].dropna().iloc[1]
-        MA_EM_3 = df['key_MA.keys'].dropna().iloc[2]
-        MA_EM_4 = df['key_MA.keys'].dropna().iloc[3]
-        MA_WO_1 = df['key_MA.keys'].dropna().iloc[4]
-        MA_WO_2 = df['key_MA.keys'].dropna().iloc[5]
-        MA_WO_3 = df['key_MA.keys'].dropna().iloc[6]
-        MA_WO_4 = df['key_MA.keys'].dropna().iloc[7]
-        MA_EV_1 = df['key_MA.keys'].dropna().iloc[8]
-        MA_EV_2 = df['key_MA.keys'].dropna().iloc[9]
-        MA_EV_3 = df['key_MA.keys'].dropna().iloc[10]
+    # Assign participant-level values (window size, MA, arousal, valence, demo)
+    participant_values = extract_participant_fields(df)
 
-        # Assign pre pretest arousal values and response times
-        arousal_PrePre = df['key_Pretest_Arousal.keys'].dropna().iloc[0]
-        arousal_Time_PrePre = df['key_Pretest_Arousal.rt'].dropna().iloc[0]
+    # Assign condition value
+    images = df['Image'].astype(str)
+    participant_values['Condition'] = get_condition(images)
 
-        # Assign pretest and experimental arousal values and response times
-        arousal_Pretest_3 = df['key_Arousal.keys'].dropna().iloc[0]
-        arousal_Time_Pretest_3 = df['key_Arousal.rt'].dropna().iloc[0]
+    # Search for rows with trials information
+    png_rows = df[images.str.contains('png', na=False)]
+    
+    if len(png_rows) == 0:
+        return  # Skip to next file
         
-        arousal_Pretest_7 = df['key_Arousal.keys'].dropna().iloc[1]
-        arousal_Time_Pretest_7 = df['key_Arousal.rt'].dropna().iloc[1]
+    Image_first = png_rows.index.min()
+    Image_last = png_rows.index.max()
+    
+    # Check if indices are valid integers
+    if not isinstance(Image_first, (int, np.integer)) or not isinstance(Image_last, (int, np.integer)):
+        return  # Skip to next file
 
-        arousal_Pretest_12 = df['key_Arousal.keys'].dropna().iloc[2]
-        arousal_Time_Pretest_12 = df['key_Arousal.rt'].dropna().iloc[2]
-        
-        arousal_Exp_2 = df['key_Arousal.keys'].dropna().iloc[3]
-        arousal_Time_Exp_2 = df['key_Arousal.rt'].dropna().iloc[3]
+    # Make dataframe only for rows with math problems, with student-level variables added to each row
+    Question_df = df.iloc[Image_first:Image_last+1].assign(**participant_values)
+    
+    # Process the data
+    df_noNA = Question_df[Question_df['Image'].notna()]
         
-        arousal_Exp_12 = df['key_Arousal.keys'].dropna().iloc[4]
-        arousal_Time_Exp_12 = df['key_Arousal.rt'].dropna().iloc[4]
-
-        # Assign pre pretest valence values and response times
-        valence_PrePre = df['key_Pretest_Valence.keys'].dropna().iloc[0]
-        valence_Time_PrePre = df['key_Pretest_Valence.rt'].dropna().iloc[0]
+    ### Keep only the specified columns
+    columns_to_keep = TRIAL_COLUMNS + [column for column, _, _ in PARTICIPANT_FIELDS]
+    df_noNA = df_noNA[columns_to_keep].copy()
 
-        # Assign pretest and experimental valence values and response times
-        valence_Pretest_3 = df['key_Valence.keys'].dropna().iloc[0]
-        valence_Time_Pretest_3 = df['key_Valence.rt'].dropna().iloc[0]
-        
-        valence_Pretest_7 = df['key_Valence.keys'].dropna().iloc[1]
-        valence_Time_Pretest_7 = df['key_Valence.rt'].dropna().iloc[1]
+    ### Add trial number (1-based indexing)
+    df_noNA['problem_Order'] = np.arange(1, len(df_noNA) + 1)
+    
+    ### Add true values, HOO position and simplification possibility of each image
+    df_noNA = df_noNA.merge(IMAGE_METADATA, on='Image', how='left')
+    
+    return PID, df_noNA
 
-        valence_Pretest_12 = df['key_Valence.keys'].dropna().iloc[2]
-        valence_Time_Pretest_12 = df['key_Valence.rt'].dropna().iloc[2]
-        
-        valence_Exp_2 = df['key_Valence.keys'].dropna().iloc[3]
-        valence_Time_Exp_2 = df['key_Valence.rt'].dropna().iloc[3]
-        
-        valence_Exp_12 = df['key_Valence.keys'].dropna().iloc[4]
-        valence_Time_Exp_12 = df['key_Valence.rt'].dropna().iloc[4]
+# Returned by clean_participant_file for participants not in participant_ids.csv
+SKIPPED = 'skipped'
 
-        # Assign demographics values
-        age = df['DemoResp'].dropna().iloc[0]
-        gender = df['DemoResp'].dropna().iloc[1]
-        race_ethnicity = df['DemoResp'].dropna().iloc[2]
+def clean_participant_file(filename, input_path, output_path, all_IDs, prefetched=None):
+    """
+    Clean one raw Pavlovia export and save its trial rows to output_path.
+    prefetched: the export read ahead by run_participant_files (read here if None)
+    Returns the saved file's path, SKIPPED if the participant is not in
+    all_IDs, or None if the file could not be cleaned.
+    """
+    # Skip non-CSV files
+    if not filename.endswith('.csv'):
+        return
 
-        # Search for rows with trials information
-        png_rows = df[df['Image'].astype(str).str.contains('png', na=False)]
-        
-        if len(png_rows) == 0:
-            continue  # Skip to next file
-            
-        Image_first = png_rows.index.min()
-        Image_last = png_rows.index.max()
-        
-        # Check if indices are valid integers
-        if not isinstance(Image_first, (int, np.integer)) or not isinstance(Image_last, (int, np.integer)):
-            continue  # Skip to next file
+    file_path = os.path.join(input_path, filename)
+    print(f"\nProcessing file: {filename}")
+    
+    try:
+        with timed_phase('read'):
+            df = prefetched.result() if prefetched is not None else read_raw_export(file_path)
+        print(f"Successfully read file, shape: {df.shape}")
+    except Exception as e:
+        print(f"Error reading file {filename}: {str(e)}")
+        return
 
-        # Make dataframe only for rows with math problems
-        Question_df = df.iloc[Image_first:Image_last+1].copy()
+    try:
+        with timed_phase('clean'):
+            cleaned = clean_participant(df, all_IDs)
+    except Exception as e:
+        print(f"Error cleaning file {filename}: {str(e)}")
+        return
+    if cleaned is None:
+        return SKIPPED
+    PID, df_noNA = cleaned
+    add_count('trials', len(df_noNA))
+    
+    # Print the output path and PID for debugging
+    print(f"Output Path: {output_path}")
+    
+    # Save the processed DataFrame
+    output_file = output_path + '/' + PID + '.csv'
+    with timed_phase('write'):
+        write_behind(df_noNA.to_csv, output_file, index=False)
+    return output_file
 
-        # Add student-level variables to each row
-        Question_df.loc[Image_first:Image_last+1,'win_height'] = win_height
-        Question_df.loc[Image_first:Image_last+1,'win_width'] = win_width
-        Question_df.loc[Image_first:Image_last+1,'Condition'] = Condition
+def read_participant_ids(IDs_path):
+    """Get the set of (normalized) participant IDs to keep"""
+    IDs_df = pd.read_csv(IDs_path, dtype={'pid': str})
+    return set(IDs_df['pid'].map(normalize_participant_id).dropna())
 
-        # Add math anxiety into dataframe
-        Question_df.loc[Image_first:Image_last+1,'MA_EM_1'] = MA_EM_1
-        Question_df.loc[Image_first:Image_last+1,'MA_EM_2'] = MA_EM_2
-        Question_df.loc[Image_first:Image_last+1,'MA_EM_3'] = MA_EM_3
-        Question_df.loc[Image_first:Image_last+1,'MA_EM_4'] = MA_EM_4
-        Question_df.loc[Image_first:Image_last+1,'MA_WO_1'] = MA_WO_1
-        Question_df.loc[Image_first:Image_last+1,'MA_WO_2'] = MA_WO_2
-        Question_df.loc[Image_first:Image_last+1,'MA_WO_3'] = MA_WO_3
-        Question_df.loc[Image_first:Image_last+1,'MA_WO_4'] = MA_WO_4
-        Question_df.loc[Image_first:Image_last+1,'MA_EV_1'] = MA_EV_1
-        Question_df.loc[Image_first:Image_last+1,'MA_EV_2'] = MA_EV_2
-        Question_df.loc[Image_first:Image_last+1,'MA_EV_3'] = MA_EV_3
+def generate_eye_tracking_data(jobs=1, force=False, paths=None, report=None, prefetch=PREFETCH_DEPTH):
+    # Generate gaze dataset 
+    # (prefetch: number of exports read ahead and written behind when jobs is 1)
+    paths = paths or get_pipeline_paths()
+    
+    input_path = paths.raw_data
 
-        # Add arousal and valence data into dataframe
-        Question_df.loc[Image_first:Image_last+1,'arousal_PrePre'] = arousal_PrePre
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_PrePre'] = arousal_Time_PrePre
-        Question_df.loc[Image_first:Image_last+1,'arousal_Pretest_3'] = arousal_Pretest_3
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_Pretest_3'] = arousal_Time_Pretest_3
-        Question_df.loc[Image_first:Image_last+1,'arousal_Pretest_7'] = arousal_Pretest_7
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_Pretest_7'] = arousal_Time_Pretest_7
-        Question_df.loc[Image_first:Image_last+1,'arousal_Pretest_12'] = arousal_Pretest_12
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_Pretest_12'] = arousal_Time_Pretest_12
-        Question_df.loc[Image_first:Image_last+1,'arousal_Exp_2'] = arousal_Exp_2
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_Exp_2'] = arousal_Time_Exp_2
-        Question_df.loc[Image_first:Image_last+1,'arousal_Exp_12'] = arousal_Exp_12
-        Question_df.loc[Image_first:Image_last+1,'arousal_Time_Exp_12'] = arousal_Time_Exp_12
+    output_path = paths.pavlovia_data
 
-        Question_df.loc[Image_first:Image_last+1,'valence_PrePre'] = valence_PrePre
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_PrePre'] = valence_Time_PrePre
-        Question_df.loc[Image_first:Image_last+1,'valence_Pretest_3'] = valence_Pretest_3
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_Pretest_3'] = valence_Time_Pretest_3
-        Question_df.loc[Image_first:Image_last+1,'valence_Pretest_7'] = valence_Pretest_7
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_Pretest_7'] = valence_Time_Pretest_7
-        Question_df.loc[Image_first:Image_last+1,'valence_Pretest_12'] = valence_Pretest_12
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_Pretest_12'] = valence_Time_Pretest_12
-        Question_df.loc[Image_first:Image_last+1,'valence_Exp_2'] = valence_Exp_2
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_Exp_2'] = valence_Time_Exp_2
-        Question_df.loc[Image_first:Image_last+1,'valence_Exp_12'] = valence_Exp_12
-        Question_df.loc[Image_first:Image_last+1,'valence_Time_Exp_12'] = valence_Time_Exp_12
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
 
-        # Add demo into dataframe
-        Question_df.loc[Image_first:Image_last+1,'age'] = age
-        Question_df.loc[Image_first:Image_last+1,'gender'] = gender
-        Question_df.loc[Image_first:Image_last+1,'race_ethnicity'] = race_ethnicity
+    # Get IDs
+    IDs_path = paths.participant_ids
+    
+    all_IDs = read_participant_ids(IDs_path)
 
-        # Create a copy for processing
-        df_noNA = Question_df.copy()
-        
-        # Process the data
-        df_noNA = df_noNA[df_noNA['Image'].notna()]
-        
-        # Define base columns that are always present
-        columns_to_keep = [
-            # Basic Info
-            'pid', 'date', 'OS', 'frameRate',
-            # Trial Data
-            'Image', 'finalNumerator', 'finalDenominator', 'trialElapsedTime', 
-            'TaskGazeArray', 
-            'Condition',
-            # Math Anxiety
-            "MA_EM_1", "MA_EM_2", "MA_EM_3", "MA_EM_4",
-            "MA_WO_1", "MA_WO_2", "MA_WO_3", "MA_WO_4",
-            "MA_EV_1", "MA_EV_2", "MA_EV_3",
-            # Demo
-            "age", "gender", "race_ethnicity",
-            # Window Info
-            'win_height', 'win_width',
-            # Arousal Data
-            'arousal_PrePre', 'arousal_Time_PrePre',
-            'arousal_Pretest_3', 'arousal_Time_Pretest_3',
-            'arousal_Pretest_7', 'arousal_Time_Pretest_7',
-            'arousal_Pretest_12', 'arousal_Time_Pretest_12',
-            'arousal_Exp_2', 'arousal_Time_Exp_2',
-            'arousal_Exp_12', 'arousal_Time_Exp_12',
-            # Valence Data
-            'valence_PrePre', 'valence_Time_PrePre',
-            'valence_Pretest_3', 'valence_Time_Pretest_3',
-            'valence_Pretest_7', 'valence_Time_Pretest_7',
-            'valence_Pretest_12', 'valence_Time_Pretest_12',
-            'valence_Exp_2', 'valence_Time_Exp_2',
-            'valence_Exp_12', 'valence_Time_Exp_12'
-        ]
-            
-        ### Keep only the specified columns
-        df_noNA = df_noNA[columns_to_keep]
+    # Only reprocess files whose content, the IDs list or this code changed
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {
+        'participant_ids': hash_file(IDs_path),
+        'code': code_version(__file__),
+    }
+    all_files = list_participant_files(input_path)
+    files = all_files if force else manifest.stale_files('clean', input_path, all_files, dependencies)
+    print(f"{len(all_files) - len(files)} of {len(all_files)} files are up to date")
 
-        ### Add trial number (1-based indexing)
-        df_noNA['problem_Order'] = np.arange(1, len(df_noNA) + 1)
-        
-        # Create a data frame mapping Image to true numerators and denominators
+    output_files = run_participant_files(
+        clean_participant_file, files, jobs=jobs, report=report,
+        read_file=partial(read_input_file, read_raw_export, input_path), prefetch=prefetch,
+        input_path=input_path, output_path=output_path, all_IDs=all_IDs
+    )
 
-        # Create dictionary for true values
-        true_values = {
-            'Image': ["P1.png", "P2.png", "P3.png", "P4.png", "P5.png", "P6.png", "P7.png", "P8.png", "P9.png", "P10.png", 
-                "P11.png", "P12.png", "CC1.png", "CC2.png", "CC3.png", "CC4.png", "CC5.png", "CC6.png", 
-                "CC7.png", "CC8.png", "CC9.png", "CC10.png", "CC11.png", "CC12.png", 
-                "IC1.png", "IC2.png", "IC3.png", "IC4.png", "IC5.png", "IC6.png", 
-                "IC7.png", "IC8.png", "IC9.png", "IC10.png", "IC11.png", "IC12.png"],
-            'true_final_numerator': [31, 28, 21, 71, 31, 49, 67, 41, 33, 43, 23, 51,
-                           29, 41, 89, 49, 29, 37, 19, 25, 43, 37, 19, 73,
-                           29, 41, 89, 49, 29, 37, 19, 25, 43, 37, 19, 73],
-            'true_final_denominator': [20, 15, 20, 12, 24, 24, 9, 20, 14, 12, 18, 28,
-                             4, 21, 36, 16, 18, 30, 10, 21, 14, 16, 24, 12,
-                             4, 21, 36, 16, 18, 30, 10, 21, 14, 16, 24, 12]
-        }
-        true_values_df = pd.DataFrame(true_values)
-        
-        # Merge with original dataframe
-        df_noNA = df_noNA.merge(true_values_df, on='Image', how='left')
-        
-        def is_numeric(x):
-            try:
-                float(x)
-                return True
-            except ValueError:
-                return False
-        
-        ### Add HOO position column
-        # Create a data frame mapping Image to HOO positions
-        HOO_Positions = {
-            'Image': ["P1.png", "P2.png", "P3.png", "P4.png", "P5.png", "P6.png", 
-                "P7.png", "P8.png", "P9.png", "P10.png", "P11.png", "P12.png", 
-                "CC1.png", "CC2.png", "CC3.png", "CC4.png", "CC5.png", "CC6.png", 
-                "CC7.png", "CC8.png", "CC9.png", "CC10.png", "CC11.png", "CC12.png", 
-                "IC1.png", "IC2.png", "IC3.png", "IC4.png", "IC5.png", "IC6.png", 
-                "IC7.png", "IC8.png", "IC9.png", "IC10.png", "IC11.png", "IC12.png"],
-            'HOO_Position': ["Left", "Left", "Left", "Left", "Left", "Left", 
-                "Right", "Right", "Right", "Right", "Right", "Right",
-                "Left", "Left", "Left", "Left", "Left", "Left", 
-                "Right", "Right", "Right", "Right", "Right", "Right",
-                "Left", "Left", "Left", "Left", "Left", "Left", 
-                "Right", "Right", "Right", "Right", "Right", "Right"]
-        }
-        HOO_Positions = pd.DataFrame(HOO_Positions)
-        
-        # Merge with original dataframe
-        df_noNA = df_noNA.merge(HOO_Positions, on='Image', how='left')
-        
-        ### Add variable showing if problem could be simplified or not
-        # Create a data frame mapping Image to Simplification Possibility
-        Simplifications = {
-            'Image': ["P1.png", "P2.png", "P3.png", "P4.png", "P5.png", "P6.png", 
-                "P7.png", "P8.png", "P9.png", "P10.png", "P11.png", "P12.png", 
-                "CC1.png", "CC2.png", "CC3.png", "CC4.png", "CC5.png", "CC6.png", 
-                "CC7.png", "CC8.png", "CC9.png", "CC10.png", "CC11.png", "CC12.png", 
-                "IC1.png", "IC2.png", "IC3.png", "IC4.png", "IC5.png", "IC6.png", 
-                "IC7.png", "IC8.png", "IC9.png", "IC10.png", "IC11.png", "IC12.png"],
-            'Simplification': ["Yes", "Yes", "Yes", "No", "No", "No", 
-                "Yes", "Yes", "Yes", "No", "No", "No", 
-                "Yes", "Yes", "Yes", "No", "No", "No", 
-                "Yes", "Yes", "Yes", "No", "No", "No", 
-                "Yes", "Yes", "Yes", "No", "No", "No",
-                "Yes", "Yes", "Yes", "No", "No", "No"]
-        }
-        Simplifications = pd.DataFrame(Simplifications)
-        
-        # Merge with original dataframe
-        df_noNA = df_noNA.merge(Simplifications, on='Image', how='left')
-        
-        # Print the output path and PID for debugging
-        print(f"Output Path: {output_path}")
-        
-        # Save the processed DataFrame
-        df_noNA.to_csv(output_path + '/' + PID + '.csv', index=False)
+    # Skipped participants are recorded too, so an unchanged file is not reread
+    for filename, output_file in zip(files, output_files):
+        if output_file == SKIPPED:
+            manifest.record('clean', os.path.join(input_path, filename), dependencies, None, skipped=True)
+        elif output_file is not None:
+            manifest.record('clean', os.path.join(input_path, filename), dependencies, output_file)
+    manifest.forget_missing('clean', all_files)
+    manifest.save()
 
-generate_eye_tracking_data()
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('clean')
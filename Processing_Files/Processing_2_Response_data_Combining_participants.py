@@ -0,0 +1,237 @@
+import os
+import numpy as np
+import pandas as pd
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import read_if_path
+from build_manifest import BuildManifest, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+
+# Columns read from the cleaned trial files (TaskGazeArray is never read)
+INPUT_COLUMNS = ['date', 'Condition', 'Image', 'problem_Order', 'HOO_Position', 'Simplification',
+                 'trialElapsedTime', 'finalNumerator', 'finalDenominator',
+                 'true_final_numerator', 'true_final_denominator']
+
+# Output columns of Math_data.csv and Response_data.csv, as in the committed files
+OUTPUT_COLUMNS = ['pid', 'date', 'Condition', 'Image', 'Correct', 'problem_Order',
+                  'HOO_Position', 'Simplification', 'trialElapsedTime',
+                  'finalNumerator', 'finalDenominator', 'true_final_numerator', 'true_final_denominator']
+
+# Participant files the R script leaves out of Response_data.csv
+EXCLUDED_FILES = ['wpi6172z971436g3640.csv', 'wpi61740524s9759r04.csv',
+                  'wpi61746552e98473o3.csv', 'wpi617m4630v4861669.csv',
+                  'wpi6o1d733879690572.csv', 'wpi6r1745874r291842.csv']
+
+# Answers entered wrongly in the task and corrected by hand:
+# (pid, Image) -> (finalNumerator, finalDenominator), None keeping the entered value
+ANSWER_CORRECTIONS = {
+    ('wpi6174493xg0886649', 'P7.png'): ('67', '9'),
+    ('wpi6174b6550g984996', 'CC8.png'): ('25', None),
+    ('wpi617n3308449928h0', 'CC7.png'): ('38', '20'),
+}
+
+# Answers with more digits than this (once both parts have the same number of
+# decimal places) are not scored, as their products would overflow int64
+MAX_ANSWER_DIGITS = 15
+
+def get_test(images):
+    """Get the test of each image: Pretest (P images) or Experiment (CC and IC)"""
+    return np.where(images.astype(str).str.startswith('P'), 'Pretest', 'Experiment')
+
+def read_trials_file(file_path):
+    """Read the scoring columns of one participant's cleaned trials, with the pid from the file name"""
+    df = pd.read_csv(file_path, usecols=INPUT_COLUMNS,
+                     dtype={'finalNumerator': str, 'finalDenominator': str, 'date': str})
+    df.insert(0, 'pid', os.path.splitext(os.path.basename(file_path))[0])
+    return df
+
+def read_participant_trials(file, input_path):
+    """Read the scoring columns of one participant's cleaned trials, or None if it cannot be read"""
+    try:
+        with timed_phase('read'):
+            df = read_trials_file(os.path.join(input_path, file))
+        add_count('trials', len(df))
+        return df
+    except Exception as e:
+        print(f"Error reading {file}: {e}")
+        return None
+
+def apply_answer_corrections(trials_df, corrections=ANSWER_CORRECTIONS):
+    """Replace the hand-corrected answers of ANSWER_CORRECTIONS"""
+    for (pid, image), values in corrections.items():
+        rows = (trials_df['pid'] == pid) & (trials_df['Image'] == image)
+        for column, value in zip(['finalNumerator', 'finalDenominator'], values):
+            if value is not None:
+                trials_df.loc[rows, column] = value
+    return trials_df
+
+def normalize_answers(answers):
+    """
+    Tidy entered numbers written as text: strip whitespace and trailing
+    decimal zeros ("79.0" becomes "79", "31.50" becomes "31.5"), and give
+    a leading-dot decimal its zero (".5" becomes "0.5").
+    """
+    answers = answers.str.strip()
+    is_decimal = answers.str.fullmatch(r'-?(?:\d+\.\d*|\.\d+)', na=False)
+    answers[is_decimal] = answers[is_decimal].str.replace(r'^(-?)\.', r'\g<1>0.', regex=True) \
+        .str.rstrip('0').str.rstrip('.')
+    return answers
+
+def parse_answers(answers):
+    """
+    Parse entered numbers (text) into exact integers.
+    Returns (digits, decimals, integer_digits, valid): the number without
+    its decimal point as int64, the number of decimal places, the number of
+    digits before the decimal point, and whether the text is a plain number
+    (anything else, e.g. an expression or an empty answer, is not).
+    """
+    answers = normalize_answers(answers.astype('string'))
+    parts = answers.str.extract(r'^(-?)(\d+)(?:\.(\d+))?$')
+    integers = parts[1].fillna('')
+    fractions = parts[2].fillna('')
+    integer_digits = integers.str.len().to_numpy(dtype=np.int64)
+    decimals = fractions.str.len().to_numpy(dtype=np.int64)
+    valid = parts[1].notna().to_numpy(dtype=bool) & (integer_digits + decimals <= MAX_ANSWER_DIGITS)
+
+    digits = np.zeros(len(answers), dtype=np.int64)
+    digits[valid] = (integers[valid] + fractions[valid]).astype(np.int64).to_numpy()
+    digits[valid & (parts[0] == '-').fillna(False).to_numpy(dtype=bool)] *= -1
+    return digits, decimals, integer_digits, valid
+
+def score_answers(numerators, denominators, true_numerators, true_denominators):
+    """
+    Score fraction answers against the true fractions, for all trials at once.
+    An answer is correct if it is an equivalent fraction (n * true_d ==
+    d * true_n, after scaling decimals to integers), so 112/60 is correct
+    for 28/15; answers that are not numbers or have a zero denominator are
+    incorrect. A correct answer is simplified if it is written in lowest
+    terms (integers with gcd 1).
+    Returns (correct, simplified): boolean arrays, simplified being False
+    for incorrect answers.
+    """
+    n, n_decimals, n_integer_digits, n_valid = parse_answers(numerators)
+    d, d_decimals, d_integer_digits, d_valid = parse_answers(denominators)
+
+    # Bring both parts to the same number of decimal places: 31.5/30 -> 315/300
+    decimals = np.maximum(n_decimals, d_decimals)
+    valid = n_valid & d_valid & (np.maximum(n_integer_digits, d_integer_digits) + decimals <= MAX_ANSWER_DIGITS)
+    n = np.where(valid, n * 10 ** np.where(valid, decimals - n_decimals, 0), 0)
+    d = np.where(valid, d * 10 ** np.where(valid, decimals - d_decimals, 0), 0)
+    valid &= d != 0
+
+    true_n = np.asarray(true_numerators, dtype=np.int64)
+    true_d = np.asarray(true_denominators, dtype=np.int64)
+    correct = valid & (n * true_d == d * true_n)
+    simplified = correct & (decimals == 0) & (np.gcd(n, d) == 1)
+    return correct, simplified
+
+def summarize_scores(scores_df):
+    """
+    Summarize the scored trials per participant, condition and test:
+    number of trials, accuracy, number of simplified answers, mean time and
+    mean time of correct trials (trialElapsedTime, in seconds), and the rate
+    correct score (correct answers per second of total time).
+    """
+    scores_df = scores_df.assign(Test=get_test(scores_df['Image']),
+                                 correct_time=scores_df['trialElapsedTime'].where(scores_df['Correct']))
+    summary_df = scores_df.groupby(['pid', 'Condition', 'Test'], sort=True).agg(
+        n_trials=('Correct', 'size'),
+        n_correct=('Correct', 'sum'),
+        n_simplified=('Simplified', 'sum'),
+        total_time=('trialElapsedTime', 'sum'),
+        mean_time=('trialElapsedTime', 'mean'),
+        mean_time_correct=('correct_time', 'mean'),
+    ).reset_index()
+    summary_df['accuracy'] = summary_df['n_correct'] / summary_df['n_trials']
+    summary_df['rcs'] = summary_df['n_correct'] / summary_df['total_time']
+    return summary_df
+
+def score_trials(trials_df):
+    """
+    Score cleaned trials of one or more participants in memory.
+    trials_df: the INPUT_COLUMNS and pid of the trials, or the path of one
+    participant's cleaned trials
+    Returns (scores_df, summary_df): the trials with Correct and Simplified
+    added and the answers normalized, and their summarize_scores summary.
+    """
+    scores_df = apply_answer_corrections(read_if_path(trials_df, read_trials_file).copy())
+    scores_df['finalNumerator'] = normalize_answers(scores_df['finalNumerator'].astype('string'))
+    scores_df['finalDenominator'] = normalize_answers(scores_df['finalDenominator'].astype('string'))
+    scores_df['Correct'], scores_df['Simplified'] = score_answers(
+        scores_df['finalNumerator'], scores_df['finalDenominator'],
+        scores_df['true_final_numerator'], scores_df['true_final_denominator'])
+    return scores_df, summarize_scores(scores_df)
+
+def to_r_logical(values):
+    """Write booleans as R's TRUE/FALSE, as read_csv in the analysis expects"""
+    return np.where(values, 'TRUE', 'FALSE')
+
+def write_scores(scores_df, output_file):
+    """Write scored trials with the committed OUTPUT_COLUMNS, Correct as TRUE/FALSE"""
+    output_df = scores_df[OUTPUT_COLUMNS].copy()
+    output_df['Correct'] = to_r_logical(output_df['Correct'])
+    output_df.to_csv(output_file, index=False)
+
+def score_responses(jobs=1, force=False, paths=None, report=None):
+    """
+    Score the fraction answers of every participant's cleaned trials in one
+    pass over the cohort, replacing Processing_2's per-participant loop.
+    Writes the scored trials (Correct for equivalent fractions) to
+    Output_Files/Math_data.csv, and to Output_Files/Response_data.csv
+    without the R script's EXCLUDED_FILES. Per-participant accuracy, time
+    and simplified-answer summaries by condition and test go to
+    Output_Files/Math_summary.csv.
+    jobs: number of participant files read in parallel
+    force: rescore even if the build manifest says the output is up to date
+    report: a run_report.RunReport to record per-file timings in (optional)
+    """
+    paths = paths or get_pipeline_paths()
+    input_path = paths.pavlovia_data
+    output_file = paths.math_data
+
+    print("\nStarting response scoring...")
+
+    csv_files = list_participant_files(input_path)
+    if not csv_files:
+        print("No CSV files found in the input directory")
+        return
+
+    # The cohort is scored as a whole, so any changed file rescores it
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {'code': code_version(__file__)}
+    if not force and not manifest.stale_files('score', input_path, csv_files, dependencies) \
+            and set(manifest.entries.get('score', {})) == set(csv_files) \
+            and os.path.exists(paths.math_summary) and os.path.exists(paths.response_data):
+        print(f"{os.path.basename(output_file)} is up to date")
+        return
+
+    results = run_participant_files(read_participant_trials, csv_files, jobs=jobs, report=report,
+                                    input_path=input_path)
+    read_files = [file for file, df in zip(csv_files, results) if df is not None]
+    if not read_files:
+        print("No data was successfully processed")
+        return
+
+    with timed_phase('score'):
+        scores_df, summary_df = score_trials(pd.concat([df for df in results if df is not None], ignore_index=True))
+
+    with timed_phase('write'):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        write_scores(scores_df, output_file)
+        write_scores(scores_df[~(scores_df['pid'] + '.csv').isin(EXCLUDED_FILES)], paths.response_data)
+        summary_df.to_csv(paths.math_summary, index=False)
+
+    print(f"Scored {len(scores_df)} trials of {len(read_files)} of {len(csv_files)} participants")
+    condition_df = summary_df.groupby(['Condition', 'Test'])[['accuracy', 'mean_time', 'rcs']].mean()
+    print(condition_df.round(3).to_string())
+    print(f"Saved {os.path.basename(output_file)}, {os.path.basename(paths.response_data)} "
+          f"and {os.path.basename(paths.math_summary)}")
+
+    manifest.entries.pop('score', None)
+    for file in read_files:
+        manifest.record('score', os.path.join(input_path, file), dependencies, output_file)
+    manifest.save()
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('score')
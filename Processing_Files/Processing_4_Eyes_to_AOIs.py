@@ -1,8 +1,21 @@
 import os
+import csv
+import hashlib
+import numpy as np
 import pandas as pd
-import ast
-import traceback
-from pathlib import Path
+from collections import OrderedDict
+from functools import partial
+import gaze_arrays
+from gaze_arrays import decode_gaze_array, resample_gaze, GazeArrayError
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import PREFETCH_DEPTH, read_if_path, write_behind
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+import vocabulary_registry
+import gaze_cache
+from gaze_cache import GazeCache, GazeCacheWriter
+from vocabulary_registry import build_vocabularies, get_aoi_vocabulary, to_categorical, encode_categoricals
 
 def pixels_to_height_units(x, y, screen_width, screen_height):
     """
@@ -86,32 +99,702 @@ def find_aoi_for_point(x, y, aois_df, win_width, win_height, hoo_position):
     except Exception as e:
         raise
 
-def process_gaze_data():
+def build_aoi_bounds(aois_df):
+    """
+    Convert AOI boundaries to height units once per HOO layout.
+    aois_df: AOI coordinates in original screen pixels (3456x2156)
+    Returns a dict with the AOI vocabulary ('categories'), the codes of the
+    two off-AOI labels and, under
+    'layouts', a dict mapping the lower-cased HOO position to the AOI names,
+    their codes in the vocabulary and their left/right/bottom/top bounds in
+    height units, kept in AOIs.csv row order so that the first matching AOI
+    still wins. Each layout also has a fingerprint of its content, used as
+    the transform cache key.
+    """
+    left_units, _ = pixels_to_height_units(
+        aois_df['left_x_min'].astype(float).to_numpy(), 0, 3456, 2156)
+    right_units, _ = pixels_to_height_units(
+        aois_df['right_x_max'].astype(float).to_numpy(), 0, 3456, 2156)
+    _, top_units = pixels_to_height_units(
+        0, aois_df['top_y_min'].astype(float).to_numpy(), 3456, 2156)
+    _, bottom_units = pixels_to_height_units(
+        0, aois_df['bottom_y_max'].astype(float).to_numpy(), 3456, 2156)
+
+    categories = np.array(get_aoi_vocabulary(aois_df), dtype=object)
+    codes = pd.Index(categories).get_indexer(aois_df['AOI'])
+    positions = aois_df['HOO_position'].str.lower()
+    layouts = {}
+    for position in positions.dropna().unique():
+        mask = (positions == position).to_numpy()
+        layout = {
+            'names': aois_df['AOI'].to_numpy(dtype=object)[mask],
+            'codes': codes[mask],
+            'left': left_units[mask],
+            'right': right_units[mask],
+            'bottom': bottom_units[mask],
+            'top': top_units[mask],
+        }
+        fingerprint = hashlib.sha256('\0'.join(map(str, layout['names'])).encode())
+        for side in ['left', 'right', 'bottom', 'top']:
+            fingerprint.update(layout[side].tobytes())
+        layout['fingerprint'] = fingerprint.hexdigest()
+        layouts[position] = layout
+    return {
+        'categories': categories,
+        'outside_aoi': categories.tolist().index('Outside_of_AOIs'),
+        'outside_screen': categories.tolist().index('Outside_of_Screen'),
+        'layouts': layouts,
+    }
+
+def _smallest_pixel(transform, target, guess, strict=False):
+    """
+    Smallest float pixel p with transform(p) >= target (> target if strict),
+    for a non-decreasing transform. Bisects between floats around an
+    algebraic guess, so the result agrees with the transform exactly.
+    NaN targets give NaN.
+    """
+    def reaches(p):
+        value = transform(p)
+        return value > target if strict else value >= target
+
+    finite = np.isfinite(target) & np.isfinite(guess)
+    guess = np.where(finite, guess, 0.0)
+    margin = 1e-6 * (np.abs(guess) + 1)
+    low, high = guess - margin, guess + margin
+    for _ in range(64):
+        bracketed = ~reaches(low) & reaches(high) | ~finite
+        if bracketed.all():
+            break
+        margin = np.where(bracketed, margin, margin * 2)
+        low, high = np.where(bracketed, low, guess - margin), np.where(bracketed, high, guess + margin)
+
+    for _ in range(128):
+        middle = low + (high - low) / 2
+        searching = (middle > low) & (middle < high)
+        if not searching.any():
+            break
+        middle_reaches = reaches(middle)
+        high = np.where(searching & middle_reaches, middle, high)
+        low = np.where(searching & ~middle_reaches, middle, low)
+    return np.where(finite, high, np.nan)
+
+def layout_to_pixels(layout, win_width, win_height):
+    """
+    Map one layout's height-unit AOI bounds into a participant's screen pixels.
+    The pixel bounds are chosen so that x_min <= x <= x_max and
+    y_min <= y <= y_max hold for exactly the pixels whose height-unit
+    coordinates fall inside the AOI, so labels do not change.
+    Returns the names, pixel bounds and grid index of the layout.
+    """
+    half_height = win_height / 2.0
+    x_units = lambda p: pixels_to_height_units(p, 0, win_width, win_height)[0]
+    # Height units decrease as pixel y increases, so search on their negation
+    minus_y_units = lambda p: -pixels_to_height_units(0, p, win_width, win_height)[1]
+
+    # left <= x_units(x) <= right
+    x_min = _smallest_pixel(x_units, layout['left'], layout['left'] * half_height + win_width / 2)
+    x_max = np.nextafter(_smallest_pixel(x_units, layout['right'], layout['right'] * half_height + win_width / 2,
+                                         strict=True), -np.inf)
+    # bottom <= y_units(y) <= top, i.e. -top <= -y_units(y) <= -bottom
+    y_min = _smallest_pixel(minus_y_units, -layout['top'], half_height - layout['top'] * half_height)
+    y_max = np.nextafter(_smallest_pixel(minus_y_units, -layout['bottom'],
+                                         half_height - layout['bottom'] * half_height, strict=True), -np.inf)
+
+    pixel_layout = {'names': layout['names'], 'x_min': x_min, 'x_max': x_max, 'y_min': y_min, 'y_max': y_max}
+    pixel_layout['grid'] = build_aoi_grid(pixel_layout)
+    return pixel_layout
+
+class AOITransformCache:
+    """
+    Bounded LRU cache of AOI layouts mapped into participant screen pixels,
+    keyed by (layout fingerprint, win_width, win_height). Participants share
+    a handful of window sizes, so most trials reuse a cached layout.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.layouts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, layout, win_width, win_height):
+        """Get the layout in pixels for this window size, mapping it on a miss"""
+        key = (layout['fingerprint'], float(win_width), float(win_height))
+        pixel_layout = self.layouts.get(key)
+        if pixel_layout is not None:
+            self.hits += 1
+            self.layouts.move_to_end(key)
+            return pixel_layout
+
+        self.misses += 1
+        pixel_layout = layout_to_pixels(layout, float(win_width), float(win_height))
+        self.layouts[key] = pixel_layout
+        if len(self.layouts) > self.maxsize:
+            self.layouts.popitem(last=False)
+            self.evictions += 1
+        return pixel_layout
+
+    def stats(self):
+        """Get the hit, miss and eviction counts"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.layouts)}
+
+# Transform cache shared by every trial this process classifies
+transform_cache = AOITransformCache()
+
+def _grid_cells(values, origin, cell_size, n_cells):
+    """Grid column (or row) of each coordinate, clamped to the grid"""
+    with np.errstate(invalid='ignore'):
+        cells = np.floor((values - origin) / cell_size)
+    return np.clip(np.nan_to_num(cells, nan=0.0), 0, n_cells - 1).astype(np.int64)
+
+def build_aoi_grid(layout, cells_per_axis=None):
+    """
+    Build a uniform grid over one layout's AOI rectangles for point lookup.
+    Every grid cell lists the AOIs whose rectangle overlaps it, in AOIs.csv
+    row order, so testing a point against its cell's AOIs in that order gives
+    the same first match as testing it against all AOIs.
+    layout: AOI names and x_min/x_max/y_min/y_max bounds
+    cells_per_axis: grid resolution (defaults to about 2 cells per AOI per axis)
+    """
+    n_aois = len(layout['names'])
+    valid = np.isfinite(layout['x_min']) & np.isfinite(layout['x_max']) & \
+        np.isfinite(layout['y_min']) & np.isfinite(layout['y_max'])
+    valid &= (layout['x_min'] <= layout['x_max']) & (layout['y_min'] <= layout['y_max'])
+    if cells_per_axis is None:
+        cells_per_axis = int(min(256, max(1, 2 * np.ceil(np.sqrt(n_aois)))))
+
+    # Grid spans the union of the AOIs; points outside it land in a border cell
+    if valid.any():
+        x0, x1 = layout['x_min'][valid].min(), layout['x_max'][valid].max()
+        y0, y1 = layout['y_min'][valid].min(), layout['y_max'][valid].max()
+    else:
+        x0 = x1 = y0 = y1 = 0.0
+    nx = cells_per_axis if x1 > x0 else 1
+    ny = cells_per_axis if y1 > y0 else 1
+    cell_width = (x1 - x0) / nx if x1 > x0 else 1.0
+    cell_height = (y1 - y0) / ny if y1 > y0 else 1.0
+
+    # The cell range of each rectangle uses the same mapping as the points,
+    # so a point on a rectangle's edge always finds it
+    first_column = _grid_cells(layout['x_min'], x0, cell_width, nx)
+    last_column = _grid_cells(layout['x_max'], x0, cell_width, nx)
+    first_row = _grid_cells(layout['y_min'], y0, cell_height, ny)
+    last_row = _grid_cells(layout['y_max'], y0, cell_height, ny)
+    cells, aois = [], []
+    for aoi in np.flatnonzero(valid):
+        columns = np.arange(first_column[aoi], last_column[aoi] + 1)
+        rows = np.arange(first_row[aoi], last_row[aoi] + 1)
+        covered = (rows[:, None] * nx + columns[None, :]).ravel()
+        cells.append(covered)
+        aois.append(np.full(len(covered), aoi))
+    cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+    aois = np.concatenate(aois) if aois else np.empty(0, dtype=np.int64)
+
+    # Group the candidates by cell, keeping AOIs.csv order within each cell
+    order = np.argsort(cells, kind='stable')
+    counts = np.bincount(cells, minlength=nx * ny)
+    return {
+        'x0': x0, 'y0': y0, 'cell_width': cell_width, 'cell_height': cell_height, 'nx': nx, 'ny': ny,
+        'starts': np.concatenate([[0], np.cumsum(counts)[:-1]]),
+        'counts': counts,
+        'candidates': aois[order],
+    }
+
+def find_aoi_indices(x, y, layout):
+    """
+    Find the first AOI (in AOIs.csv order) containing each point, using the
+    layout's grid.
+    x, y: points in the same space as the layout's bounds
+    Returns the AOI index of every point, or -1 if no AOI contains it.
+    """
+    grid = layout['grid']
+    cells = _grid_cells(y, grid['y0'], grid['cell_height'], grid['ny']) * grid['nx'] + \
+        _grid_cells(x, grid['x0'], grid['cell_width'], grid['nx'])
+    starts = grid['starts'][cells]
+    counts = grid['counts'][cells]
+    found = np.full(len(x), -1, dtype=np.int64)
+
+    # Test the k-th candidate of every still unmatched point, so the first
+    # containing AOI of each cell wins
+    for k in range(int(counts.max()) if len(counts) else 0):
+        pending = np.flatnonzero((found < 0) & (counts > k))
+        if len(pending) == 0:
+            break
+        candidates = grid['candidates'][starts[pending] + k]
+        x_pending = x[pending]
+        y_pending = y[pending]
+        inside = (layout['x_min'][candidates] <= x_pending) & (x_pending <= layout['x_max'][candidates]) & \
+                 (layout['y_min'][candidates] <= y_pending) & (y_pending <= layout['y_max'][candidates])
+        found[pending[inside]] = candidates[inside]
+    return found
+
+def classify_gaze_codes(x, y, aoi_bounds, win_width, win_height, hoo_position):
+    """
+    Vectorized find_aoi_for_point for all gaze points of one trial, giving
+    integer codes into aoi_bounds['categories'] instead of names.
+    x, y: arrays of gaze coordinates in participant's screen pixels
+    aoi_bounds: output of build_aoi_bounds
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    codes = np.full(len(x), aoi_bounds['outside_aoi'], dtype=np.int16)
+
+    # First check which points are within screen boundaries
+    on_screen = (0 <= x) & (x <= win_width) & (0 <= y) & (y <= win_height)
+    codes[~on_screen] = aoi_bounds['outside_screen']
+    if not on_screen.any():
+        return codes
+
+    # Case-insensitive position matching
+    layout = aoi_bounds['layouts'].get(hoo_position.lower())
+    if layout is None or len(layout['names']) == 0:
+        return codes
+
+    # Compare the on-screen points with the AOIs mapped into this window's pixels
+    pixel_layout = transform_cache.get(layout, win_width, win_height)
+    aoi_indices = find_aoi_indices(x[on_screen], y[on_screen], pixel_layout)
+
+    # The first AOI (in AOIs.csv order) containing the point wins
+    in_aoi = np.flatnonzero(on_screen)[aoi_indices >= 0]
+    codes[in_aoi] = layout['codes'][aoi_indices[aoi_indices >= 0]]
+    return codes
+
+def classify_gaze_points(x, y, aoi_bounds, win_width, win_height, hoo_position):
+    """
+    Vectorized find_aoi_for_point for all gaze points of one trial.
+    Returns an object array with the same labels find_aoi_for_point gives.
+    """
+    codes = classify_gaze_codes(x, y, aoi_bounds, win_width, win_height, hoo_position)
+    return aoi_bounds['categories'][codes]
+
+def write_columnar_output(samples_df, trials_df, samples_file, trials_file):
+    """
+    Save the sample-level table and the trial/participant table as Parquet.
+    samples_df: one row per gaze point (pid, trial, time_point, x, y, AOI)
+    trials_df: one row per trial, joined to samples_df on 'trial'
+    """
+    samples_df.to_parquet(samples_file, index=False)
+    trials_df.to_parquet(trials_file, index=False)
+
+def load_labelled_gaze(samples_file, trials_file, trial_columns=None):
+    """
+    Read a columnar AOI_samples file back and attach trial-level columns.
+    trial_columns: trial columns to join onto the samples (all if None)
+    """
+    samples_df = pd.read_parquet(samples_file)
+    trials_df = pd.read_parquet(trials_file, columns=None if trial_columns is None else ['trial'] + list(trial_columns))
+    return samples_df.merge(trials_df, on='trial', how='left')
+
+def label_trials(trials_df, gaze_texts, aoi_bounds, counters, decode=decode_gaze_array, resample_rate=None):
+    """
+    Decode and classify the gaze samples of each trial, one trial at a time.
+    trials_df: trial rows without TaskGazeArray
+    gaze_texts: the trials' TaskGazeArray cells, in the same order
+    counters: point counters, updated in place
+    decode: turns an item of gaze_texts into (time, x, y) arrays, e.g.
+    GazeCache.decode for trial positions (default: decode_gaze_array)
+    resample_rate: interpolate each trial's samples onto a uniform grid of
+    this many samples per second before classifying them (None keeps the
+    recorded samples)
+    Yields (trial position, time points, x, y, AOI codes) for every trial
+    that could be processed; the codes index aoi_bounds['categories'].
+    """
+    for position, ((index, row), gaze_array) in enumerate(zip(trials_df.iterrows(), gaze_texts)):
+        try:
+            # Decode the TaskGazeArray string into time, x and y arrays
+            with timed_phase('parse'):
+                time_points, xs, ys = decode(gaze_array)
+            if resample_rate:
+                with timed_phase('resample'):
+                    time_points, xs, ys = resample_gaze(time_points, xs, ys, resample_rate)
+            
+            # Classify all gaze points of the trial at once
+            with timed_phase('classify'):
+                aois = classify_gaze_codes(
+                    xs, ys,
+                    aoi_bounds,
+                    row['win_width'], row['win_height'],
+                    row['HOO_Position']
+                )
+            
+            add_count('samples', len(aois))
+            counters['points'] += len(aois)
+            counters['outside_aoi'] += int(np.sum(aois == aoi_bounds['outside_aoi']))
+            counters['outside_screen'] += int(np.sum(aois == aoi_bounds['outside_screen']))
+        except GazeArrayError as e:
+            counters['malformed'] += 1
+            print(f"  Malformed TaskGazeArray in row {index} ({row['Image']}): {e}")
+            continue
+        except Exception as e:
+            print(f"  Error processing row {index}: {e}")
+            continue
+        yield position, time_points, xs, ys, aois
+
+def build_sample_table(labelled_trials, aoi_categories):
+    """
+    Create the sample-level table (one row per gaze point) from label_trials
+    output, with AOI as a Categorical over aoi_categories.
+    """
+    labelled_trials = list(labelled_trials)
+    return pd.DataFrame({
+        'trial': np.concatenate([np.full(len(aois), position, dtype=np.int32)
+                                 for position, _, _, _, aois in labelled_trials] or [np.empty(0, dtype=np.int32)]),
+        'time_point': np.concatenate([t for _, t, _, _, _ in labelled_trials] or [np.empty(0)]),
+        'x': np.concatenate([x for _, _, x, _, _ in labelled_trials] or [np.empty(0)]),
+        'y': np.concatenate([y for _, _, _, y, _ in labelled_trials] or [np.empty(0)]),
+        'AOI': pd.Categorical.from_codes(
+            np.concatenate([aois for _, _, _, _, aois in labelled_trials] or [np.empty(0, dtype=np.int16)]),
+            categories=aoi_categories),
+    })
+
+def label_participant(df, aoi_bounds, gaze_texts=None, decode=decode_gaze_array, resample_rate=None):
+    """
+    Label the gaze samples of one participant's trials in memory.
+    df: cleaned trial rows (one Pavlovia_Data file), or the file's path
+    aoi_bounds: build_aoi_bounds' result, or AOIs.csv as a DataFrame or path
+    gaze_texts, decode: the trials' gaze data and how to decode it (see
+    label_trials; default: df's TaskGazeArray cells)
+    resample_rate: resample each trial to this rate (see label_trials)
+    Returns (samples_df, trials_df, counters): the sample-level table
+    (trial, time_point, x, y, AOI), the trial rows without TaskGazeArray and
+    the point counters.
+    """
+    counters = {'points': 0, 'outside_aoi': 0, 'outside_screen': 0, 'malformed': 0}
+    
+    df = read_if_path(df, pd.read_csv)
+    if not isinstance(aoi_bounds, dict):
+        aoi_bounds = build_aoi_bounds(read_if_path(aoi_bounds, read_aois))
+    if gaze_texts is None:
+        gaze_texts = df['TaskGazeArray']
+    
+    # Drop the TaskGazeArray column as it's no longer needed
+    trials_df = df.drop(columns=['TaskGazeArray'], errors='ignore')
+    
+    samples_df = build_sample_table(label_trials(trials_df, gaze_texts, aoi_bounds, counters, decode,
+                                                 resample_rate),
+                                    aoi_bounds['categories'])
+    return samples_df, trials_df, counters
+
+class LabelledBatchWriter:
+    """
+    Append batches of labelled samples to one participant's output file, in
+    the same layout process_gaze_data writes in batch mode.
+    """
+
+    def __init__(self, output_format, output_file, trials_df, vocabularies, pid=None):
+        self.output_format = output_format
+        self.output_file = output_file
+        self.trials_df = trials_df
+        self.pid = pid
+        self.vocabularies = vocabularies
+        self.parquet_writer = None
+        self.rows_written = 0
+        self.float_time_points = False
+
+    def write(self, samples_df):
+        """Append one batch of samples"""
+        with timed_phase('write'):
+            self._write(samples_df)
+        self.rows_written += len(samples_df)
+
+    def _write(self, samples_df):
+        if self.output_format == 'csv':
+            labelled_df = build_labelled_table(samples_df, self.trials_df)
+            # Batch mode writes time points as integers only if every one in the file is whole
+            if labelled_df['time_point'].dtype.kind == 'f' and not self.float_time_points:
+                self.float_time_points = True
+                if self.rows_written:
+                    self._rewrite_time_points_as_floats()
+            if self.float_time_points:
+                labelled_df['time_point'] = labelled_df['time_point'].astype(np.float64)
+            labelled_df.to_csv(self.output_file, index=False, mode='w' if self.rows_written == 0 else 'a',
+                               header=self.rows_written == 0)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            samples_df, _ = build_columnar_tables(self.pid, samples_df, self.trials_df.iloc[:0], self.vocabularies)
+            table = pa.Table.from_pandas(samples_df, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.output_file, table.schema)
+            self.parquet_writer.write_table(table)
+
+    def _rewrite_time_points_as_floats(self):
+        """Rewrite the whole time points already written in the CSV as floats"""
+        column = len(self.trials_df.columns)
+        temporary_file = self.output_file + '.tmp'
+        with open(self.output_file, newline='') as source, open(temporary_file, 'w', newline='') as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target, lineterminator=os.linesep)
+            writer.writerow(next(reader))
+            for row in reader:
+                row[column] = str(np.float64(row[column]))
+                writer.writerow(row)
+        os.replace(temporary_file, self.output_file)
+
+    def close(self):
+        """Finish the file, writing an empty table if no samples were written"""
+        if self.output_format == 'csv':
+            if self.rows_written == 0:
+                self.write(build_sample_table([], self.vocabularies['AOI']))
+        else:
+            if self.parquet_writer is None:
+                self.write(build_sample_table([], self.vocabularies['AOI']))
+            self.parquet_writer.close()
+
+def read_participant_gaze(input_file, cache_dir=None, streaming=False):
+    """
+    Get one Pavlovia_Data file's trial rows and gaze data for label_trials,
+    from its gaze cache when that is up to date.
+    cache_dir: the file's GazeCache directory (None to always parse the text)
+    streaming: read the gaze text one trial at a time
+    Returns (trials_df, gaze_texts, decode, cache_writer); cache_writer is
+    the GazeCacheWriter filled by decode, to be closed after labelling, or
+    None when the cache is used or disabled.
+    """
+    with timed_phase('read'):
+        cache = GazeCache.open(cache_dir, input_file) if cache_dir else None
+    if cache is not None:
+        add_count('gaze_cache_files', 1)
+        return cache.trials(), range(cache.n_trials), cache.decode, None
+    
+    with timed_phase('read'):
+        if streaming:
+            # Trial-level columns are small; gaze arrays are read one trial at a time
+            trials_df = pd.read_csv(input_file, usecols=lambda column: column != 'TaskGazeArray')
+            gaze_texts = (gaze_array
+                           for chunk in pd.read_csv(input_file, usecols=['TaskGazeArray'], chunksize=1)
+                           for gaze_array in chunk['TaskGazeArray'])
+        else:
+            df = pd.read_csv(input_file)
+            trials_df = df.drop('TaskGazeArray', axis=1)
+            gaze_texts = df['TaskGazeArray']
+    
+    if not cache_dir:
+        return trials_df, gaze_texts, decode_gaze_array, None
+    cache_writer = GazeCacheWriter(cache_dir, input_file, trials_df)
+    return trials_df, gaze_texts, cache_writer.decode, cache_writer
+
+def print_loaded(trials_df, cache_dir, cache_writer):
+    """Report what read_participant_gaze loaded (printed by the caller, as reads may run ahead)"""
+    source = " from the gaze cache" if cache_dir and cache_writer is None else ""
+    print(f"  Loaded {len(trials_df)} rows{source}")
+
+def read_participant_gaze_file(file, input_path, cache_path=None):
+    """read_participant_gaze for a file of input_path, with its cache in cache_path (run_participant_files read_file)"""
+    cache_dir = os.path.join(cache_path, os.path.splitext(file)[0]) if cache_path else None
+    return read_participant_gaze(os.path.join(input_path, file), cache_dir)
+
+def stream_label_participant_file(input_file, output_file, trials_file, pid,
+                                  aoi_bounds, vocabularies, output_format, chunk_size, cache_dir=None,
+                                  resample_rate=None):
+    """
+    Label one participant file while keeping memory bounded by chunk_size.
+    Trials are read and classified one at a time, and samples are written
+    in batches of at least chunk_size points; the output is identical to
+    batch mode.
+    cache_dir: the file's GazeCache directory (None to always parse the text)
+    resample_rate: resample each trial to this rate (see label_trials)
+    Returns the point counters.
+    """
+    counters = {'points': 0, 'outside_aoi': 0, 'outside_screen': 0, 'malformed': 0}
+    
+    trials_df, gaze_texts, decode, cache_writer = read_participant_gaze(input_file, cache_dir, streaming=True)
+    print_loaded(trials_df, cache_dir, cache_writer)
+    
+    if output_format == 'parquet':
+        _, columnar_trials_df = build_columnar_tables(pid, build_sample_table([], vocabularies['AOI']),
+                                                      trials_df, vocabularies)
+        columnar_trials_df.to_parquet(trials_file, index=False)
+    
+    writer = LabelledBatchWriter(output_format, output_file, trials_df, vocabularies, pid)
+    batch = []
+    batch_points = 0
+    for labelled_trial in label_trials(trials_df, gaze_texts, aoi_bounds, counters, decode, resample_rate):
+        batch.append(labelled_trial)
+        batch_points += len(labelled_trial[-1])
+        if batch_points >= chunk_size:
+            writer.write(build_sample_table(batch, vocabularies['AOI']))
+            batch = []
+            batch_points = 0
+    if batch:
+        writer.write(build_sample_table(batch, vocabularies['AOI']))
+    writer.close()
+    if cache_writer is not None:
+        cache_writer.close()
+    return counters
+
+def build_labelled_table(samples_df, trials_df, trial_columns=None):
+    """
+    Build the denormalized AOI_hit table: trial columns repeated for every
+    gaze point, followed by time_point, x, y and AOI.
+    Whole-number time points are kept as integers, as in the gaze text.
+    trial_columns: trial columns to keep (all if None)
+    """
+    if trial_columns is not None:
+        trials_df = trials_df[list(trial_columns)]
+    processed_df = trials_df.iloc[samples_df['trial']].reset_index(drop=True)
+    for column in ['time_point', 'x', 'y', 'AOI']:
+        processed_df[column] = samples_df[column].array
+    time_points = processed_df['time_point'].to_numpy()
+    if np.all(np.mod(time_points, 1) == 0):
+        processed_df['time_point'] = time_points.astype(np.int64)
+    return processed_df
+
+def build_columnar_tables(pid, samples_df, trials_df, vocabularies):
+    """
+    Add the pid and trial index used by the Parquet output, and encode AOI,
+    Image, HOO_Position and Condition over the shared vocabularies.
+    """
+    samples_df = samples_df.copy()
+    samples_df.insert(0, 'pid', pd.Categorical([pid] * len(samples_df)))
+    samples_df['AOI'] = to_categorical(samples_df['AOI'], vocabularies['AOI'])
+    trials_df = encode_categoricals(trials_df, vocabularies)
+    trials_df.insert(0, 'trial', np.arange(len(trials_df), dtype=np.int32))
+    return samples_df, trials_df
+
+def label_participant_file(file, input_path, output_path, samples_path, trials_path,
+                           aoi_bounds, vocabularies, output_format, chunk_size=None, cache_path=None,
+                           resample_rate=None, prefetched=None):
+    """
+    Label the gaze samples of one participant file and save the result.
+    chunk_size: if set, stream the file in batches of this many samples
+    cache_path: directory of the gaze caches (None to always parse the text)
+    resample_rate: resample each trial to this rate (see label_trials)
+    prefetched: read_participant_gaze_file's result read ahead by
+    run_participant_files (read here if None; not used when streaming)
+    Returns the file's counters, with 'processed' False if the file failed.
+    """
+    counters = {'processed': False, 'points': 0, 'outside_aoi': 0, 'outside_screen': 0, 'malformed': 0,
+                'output': None, 'cache_hits': 0, 'cache_misses': 0}
+    cache_stats = transform_cache.stats()
+    try:
+        input_file = os.path.join(input_path, file)
+        output_file = os.path.join(output_path, file)
+        
+        print(f"\nProcessing file: {file}")
+        
+        pid = os.path.splitext(file)[0]
+        if output_format == 'parquet':
+            output_file = os.path.join(samples_path, pid + '.parquet')
+        trials_file = os.path.join(trials_path, pid + '.parquet')
+        cache_dir = os.path.join(cache_path, pid) if cache_path else None
+        
+        if chunk_size:
+            # Stream the file in batches of at least chunk_size samples
+            file_counters = stream_label_participant_file(
+                input_file, output_file, trials_file, pid,
+                aoi_bounds, vocabularies, output_format, chunk_size, cache_dir, resample_rate
+            )
+        else:
+            # Read the trials and their gaze data, from the gaze cache if possible
+            if prefetched is not None:
+                trials_df, gaze_texts, decode, cache_writer = prefetched.result()
+            else:
+                trials_df, gaze_texts, decode, cache_writer = read_participant_gaze(input_file, cache_dir)
+            print_loaded(trials_df, cache_dir, cache_writer)
+            
+            samples_df, trials_df, file_counters = label_participant(trials_df, aoi_bounds, gaze_texts, decode,
+                                                                     resample_rate)
+            if cache_writer is not None:
+                cache_writer.close()
+            
+            with timed_phase('write'):
+                if output_format == 'csv':
+                    # Save processed data
+                    write_behind(build_labelled_table(samples_df, trials_df).to_csv, output_file, index=False)
+                else:
+                    samples_df, trials_df = build_columnar_tables(pid, samples_df, trials_df, vocabularies)
+                    write_behind(write_columnar_output, samples_df, trials_df, output_file, trials_file)
+        
+        counters.update(file_counters, processed=True, output=output_file,
+                        cache_hits=transform_cache.hits - cache_stats['hits'],
+                        cache_misses=transform_cache.misses - cache_stats['misses'])
+        
+        print(f"  Processed {file_counters['points']} points:")
+        print(f"    - {file_counters['outside_aoi']} inside screen but outside AOIs")
+        print(f"    - {file_counters['outside_screen']} outside screen")
+        if file_counters['malformed']:
+            print(f"  Skipped {file_counters['malformed']} trials with malformed TaskGazeArray")
+        print(f"  Saved to {os.path.basename(output_file)}")
+        
+    except Exception as e:
+        print(f"  Error processing file {file}: {e}")
+    return counters
+
+def read_aois(aois_path):
+    """Read AOIs.csv, stripping whitespace from the column names"""
+    aois_df = pd.read_csv(aois_path)
+    aois_df.columns = aois_df.columns.str.strip()
+    return aois_df
+
+def process_gaze_data(output_format='csv', jobs=1, force=False, paths=None, chunk_size=None, report=None,
+                      use_gaze_cache=True, resample_rate=None, prefetch=PREFETCH_DEPTH):
+    """
+    Label every gaze sample of every participant with its AOI.
+    output_format: 'csv' writes one denormalized file per participant to
+    Processing_files/AOI_hit; 'parquet' writes a typed sample table to
+    Processing_files/AOI_samples and the trial table to
+    Processing_files/AOI_trials.
+    jobs: number of participant files processed in parallel
+    force: reprocess files even if the build manifest says they are up to date
+    chunk_size: stream each file in batches of this many samples, keeping
+    memory bounded on long recordings (None processes whole files)
+    report: a run_report.RunReport to record per-file timings in (optional)
+    use_gaze_cache: keep the decoded gaze samples in Processing_files/Gaze_Cache
+    and map them from there when relabelling, instead of parsing the text
+    resample_rate: interpolate every trial's samples onto a uniform grid of
+    this many samples per second (e.g. 30) before labelling, so sample
+    counts are comparable across participants whatever their webcam rate
+    prefetch: number of files read ahead and written behind while one is
+    labelled, when jobs is 1 and files are not streamed (0 to not overlap)
+    """
     # Set up paths
-    parent_path = str(Path().resolve())
-    input_path = os.path.join(parent_path, 'Processing_files/Pavlovia_Data')
-    output_path = os.path.join(parent_path, 'Processing_files/AOI_hit')
-    aois_path = os.path.join(parent_path, 'Input_files/AOIs.csv')
+    paths = paths or get_pipeline_paths()
+    input_path = paths.pavlovia_data
+    output_path = paths.aoi_hit
+    samples_path = paths.aoi_samples
+    trials_path = paths.aoi_trials
+    aois_path = paths.aois
     
     print("\nStarting gaze data processing...")
     
-    # Create output directory if it doesn't exist
-    os.makedirs(output_path, exist_ok=True)
+    if output_format not in ('csv', 'parquet'):
+        print(f"Unknown output format: {output_format}")
+        return
+    
+    # Create output directories if they don't exist
+    if output_format == 'csv':
+        os.makedirs(output_path, exist_ok=True)
+    else:
+        os.makedirs(samples_path, exist_ok=True)
+        os.makedirs(trials_path, exist_ok=True)
     
     # Read AOIs data
     try:
-        aois_df = pd.read_csv(aois_path)
-        aois_df.columns = aois_df.columns.str.strip()
+        aois_df = read_aois(aois_path)
+        aoi_bounds = build_aoi_bounds(aois_df)
+        vocabularies = build_vocabularies(aois_df)
         print(f"Successfully loaded AOIs file with {len(aois_df)} AOIs")
     except Exception as e:
         print(f"Error reading AOIs file: {e}")
         return
         
     # Get list of CSV files
-    csv_files = [f for f in os.listdir(input_path) if f.endswith('.csv') and f not in output_path] 
+    all_files = list_participant_files(input_path)
+    
+    # Only reprocess files whose content, AOIs.csv or this code changed
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {
+        'aois': hash_file(aois_path),
+        'output_format': output_format,
+        'resample_rate': resample_rate,
+        'code': code_version(__file__, gaze_arrays.__file__, vocabulary_registry.__file__, gaze_cache.__file__),
+    }
+    csv_files = all_files if force else manifest.stale_files('label', input_path, all_files, dependencies)
 
     total_files = len(csv_files)
-    print(f"\nFound {total_files} files to process")
+    print(f"\nFound {total_files} files to process ({len(all_files) - total_files} up to date)")
     
     # Initialize counters
     processed_files = 0
@@ -119,88 +802,51 @@ def process_gaze_data():
     total_points_processed = 0
     points_outside_aoi = 0
     points_outside_screen = 0
+    malformed_trials = 0
+    cache_hits = 0
+    cache_misses = 0
     
     # Process each file
-    for file in csv_files:  # Process all files
-        try:
-            input_file = os.path.join(input_path, file)
-            output_file = os.path.join(output_path, file)
-            
-            print(f"\nProcessing file: {file}")
-            
-            # Read input CSV
-            df = pd.read_csv(input_file)
-            print(f"  Loaded {len(df)} rows")
-            
-            # Process each row
-            processed_rows = []
-            file_points = 0
-            file_outside_aoi = 0
-            file_outside_screen = 0
-            
-            for _, row in df.iterrows():
-                try:
-                    # Clean and parse the TaskGazeArray string
-                    gaze_array_str = str(row['TaskGazeArray']).strip('"')  # Convert to string and remove outer quotes
-                    gaze_points = ast.literal_eval(gaze_array_str)
-                    
-                    # Process each gaze point
-                    for time_point, x, y in gaze_points:
-                        new_row = row.copy()
-                        new_row['time_point'] = time_point
-                        new_row['x'] = x
-                        new_row['y'] = y
-                        aoi = find_aoi_for_point(
-                            x, y, 
-                            aois_df, 
-                            row['win_width'], row['win_height'],
-                            row['HOO_Position']
-                        )
-                        new_row['AOI'] = aoi
-                        processed_rows.append(new_row)
-                        
-                        file_points += 1
-                        if aoi == "Outside_of_AOIs":
-                            file_outside_aoi += 1
-                        elif aoi == "Outside_of_Screen":
-                            file_outside_screen += 1
-                except Exception as e:
-                    print(f"  Error processing row: {e}")
-                    continue
-            
-            # Create processed dataframe
-            processed_df = pd.DataFrame(processed_rows)
-            
-            # Drop the TaskGazeArray column as it's no longer needed
-            processed_df = processed_df.drop('TaskGazeArray', axis=1)
-            
-            # Save processed data
-            processed_df.to_csv(output_file, index=False)
-            
-            # Update counters
-            processed_files += 1
-            total_points_processed += file_points
-            points_outside_aoi += file_outside_aoi
-            points_outside_screen += file_outside_screen
-            
-            print(f"  Processed {file_points} points:")
-            print(f"    - {file_outside_aoi} inside screen but outside AOIs")
-            print(f"    - {file_outside_screen} outside screen")
-            print(f"  Saved to {os.path.basename(output_file)}")
-            
-        except Exception as e:
+    cache_path = paths.gaze_cache if use_gaze_cache else None
+    read_file = None if chunk_size else partial(read_participant_gaze_file, input_path=input_path,
+                                                cache_path=cache_path)
+    results = run_participant_files(
+        label_participant_file, csv_files, jobs=jobs, report=report, read_file=read_file, prefetch=prefetch,
+        input_path=input_path, output_path=output_path,
+        samples_path=samples_path, trials_path=trials_path,
+        aoi_bounds=aoi_bounds, vocabularies=vocabularies,
+        output_format=output_format, chunk_size=chunk_size,
+        cache_path=cache_path, resample_rate=resample_rate
+    )
+    
+    # Update counters
+    for file, counters in zip(csv_files, results):
+        if not counters['processed']:
             failed_files += 1
-            print(f"  Error processing file: {e}")
             continue
+        manifest.record('label', os.path.join(input_path, file), dependencies, counters['output'])
+        processed_files += 1
+        total_points_processed += counters['points']
+        points_outside_aoi += counters['outside_aoi']
+        points_outside_screen += counters['outside_screen']
+        malformed_trials += counters['malformed']
+        cache_hits += counters['cache_hits']
+        cache_misses += counters['cache_misses']
+    manifest.forget_missing('label', all_files)
+    manifest.save()
     
     # Print summary
     print("\n=== Processing Summary ===")
     print(f"Total files processed: {processed_files}/{total_files}")
     print(f"Failed files: {failed_files}")
     print(f"Total points processed: {total_points_processed}")
-    print(f"Points inside screen but outside AOIs: {points_outside_aoi} ({points_outside_aoi/total_points_processed*100:.1f}%)")
-    print(f"Points outside screen: {points_outside_screen} ({points_outside_screen/total_points_processed*100:.1f}%)")
+    print(f"Points inside screen but outside AOIs: {points_outside_aoi} ({points_outside_aoi/max(total_points_processed, 1)*100:.1f}%)")
+    print(f"Points outside screen: {points_outside_screen} ({points_outside_screen/max(total_points_processed, 1)*100:.1f}%)")
+    print(f"Trials with malformed TaskGazeArray: {malformed_trials}")
+    print(f"AOI transform cache: {cache_hits} hits, {cache_misses} misses "
+          f"({cache_hits/max(cache_hits + cache_misses, 1)*100:.1f}% hit rate)")
     print("=========================")
 
 if __name__ == "__main__":
-    process_gaze_data()
\ No newline at end of file
+    from pipeline_cli import run_script
+    run_script('label')
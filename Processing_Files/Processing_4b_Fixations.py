@@ -0,0 +1,303 @@
+import os
+from functools import partial
+import numpy as np
+import pandas as pd
+from Processing_4_Eyes_to_AOIs import pixels_to_height_units, load_labelled_gaze
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import read_if_path
+from build_manifest import BuildManifest, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+
+# Default event detection thresholds. Webcam gaze has no viewing distance, so
+# space is measured in PsychoPy height units (screen height = 2) and time in
+# the milliseconds of TaskGazeArray.
+VELOCITY_THRESHOLD = 2.0     # I-VT: height units per second
+DISPERSION_THRESHOLD = 0.1   # I-DT: (max x - min x) + (max y - min y) in height units
+MIN_FIXATION_DURATION = 100  # ms
+
+FIXATION_COLUMNS = ['fixation', 'start_time', 'end_time', 'duration', 'x', 'y', 'n_samples', 'AOI']
+
+# Trial columns needed to detect fixations from the labelled samples
+TRIAL_COLUMNS = ['Image', 'HOO_Position', 'win_width', 'win_height']
+
+def detect_fixations_ivt(group_ids, time_points, x, y, velocity_threshold=VELOCITY_THRESHOLD,
+                         min_duration=MIN_FIXATION_DURATION):
+    """
+    Velocity-threshold (I-VT) fixation detection over many trials at once.
+    Inputs are sorted by group, then time. A sample belongs to a fixation if
+    the speed from the previous sample of its group is below the threshold
+    (the first sample of a group uses the speed to the next one).
+    Returns (starts, ends): sample index ranges [start, end) of the fixations
+    lasting at least min_duration ms.
+    """
+    n = len(time_points)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    same_group = group_ids[1:] == group_ids[:-1]
+    distance = np.hypot(np.diff(x), np.diff(y))
+    elapsed = np.diff(time_points) / 1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(distance == 0, 0.0, distance / elapsed)
+    # Samples with tied time points only count as still if they did not move
+    speed = np.where(elapsed > 0, speed, np.where(distance == 0, 0.0, np.inf))
+
+    speed_in = np.concatenate([[np.nan], np.where(same_group, speed, np.nan)])
+    speed_out = np.concatenate([np.where(same_group, speed, np.nan), [np.nan]])
+    speed_in = np.where(np.isnan(speed_in), speed_out, speed_in)
+    is_fixation = speed_in < velocity_threshold
+
+    # Runs of fixation samples within a group
+    continues = np.concatenate([[False], is_fixation[:-1] & is_fixation[1:] & same_group])
+    starts = np.flatnonzero(is_fixation & ~continues)
+    ends = np.flatnonzero(is_fixation & ~np.concatenate([continues[1:], [False]])) + 1
+
+    long_enough = time_points[ends - 1] - time_points[starts] >= min_duration
+    return starts[long_enough], ends[long_enough]
+
+def _range_extremes(values):
+    """
+    Sparse tables of values' maxima and minima: level k holds the max/min
+    over the 2**k samples starting at each position.
+    """
+    maxima, minima = [values], [values]
+    width = 1
+    while 2 * width <= len(values):
+        maxima.append(np.maximum(maxima[-1][:-width], maxima[-1][width:]))
+        minima.append(np.minimum(minima[-1][:-width], minima[-1][width:]))
+        width *= 2
+    return maxima, minima
+
+def _window_dispersion(x_tables, y_tables, firsts, lasts):
+    """(max x - min x) + (max y - min y) over the sample windows [firsts, lasts]"""
+    levels = np.frexp(lasts - firsts + 1)[1] - 1
+    dispersion = np.empty(len(firsts))
+    for level in np.unique(levels):
+        at = np.flatnonzero(levels == level)
+        first, second = firsts[at], lasts[at] - (1 << int(level)) + 1
+        (x_max, x_min), (y_max, y_min) = [
+            (np.maximum(maxima[level][first], maxima[level][second]),
+             np.minimum(minima[level][first], minima[level][second])) for maxima, minima in (x_tables, y_tables)]
+        dispersion[at] = x_max - x_min + y_max - y_min
+    return dispersion
+
+def _idt_trial(time_points, x, y, dispersion_threshold, min_duration):
+    """
+    I-DT fixation detection for one trial's sorted samples.
+    The widest window within the dispersion threshold is found for every
+    start sample at once, by a binary search over range minima and maxima;
+    only the walk from one fixation to the next is a loop, so it runs once
+    per fixation rather than once per sample.
+    """
+    n = len(time_points)
+    if n == 0:
+        return [], []
+    positions = np.arange(n)
+
+    # Smallest window starting at each sample that spans min_duration
+    last = np.searchsorted(time_points, time_points + min_duration)
+
+    # Last sample each window can grow to before its dispersion exceeds the threshold
+    x_tables, y_tables = _range_extremes(x), _range_extremes(y)
+    low, high = positions.copy(), np.full(n, n - 1)
+    while np.any(low < high):
+        middle = (low + high + 1) // 2
+        fits = ~(_window_dispersion(x_tables, y_tables, positions, middle) > dispersion_threshold)
+        low = np.where(fits, middle, low)
+        high = np.where(fits, high, middle - 1)
+    ends = low + 1
+
+    # A fixation starts wherever the min_duration window fits; after one,
+    # the search resumes at its end
+    is_start = (last < n) & (ends > last)
+    next_start = np.append(np.minimum.accumulate(np.where(is_start, positions, n)[::-1])[::-1], n)
+    starts, stops = [], []
+    i = next_start[0]
+    while i < n:
+        starts.append(i)
+        stops.append(ends[i])
+        i = next_start[ends[i]]
+    return starts, stops
+
+def detect_fixations_idt(group_ids, time_points, x, y, dispersion_threshold=DISPERSION_THRESHOLD,
+                         min_duration=MIN_FIXATION_DURATION):
+    """
+    Dispersion-threshold (I-DT) fixation detection. Inputs are sorted by
+    group, then time; windows never cross a group boundary.
+    Returns (starts, ends): sample index ranges [start, end) of the fixations.
+    """
+    group_starts = np.flatnonzero(np.concatenate([[True], group_ids[1:] != group_ids[:-1]]))
+    group_ends = np.append(group_starts[1:], len(group_ids))
+
+    starts, ends = [], []
+    for group_start, group_end in zip(group_starts, group_ends):
+        trial = slice(group_start, group_end)
+        trial_starts, trial_ends = _idt_trial(time_points[trial], x[trial], y[trial],
+                                              dispersion_threshold, min_duration)
+        starts += [group_start + start for start in trial_starts]
+        ends += [group_start + end for end in trial_ends]
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def detect_fixations(df, method='ivt', group_columns=('Image',), velocity_threshold=VELOCITY_THRESHOLD,
+                     dispersion_threshold=DISPERSION_THRESHOLD, min_duration=MIN_FIXATION_DURATION):
+    """
+    Detect fixations in AOI-labelled gaze samples.
+
+    Args:
+        df: labelled samples with the group columns, HOO_Position, win_width,
+            win_height, time_point, x, y and AOI, or an AOI_hit CSV file's path
+        method: 'ivt' (velocity threshold) or 'idt' (dispersion threshold)
+        group_columns: Columns identifying one image viewing
+
+    Returns:
+        DataFrame with one row per fixation: the group columns, HOO_Position,
+        fixation (1-based order within the group), start_time, end_time,
+        duration (ms), centroid x and y (height units), n_samples and the AOI
+        most of its samples fall in
+    """
+    group_columns = list(group_columns)
+    output_columns = group_columns + ['HOO_Position'] + FIXATION_COLUMNS
+
+    df = read_if_path(df, partial(read_gaze_for_fixations, input_format='csv', trials_path=None))
+    df = df.dropna(subset=group_columns + ['time_point'])
+    if len(df) == 0:
+        return pd.DataFrame(columns=output_columns)
+
+    # Sort by group, then chronologically within each group
+    group_ids = df.groupby(group_columns, sort=True, observed=True).ngroup().to_numpy()
+    time_points = df['time_point'].to_numpy(dtype=float)
+    order = np.lexsort((time_points, group_ids))
+    group_ids = group_ids[order]
+    time_points = time_points[order]
+    x, y = pixels_to_height_units(df['x'].to_numpy(dtype=float)[order], df['y'].to_numpy(dtype=float)[order],
+                                  df['win_width'].to_numpy(dtype=float)[order],
+                                  df['win_height'].to_numpy(dtype=float)[order])
+
+    if method == 'ivt':
+        starts, ends = detect_fixations_ivt(group_ids, time_points, x, y, velocity_threshold, min_duration)
+    elif method == 'idt':
+        starts, ends = detect_fixations_idt(group_ids, time_points, x, y, dispersion_threshold, min_duration)
+    else:
+        raise ValueError(f"Unknown fixation detection method: {method}")
+    if len(starts) == 0:
+        return pd.DataFrame(columns=output_columns)
+
+    # Sample positions of every fixation, concatenated
+    lengths = ends - starts
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    members = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    fixation_ids = np.repeat(np.arange(len(starts)), lengths)
+
+    # Majority AOI of each fixation (first AOI code wins ties)
+    codes, aoi_names = df['AOI'].iloc[order[members]].factorize()
+    aoi_counts = np.bincount(fixation_ids * len(aoi_names) + codes,
+                             minlength=len(starts) * len(aoi_names)).reshape(len(starts), len(aoi_names))
+
+    first_rows = df.iloc[order[starts]]
+    fixation_groups = group_ids[starts]
+    is_first = np.concatenate([[True], fixation_groups[1:] != fixation_groups[:-1]])
+    first_of_group = np.maximum.accumulate(np.where(is_first, np.arange(len(starts)), 0))
+
+    result = {column: first_rows[column].to_numpy() for column in group_columns}
+    result['HOO_Position'] = first_rows['HOO_Position'].to_numpy()
+    result['fixation'] = np.arange(len(starts)) - first_of_group + 1
+    result['start_time'] = time_points[starts]
+    result['end_time'] = time_points[ends - 1]
+    result['duration'] = result['end_time'] - result['start_time']
+    result['x'] = np.add.reduceat(x[members], offsets) / lengths
+    result['y'] = np.add.reduceat(y[members], offsets) / lengths
+    result['n_samples'] = lengths
+    result['AOI'] = np.asarray(aoi_names, dtype=object)[aoi_counts.argmax(axis=1)]
+    return pd.DataFrame(result, columns=output_columns)
+
+def read_gaze_for_fixations(input_file, input_format, trials_path):
+    """Read the labelled samples and trial columns fixation detection needs"""
+    if input_format == 'csv':
+        return pd.read_csv(input_file, usecols=TRIAL_COLUMNS + ['time_point', 'x', 'y', 'AOI'],
+                           dtype={'AOI': 'category'})
+    trials_file = os.path.join(trials_path, os.path.basename(input_file))
+    return load_labelled_gaze(input_file, trials_file, trial_columns=TRIAL_COLUMNS)
+
+def read_fixations(fixations_file):
+    """Read a participant's fixation table written by process_fixations"""
+    return pd.read_csv(fixations_file, dtype={'Image': str, 'HOO_Position': str, 'AOI': str},
+                       float_precision='round_trip')
+
+def detect_participant_fixations(file, input_path, output_path, trials_path, input_format, method, thresholds):
+    """Detect the fixations of one participant file and save them"""
+    try:
+        print(f"\nProcessing {file}")
+        input_file = os.path.join(input_path, file)
+        output_file = os.path.join(output_path, os.path.splitext(file)[0] + '.csv')
+
+        with timed_phase('read'):
+            df = read_gaze_for_fixations(input_file, input_format, trials_path)
+        add_count('samples', len(df))
+        with timed_phase('detect'):
+            fixations_df = detect_fixations(df, method, **thresholds)
+
+        with timed_phase('write'):
+            fixations_df.to_csv(output_file, index=False)
+        print(f"  {len(df)} samples -> {len(fixations_df)} fixations")
+        return True
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        return False
+
+def process_fixations(method='ivt', input_format='csv', jobs=1, force=False, paths=None,
+                      velocity_threshold=VELOCITY_THRESHOLD, dispersion_threshold=DISPERSION_THRESHOLD,
+                      min_duration=MIN_FIXATION_DURATION, report=None):
+    """
+    Reduce every participant's labelled gaze samples to fixations, saved to
+    Processing_Files/Fixations (one row per fixation).
+    method: 'ivt' or 'idt'
+    input_format: format written by Processing_4 ('csv' or 'parquet')
+    jobs: number of participant files processed in parallel
+    force: reprocess files even if the build manifest says they are up to date
+    report: a run_report.RunReport to record per-file timings in (optional)
+    """
+    paths = paths or get_pipeline_paths()
+    input_path = paths.aoi_hit if input_format == 'csv' else paths.aoi_samples
+    output_path = paths.fixations
+
+    print(f"\nStarting fixation detection ({method.upper()})...")
+
+    if method not in ('ivt', 'idt'):
+        print(f"Unknown fixation detection method: {method}")
+        return
+
+    os.makedirs(output_path, exist_ok=True)
+    all_files = list_participant_files(input_path, '.' + input_format)
+
+    # Only reprocess files whose content, the thresholds or this code changed
+    thresholds = {'velocity_threshold': velocity_threshold, 'dispersion_threshold': dispersion_threshold,
+                  'min_duration': min_duration}
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {
+        'method': method,
+        'input_format': input_format,
+        'thresholds': thresholds,
+        'code': code_version(__file__),
+    }
+    files = all_files if force else manifest.stale_files('fixations', input_path, all_files, dependencies)
+    print(f"{len(all_files) - len(files)} of {len(all_files)} files are up to date")
+
+    succeeded = run_participant_files(
+        detect_participant_fixations, files, jobs=jobs, report=report,
+        input_path=input_path, output_path=output_path, trials_path=paths.aoi_trials,
+        input_format=input_format, method=method, thresholds=thresholds
+    )
+
+    for file, success in zip(files, succeeded):
+        if success:
+            output_file = os.path.join(output_path, os.path.splitext(file)[0] + '.csv')
+            manifest.record('fixations', os.path.join(input_path, file), dependencies, output_file)
+    manifest.forget_missing('fixations', all_files)
+    manifest.save()
+
+    print(f"\nDetected fixations for {sum(succeeded)}/{len(files)} files")
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('fixations')
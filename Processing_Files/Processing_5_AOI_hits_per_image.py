@@ -1,18 +1,43 @@
 import os
-from pathlib import Path
+from functools import partial
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+import Processing_4b_Fixations
+from Processing_4b_Fixations import read_fixations
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import PREFETCH_DEPTH, read_input_file, read_if_path, write_behind
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
 
-def get_all_possible_aois():
+def get_all_possible_aois(aois_path=None):
     """Get all possible AOIs from the AOIs.csv file"""
-    parent_path = str(Path().resolve())
-    aois_path = os.path.join(parent_path + '/Input_files', 'AOIs.csv')
+    aois_path = aois_path or get_pipeline_paths().aois
     aois_df = pd.read_csv(aois_path)
     all_aois = sorted(aois_df['AOI'].unique())
     # Add Outside_of_AOIs as a possible option
     all_aois = sorted(all_aois + ['Outside_of_AOIs', 'Outside_of_Screen'])
     return all_aois
 
+def get_fixation_columns(all_possible_aois):
+    """Fixation metric columns added by add_fixation_metrics, in output order"""
+    return [f'Fixation_Count_{aoi}' for aoi in all_possible_aois] + \
+        [f'Dwell_Time_{aoi}' for aoi in all_possible_aois] + ['Fixation_Count_All', 'Dwell_Time_All']
+
+def get_hits_columns(all_possible_aois, group_columns=('Image',), fixations=False):
+    """
+    Columns of the AOI hits per image table, in output order.
+    fixations: include the fixation count and dwell time columns
+    """
+    columns = list(group_columns) + ['HOO_Position', 'Numerator_Denominator_Transitions'] + \
+        [f'Total_Hits_{aoi}' for aoi in all_possible_aois] + \
+        [f'New_Hits_{aoi}' for aoi in all_possible_aois] + \
+        ['Total_AOI_Hits_All', 'New_AOI_Hits_All']
+    if fixations:
+        columns += get_fixation_columns(all_possible_aois)
+    return columns
+
 def calculate_aoi_hits(df, all_possible_aois):
     """
     Calculate AOI hits and first/new hits for a single image viewing.
@@ -112,17 +137,253 @@ def calculate_aoi_hits(df, all_possible_aois):
     
     return result_dict
 
-def process_aoi_hits():
+def _reference_time_order(time_points):
+    """
+    Order of one group's samples as df.sort_values('time_point') gives it
+    (quicksort, NaN last), so ties are broken exactly like calculate_aoi_hits.
+    """
+    positions = np.arange(len(time_points))
+    is_nan = pd.isna(time_points)
+    non_nan = positions[~is_nan]
+    return np.concatenate([non_nan[time_points[~is_nan].argsort(kind='quicksort')], positions[is_nan]])
+
+def sort_group_samples(df, group_columns):
+    """
+    Order the samples of df by group (in sorted key order), then
+    chronologically within each group, breaking time ties like
+    calculate_aoi_hits does.
+    df: samples without missing group keys
+    Returns (order, sorted_groups, group_starts, group_ends): positions of
+    the samples in that order, their group numbers, and where each group
+    starts and ends in the order.
+    """
+    # Number groups in sorted key order
+    group_ids = df.groupby(group_columns, sort=True, observed=True).ngroup().to_numpy()
+    n_groups = group_ids.max() + 1
+    
+    # Sort by group, then chronologically within each group
+    time_points = df['time_point'].to_numpy()
+    order = np.lexsort((time_points, group_ids))
+    sorted_groups = group_ids[order]
+    group_starts = np.searchsorted(sorted_groups, np.arange(n_groups))
+    group_ends = np.append(group_starts[1:], len(order))
+    
+    # Groups with tied time points follow the reference sort order exactly
+    sorted_times = time_points[order]
+    ties = (sorted_groups[1:] == sorted_groups[:-1]) & (sorted_times[1:] == sorted_times[:-1])
+    for group in np.unique(sorted_groups[1:][ties]):
+        members = np.flatnonzero(group_ids == group)
+        order[group_starts[group]:group_ends[group]] = members[_reference_time_order(time_points[members])]
+    return order, sorted_groups, group_starts, group_ends
+
+def find_new_hits(codes, is_valid, sorted_groups, group_starts):
+    """
+    Find the samples that start a new hit: a valid AOI that differs from the
+    last valid AOI of the group, which covers run starts as well as re-entry
+    after Outside_of_AOIs/Outside_of_Screen.
+    codes, is_valid: AOI codes of the samples in sort_group_samples order,
+    and whether each is an AOI rather than an off-AOI label
+    """
+    positions = np.arange(len(codes))
+    last_valid_position = np.maximum.accumulate(np.where(is_valid, positions, -1))
+    previous_valid = np.concatenate([[-1], last_valid_position[:-1]])
+    has_previous_valid = previous_valid >= group_starts[sorted_groups]
+    return is_valid & (~has_previous_valid | (codes[previous_valid] != codes))
+
+def calculate_aoi_hits_vectorized(df, all_possible_aois, group_columns=('Image',)):
+    """
+    Calculate AOI hits, new hits and numerator/denominator transitions for
+    every group (image viewing) at once, using run boundaries over integer
+    AOI codes instead of walking the rows.
+    
+    Args:
+        df: DataFrame containing gaze data for one or more image viewings,
+            or an AOI_hit CSV file's path
+        all_possible_aois: List of all possible AOIs from AOIs.csv (or its path)
+        group_columns: Columns identifying one image viewing, e.g. ['pid', 'Image']
+    
+    Returns:
+        DataFrame with one row per group, sorted by the group columns, with
+        the same columns and values calculate_aoi_hits gives per group
+    """
+    df = read_if_path(df, partial(read_labelled_gaze, input_format='csv', trials_path=None))
+    all_possible_aois = read_if_path(all_possible_aois, get_all_possible_aois)
+    group_columns = list(group_columns)
+    ignored_aois = ['Outside_of_AOIs', 'Outside_of_Screen']
+    denominator_aois = ['H_D1', 'H_D2']
+    numerator_aois = ['H_N1', 'H_N2']
+    output_columns = get_hits_columns(all_possible_aois, group_columns)
+    
+    # Rows with a missing group key are dropped, as groupby does
+    df = df.dropna(subset=group_columns)
+    if len(df) == 0:
+        return pd.DataFrame(columns=output_columns)
+    
+    # Sort by group, then chronologically within each group
+    order, sorted_groups, group_starts, _ = sort_group_samples(df, group_columns)
+    n_groups = len(group_starts)
+    
+    # Encode AOIs as integer codes (cheap when AOI is already categorical)
+    codes, aoi_names = df['AOI'].iloc[order].factorize()
+    aoi_names = list(aoi_names)
+    n_aois = len(aoi_names)
+    is_valid = ~np.isin(np.array(aoi_names, dtype=object), ignored_aois)[codes]
+    
+    is_new_hit = find_new_hits(codes, is_valid, sorted_groups, group_starts)
+    
+    total_hits = np.bincount(sorted_groups * n_aois + codes, minlength=n_groups * n_aois).reshape(n_groups, n_aois)
+    new_hits = np.bincount(sorted_groups[is_new_hit] * n_aois + codes[is_new_hit],
+                           minlength=n_groups * n_aois).reshape(n_groups, n_aois)
+    
+    # Transitions between numerator and denominator, ignoring samples in between
+    fraction_part = np.select(
+        [np.isin(np.array(aoi_names, dtype=object), numerator_aois),
+         np.isin(np.array(aoi_names, dtype=object), denominator_aois)],
+        [1, 2], 0)[codes] if n_aois else np.zeros(0, dtype=int)
+    in_fraction = fraction_part != 0
+    fraction_groups = sorted_groups[in_fraction]
+    fraction_part = fraction_part[in_fraction]
+    is_transition = (fraction_part[1:] != fraction_part[:-1]) & (fraction_groups[1:] == fraction_groups[:-1])
+    transitions = np.bincount(fraction_groups[1:][is_transition], minlength=n_groups)
+    
+    # Create result table with separate columns for each AOI
+    first_rows = df.iloc[order[group_starts]]
+    result = {column: first_rows[column].to_numpy() for column in group_columns}
+    result['HOO_Position'] = first_rows['HOO_Position'].to_numpy()
+    result['Numerator_Denominator_Transitions'] = transitions.astype(np.int64)
+    
+    # Add total and new hits columns for all possible AOIs (0 if no hits)
+    zeros = np.zeros(n_groups, dtype=np.int64)
+    for aoi in all_possible_aois:
+        result[f'Total_Hits_{aoi}'] = total_hits[:, aoi_names.index(aoi)] if aoi in aoi_names else zeros
+    for aoi in all_possible_aois:
+        result[f'New_Hits_{aoi}'] = new_hits[:, aoi_names.index(aoi)] if aoi in aoi_names else zeros
+    
+    # Add the total columns across all possible AOIs
+    result['Total_AOI_Hits_All'] = sum(result[f'Total_Hits_{aoi}'] for aoi in all_possible_aois) + zeros
+    result['New_AOI_Hits_All'] = sum(result[f'New_Hits_{aoi}'] for aoi in all_possible_aois) + zeros
+    
+    return pd.DataFrame(result, columns=output_columns)
+
+def calculate_fixation_metrics(fixations_df, all_possible_aois, group_columns=('Image',)):
+    """
+    Count fixations and sum their durations (dwell time, ms) per AOI for
+    every group, from the output of detect_fixations.
+    Returns a DataFrame with the group columns, Fixation_Count_* and
+    Dwell_Time_* for all possible AOIs, Fixation_Count_All and Dwell_Time_All.
+    """
+    group_columns = list(group_columns)
+    output_columns = group_columns + get_fixation_columns(all_possible_aois)
+    
+    fixations_df = fixations_df[fixations_df['AOI'].isin(all_possible_aois)]
+    if len(fixations_df) == 0:
+        return pd.DataFrame(columns=output_columns)
+    
+    per_aoi = fixations_df.groupby(group_columns + ['AOI'], sort=True, observed=True)['duration'].agg(['size', 'sum'])
+    per_aoi = per_aoi.unstack('AOI', fill_value=0)
+    counts = per_aoi['size'].reindex(columns=all_possible_aois, fill_value=0)
+    dwell_times = per_aoi['sum'].reindex(columns=all_possible_aois, fill_value=0)
+    
+    result = per_aoi.index.to_frame(index=False)
+    for aoi in all_possible_aois:
+        result[f'Fixation_Count_{aoi}'] = counts[aoi].to_numpy()
+    for aoi in all_possible_aois:
+        result[f'Dwell_Time_{aoi}'] = dwell_times[aoi].to_numpy()
+    result['Fixation_Count_All'] = counts.sum(axis=1).to_numpy()
+    result['Dwell_Time_All'] = dwell_times.sum(axis=1).to_numpy()
+    return result[output_columns]
+
+def add_fixation_metrics(hits_df, fixations_df, all_possible_aois, group_columns=('Image',)):
+    """
+    Add the fixation count and dwell time columns of fixations_df (the
+    output of detect_fixations, or a Fixations file's path) to the per-group
+    hits_df (0 for groups without fixations).
+    """
+    group_columns = list(group_columns)
+    fixations_df = read_if_path(fixations_df, read_fixations)
+    metrics_df = calculate_fixation_metrics(fixations_df, all_possible_aois, group_columns)
+    metric_columns = [column for column in metrics_df.columns if column not in group_columns]
+    hits_df = hits_df.merge(metrics_df, on=group_columns, how='left')
+    hits_df[metric_columns] = hits_df[metric_columns].astype(np.float64).fillna(0)
+    count_columns = [column for column in metric_columns if column.startswith('Fixation_Count_')]
+    dwell_columns = [column for column in metric_columns if column.startswith('Dwell_Time_')]
+    hits_df[count_columns] = hits_df[count_columns].astype(np.int64)
+    hits_df[dwell_columns] = hits_df[dwell_columns].astype(np.float64)
+    return hits_df
+
+def read_labelled_gaze(input_file, input_format, trials_path):
+    """Read one participant's AOI-labelled gaze samples in the given format"""
+    if input_format == 'csv':
+        return pd.read_csv(input_file, dtype={'AOI': 'category'})
+    
+    from Processing_4_Eyes_to_AOIs import load_labelled_gaze
+    trials_file = os.path.join(trials_path, os.path.basename(input_file))
+    return load_labelled_gaze(input_file, trials_file, trial_columns=['Image', 'HOO_Position'])
+
+def process_participant_hits(file, input_path, output_path, trials_path,
+                             input_format, all_possible_aois, fixations_path=None, prefetched=None):
+    """
+    Calculate AOI hits per image for one participant file and save them.
+    fixations_path: also add fixation metrics from the participant's file
+    in this directory of Processing_4b's fixations (None leaves them out)
+    prefetched: the labelled gaze read ahead by run_participant_files (read here if None)
+    """
+    try:
+        print(f"\nProcessing {file}")
+        input_file = os.path.join(input_path, file)
+        output_file = os.path.join(output_path, os.path.splitext(file)[0] + '.csv')
+        
+        # Read input file
+        with timed_phase('read'):
+            if prefetched is not None:
+                df = prefetched.result()
+            else:
+                df = read_labelled_gaze(input_file, input_format, trials_path)
+        add_count('samples', len(df))
+        
+        # Calculate hits for all images at once
+        with timed_phase('hits'):
+            output_df = calculate_aoi_hits_vectorized(df, all_possible_aois)
+        
+        if fixations_path:
+            with timed_phase('fixations'):
+                fixations_file = os.path.join(fixations_path, os.path.splitext(file)[0] + '.csv')
+                output_df = add_fixation_metrics(output_df, fixations_file, all_possible_aois)
+        
+        # Save to CSV
+        with timed_phase('write'):
+            write_behind(output_df.to_csv, output_file, index=False)
+        print(f"Saved results to {os.path.basename(output_file)}")
+        return True
+        
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        return False
+
+def process_aoi_hits(input_format='csv', jobs=1, force=False, paths=None, fixations=False,
+                     report=None, prefetch=PREFETCH_DEPTH):
+    """
+    input_format: 'csv' reads Processing_files/AOI_hit; 'parquet' reads the
+    columnar Processing_files/AOI_samples and AOI_trials tables.
+    fixations: also add fixation count and dwell time columns from the
+    fixations detected by Processing_4b (which must be up to date for the
+    labelled files; its method and thresholds are taken as they were run)
+    jobs: number of participant files processed in parallel
+    force: reprocess files even if the build manifest says they are up to date
+    report: a run_report.RunReport to record per-file timings in (optional)
+    prefetch: number of files read ahead and written behind when jobs is 1
+    """
     # Set up paths
-    parent_path = str(Path().resolve())
-    input_path = os.path.join(parent_path + '/Processing_files', 'AOI_hit')
-    output_path = os.path.join(parent_path + '/Output_files', 'AOI_hit_per_image')
+    paths = paths or get_pipeline_paths()
+    input_path = paths.aoi_hit if input_format == 'csv' else paths.aoi_samples
+    trials_path = paths.aoi_trials
+    output_path = paths.aoi_hit_per_image
     
     print("\nStarting AOI hits analysis...")
     
     # Get all possible AOIs
     try:
-        all_possible_aois = get_all_possible_aois()
+        all_possible_aois = get_all_possible_aois(paths.aois)
         print(f"Found {len(all_possible_aois)} possible AOIs")
     except Exception as e:
         print(f"Error reading AOIs file: {e}")
@@ -131,39 +392,53 @@ def process_aoi_hits():
     # Create output directory if it doesn't exist
     os.makedirs(output_path, exist_ok=True)
     
-    # Get list of CSV files
-    csv_files = [f for f in os.listdir(input_path) if f.endswith('.csv')]
+    # Get list of input files
+    all_files = list_participant_files(input_path, '.' + input_format)
+    
+    # Only reprocess files whose content, AOIs.csv, fixations or this code changed
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {
+        'aois': hash_file(paths.aois),
+        'input_format': input_format,
+        'code': code_version(__file__, Processing_4b_Fixations.__file__),
+    }
+    file_dependencies = {file: dependencies for file in all_files}
+    files = all_files
+    if fixations:
+        # Each file's fixations stage entry (method, thresholds and code) is a dependency
+        fixation_entries = manifest.entries.get('fixations', {})
+        missing = []
+        for file in all_files:
+            entry = fixation_entries.get(file)
+            if entry is None or not manifest.is_fresh('fixations', os.path.join(input_path, file),
+                                                      entry['dependencies']):
+                missing.append(file)
+            else:
+                file_dependencies[file] = dict(dependencies, fixations=entry['dependencies'])
+        if missing:
+            print(f"No up-to-date fixations for {len(missing)} files (run the fixations stage first): {missing}")
+        files = [file for file in all_files if file not in missing]
+    csv_files = [file for file in files
+                 if force or not manifest.is_fresh('hits', os.path.join(input_path, file), file_dependencies[file])]
+    print(f"{len(files) - len(csv_files)} of {len(files)} files are up to date")
     
     # Process each participant's file
-    for file in csv_files:
-        try:
-            print(f"\nProcessing {file}")
-            input_file = os.path.join(input_path, file)
-            output_file = os.path.join(output_path, file)
-            
-            # Read input CSV
-            df = pd.read_csv(input_file)
-            
-            # Group by Image
-            image_groups = df.groupby('Image')
-            
-            # Process each image
-            results = []
-            for _, image_df in image_groups:
-                # Calculate hits and add to results
-                result_dict = calculate_aoi_hits(image_df, all_possible_aois)
-                results.append(result_dict)
-            
-            # Create output DataFrame
-            output_df = pd.DataFrame(results)
-            
-            # Save to CSV
-            output_df.to_csv(output_file, index=False)
-            print(f"Saved results to {os.path.basename(output_file)}")
-            
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-            continue
+    succeeded = run_participant_files(
+        process_participant_hits, csv_files, jobs=jobs, report=report, prefetch=prefetch,
+        read_file=partial(read_input_file, partial(read_labelled_gaze, input_format=input_format,
+                                                   trials_path=trials_path), input_path),
+        input_path=input_path, output_path=output_path, trials_path=trials_path,
+        input_format=input_format, all_possible_aois=all_possible_aois,
+        fixations_path=paths.fixations if fixations else None
+    )
+    
+    for file, success in zip(csv_files, succeeded):
+        if success:
+            output_file = os.path.join(output_path, os.path.splitext(file)[0] + '.csv')
+            manifest.record('hits', os.path.join(input_path, file), file_dependencies[file], output_file)
+    manifest.forget_missing('hits', all_files)
+    manifest.save()
 
 if __name__ == "__main__":
-    process_aoi_hits()
+    from pipeline_cli import run_script
+    run_script('hits')
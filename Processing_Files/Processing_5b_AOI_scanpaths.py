@@ -0,0 +1,318 @@
+import os
+import numpy as np
+import pandas as pd
+from Processing_4_Eyes_to_AOIs import read_aois, load_labelled_gaze
+from Processing_5_AOI_hits_per_image import sort_group_samples, find_new_hits
+from vocabulary_registry import get_aoi_vocabulary, OFF_AOI_LABELS
+from participant_runner import list_participant_files, run_participant_files
+from build_manifest import BuildManifest, hash_file, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+
+# Longest n-gram kept in the inverted index; longer query patterns are
+# answered from the index of their n-grams and checked against the scanpaths
+MAX_NGRAM = 3
+
+# Separators accepted between the AOIs of a query pattern
+PATTERN_SEPARATORS = ['→', '->', '>', ',']
+
+INDEX_FILE = 'scanpath_index.npz'
+TRIALS_FILE = 'scanpath_trials.csv'
+TRANSITIONS_FILE = 'AOI_transitions.csv'
+
+def build_scanpaths(df, aoi_names, group_columns=('Image',)):
+    """
+    Reduce each image viewing's samples to its scanpath: the sequence of AOIs
+    visited, one entry per new hit (a run of samples on one AOI, ignoring
+    Outside_of_AOIs/Outside_of_Screen samples in between), so the scanpath
+    has New_AOI_Hits_All entries.
+    aoi_names: AOI vocabulary the codes refer to (get_aoi_vocabulary)
+    Returns (groups_df, codes, lengths): one row per viewing with the group
+    columns and HOO_Position, sorted like calculate_aoi_hits_vectorized; the
+    scanpaths' AOI codes, concatenated; and each scanpath's length.
+    """
+    group_columns = list(group_columns)
+    df = df.dropna(subset=group_columns)
+    if len(df) == 0:
+        return pd.DataFrame(columns=group_columns + ['HOO_Position']), np.empty(0, np.int16), np.empty(0, np.int64)
+
+    order, sorted_groups, group_starts, _ = sort_group_samples(df, group_columns)
+    codes = pd.Categorical(df['AOI'].iloc[order].astype(str), categories=aoi_names).codes.astype(np.int64)
+    off_codes = [aoi_names.index(label) for label in OFF_AOI_LABELS]
+
+    # Labels missing from the vocabulary get code -1; they still end a run,
+    # as they do in calculate_aoi_hits_vectorized, but are left out of the scanpath
+    is_unknown = codes < 0
+    if is_unknown.any():
+        unknown = sorted(df['AOI'].iloc[order][is_unknown].astype(str).unique())
+        print(f"  {is_unknown.sum()} samples with AOIs not in the vocabulary left out: {unknown}")
+        add_count('unknown_aoi_samples', int(is_unknown.sum()))
+    is_valid = ~np.isin(codes, off_codes)
+    is_new_hit = find_new_hits(codes, is_valid, sorted_groups, group_starts) & ~is_unknown
+
+    first_rows = df.iloc[order[group_starts]]
+    groups_df = pd.DataFrame({column: first_rows[column].astype(str).to_numpy()
+                              for column in group_columns + ['HOO_Position']})
+    lengths = np.bincount(sorted_groups[is_new_hit], minlength=len(group_starts))
+    return groups_df, codes[is_new_hit].astype(np.int16), lengths
+
+def count_transitions(codes, lengths, n_aois):
+    """
+    Count the AOI-to-AOI transitions (consecutive scanpath entries) of every
+    scanpath. Only the transitions that occur are counted, so memory grows
+    with the number of scanpath entries, not with n_aois squared.
+    Returns the sparse (COO) matrices as (scanpath, from_code, to_code, count)
+    arrays, sorted by scanpath, then from, then to.
+    """
+    codes = codes.astype(np.int64)
+    scanpaths = np.repeat(np.arange(len(lengths)), lengths)
+    same_scanpath = scanpaths[1:] == scanpaths[:-1]
+    keys = (scanpaths[1:][same_scanpath] * n_aois + codes[:-1][same_scanpath]) * n_aois + codes[1:][same_scanpath]
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys // (n_aois * n_aois), keys // n_aois % n_aois, keys % n_aois, counts
+
+def build_ngram_index(codes, lengths, n, n_aois):
+    """
+    Build the inverted index of the scanpaths' n-grams.
+    An n-gram is keyed by its codes read as a base-n_aois number.
+    Returns (keys, scanpaths, counts): every (n-gram, scanpath) pair with its
+    number of occurrences, sorted by key then scanpath, so the scanpaths
+    containing an n-gram are one searchsorted range.
+    """
+    scanpaths = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.flatnonzero(scanpaths[:len(scanpaths) - n + 1] == scanpaths[n - 1:]) if len(scanpaths) >= n else \
+        np.empty(0, dtype=np.int64)
+    keys = np.zeros(len(starts), dtype=np.int64)
+    for offset in range(n):
+        keys = keys * n_aois + codes[starts + offset]
+    scanpaths = scanpaths[starts]
+
+    order = np.lexsort((scanpaths, keys))
+    keys = keys[order]
+    scanpaths = scanpaths[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = (keys[1:] != keys[:-1]) | (scanpaths[1:] != scanpaths[:-1])
+    first = np.flatnonzero(is_first)
+    counts = np.diff(np.append(first, len(keys)))
+    return keys[first], scanpaths[first], counts
+
+def read_gaze_for_scanpaths(input_file, input_format, trials_path):
+    """Read the labelled sample columns scanpaths need"""
+    if input_format == 'csv':
+        return pd.read_csv(input_file, usecols=['Image', 'HOO_Position', 'time_point', 'AOI'],
+                           dtype={'AOI': 'category'})
+    trials_file = os.path.join(trials_path, os.path.basename(input_file))
+    return load_labelled_gaze(input_file, trials_file, trial_columns=['Image', 'HOO_Position'])
+
+def build_participant_scanpaths(file, input_path, trials_path, input_format, aoi_names):
+    """
+    Build the scanpaths of one participant file.
+    Returns build_scanpaths' (groups_df, codes, lengths) with pid added to
+    groups_df, or None if the file cannot be processed.
+    """
+    try:
+        print(f"Processing {file}")
+        with timed_phase('read'):
+            df = read_gaze_for_scanpaths(os.path.join(input_path, file), input_format, trials_path)
+        add_count('samples', len(df))
+        with timed_phase('scanpaths'):
+            groups_df, codes, lengths = build_scanpaths(df, aoi_names)
+        groups_df.insert(0, 'pid', os.path.splitext(file)[0])
+        return groups_df, codes, lengths
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        return None
+
+class ScanpathIndex:
+    """
+    Cohort-wide scanpaths of every (pid, Image) viewing, their sparse AOI
+    transition matrices and an inverted n-gram index, loaded from the files
+    written by process_scanpaths.
+    """
+
+    def __init__(self, index_path):
+        with np.load(os.path.join(index_path, INDEX_FILE)) as data:
+            arrays = dict(data)
+        self.aoi_names = list(arrays['aoi_names'])
+        self.max_n = int(arrays['max_n'])
+        self.codes = arrays['codes']
+        self.offsets = arrays['offsets']
+        self.transitions = {name: arrays['transition_' + name] for name in ('scanpath', 'from', 'to', 'count')}
+        self.ngrams = {n: (arrays[f'ngram_keys_{n}'], arrays[f'ngram_scanpaths_{n}'], arrays[f'ngram_counts_{n}'])
+                       for n in range(1, self.max_n + 1)}
+        self.trials_df = pd.read_csv(os.path.join(index_path, TRIALS_FILE), dtype={'pid': str, 'Image': str},
+                                     usecols=['scanpath', 'pid', 'Image', 'HOO_Position', 'length'])
+
+    def encode(self, pattern):
+        """Turn a pattern ('H_N1>H_D1>H_O' or a list of AOI names) into AOI codes"""
+        if isinstance(pattern, str):
+            for separator in PATTERN_SEPARATORS:
+                pattern = pattern.replace(separator, ' ')
+            pattern = pattern.split()
+        unknown = [aoi for aoi in pattern if aoi not in self.aoi_names]
+        if unknown:
+            raise ValueError(f"unknown AOIs {unknown}")
+        return [self.aoi_names.index(aoi) for aoi in pattern]
+
+    def _lookup(self, codes):
+        """Get (scanpaths, counts) of an n-gram of at most max_n codes"""
+        keys, scanpaths, counts = self.ngrams[len(codes)]
+        key = 0
+        for code in codes:
+            key = key * len(self.aoi_names) + code
+        start, end = np.searchsorted(keys, [key, key + 1])
+        return scanpaths[start:end], counts[start:end]
+
+    def find(self, pattern):
+        """
+        Find the scanpaths in which the AOIs of pattern are visited one right
+        after the other.
+        Returns (scanpaths, counts): scanpath numbers and occurrence counts.
+        """
+        codes = self.encode(pattern)
+        if not codes:
+            raise ValueError("empty pattern")
+        if len(codes) <= self.max_n:
+            return self._lookup(codes)
+
+        # Scanpaths containing every n-gram of the pattern, then checked in full
+        candidates = None
+        for start in range(len(codes) - self.max_n + 1):
+            scanpaths, _ = self._lookup(codes[start:start + self.max_n])
+            candidates = scanpaths if candidates is None else np.intersect1d(candidates, scanpaths,
+                                                                              assume_unique=True)
+        counts = np.zeros(len(candidates), dtype=np.int64)
+        for i, scanpath in enumerate(candidates):
+            visited = self.codes[self.offsets[scanpath]:self.offsets[scanpath + 1]]
+            if len(visited) >= len(codes):
+                windows = np.lib.stride_tricks.sliding_window_view(visited, len(codes))
+                counts[i] = np.all(windows == codes, axis=1).sum()
+        return candidates[counts > 0], counts[counts > 0]
+
+    def query(self, pattern):
+        """Get the (pid, Image) viewings whose scanpath contains pattern, with its count"""
+        scanpaths, counts = self.find(pattern)
+        result_df = self.trials_df.iloc[scanpaths].reset_index(drop=True)
+        result_df['count'] = counts
+        return result_df
+
+    def transition_matrix(self, pid, image):
+        """Get one viewing's AOI-to-AOI transition counts as a dense DataFrame (rows: from, columns: to)"""
+        matches = self.trials_df.index[(self.trials_df['pid'] == pid) & (self.trials_df['Image'] == image)]
+        if not len(matches):
+            raise KeyError(f"no scanpath for {pid} {image}")
+        start, end = np.searchsorted(self.transitions['scanpath'], [matches[0], matches[0] + 1])
+        matrix = np.zeros((len(self.aoi_names), len(self.aoi_names)), dtype=np.int64)
+        matrix[self.transitions['from'][start:end], self.transitions['to'][start:end]] = \
+            self.transitions['count'][start:end]
+        return pd.DataFrame(matrix, index=self.aoi_names, columns=self.aoi_names)
+
+def save_scanpath_index(output_path, aoi_names, trials_df, codes, lengths, max_n=MAX_NGRAM):
+    """
+    Save the cohort's scanpaths, transition matrices and n-gram index.
+    Writes scanpath_index.npz (arrays for ScanpathIndex), scanpath_trials.csv
+    (one row per viewing with its scanpath as text) and AOI_transitions.csv
+    (pid, Image, from_AOI, to_AOI, count for every non-zero transition).
+    """
+    n_aois = len(aoi_names)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    with timed_phase('transitions'):
+        transition_scanpaths, from_codes, to_codes, transition_counts = count_transitions(codes, lengths, n_aois)
+    arrays = {
+        'aoi_names': np.array(aoi_names, dtype=str),
+        'max_n': np.array(max_n),
+        'codes': codes,
+        'offsets': offsets,
+        'transition_scanpath': transition_scanpaths,
+        'transition_from': from_codes.astype(np.int16),
+        'transition_to': to_codes.astype(np.int16),
+        'transition_count': transition_counts,
+    }
+    with timed_phase('ngrams'):
+        for n in range(1, max_n + 1):
+            keys, scanpaths, counts = build_ngram_index(codes.astype(np.int64), lengths, n, n_aois)
+            arrays.update({f'ngram_keys_{n}': keys, f'ngram_scanpaths_{n}': scanpaths, f'ngram_counts_{n}': counts})
+
+    with timed_phase('write'):
+        os.makedirs(output_path, exist_ok=True)
+        np.savez(os.path.join(output_path, INDEX_FILE), **arrays)
+
+        names = np.array(aoi_names, dtype=object)
+        trials_df = trials_df.assign(length=lengths)
+        trials_df.insert(0, 'scanpath', np.arange(len(trials_df)))
+        trials_df['path'] = ['>'.join(names[codes[start:end]]) for start, end in zip(offsets[:-1], offsets[1:])]
+        trials_df.to_csv(os.path.join(output_path, TRIALS_FILE), index=False)
+
+        pd.DataFrame({
+            'pid': trials_df['pid'].to_numpy()[transition_scanpaths],
+            'Image': trials_df['Image'].to_numpy()[transition_scanpaths],
+            'from_AOI': names[from_codes],
+            'to_AOI': names[to_codes],
+            'count': transition_counts,
+        }).to_csv(os.path.join(output_path, TRANSITIONS_FILE), index=False)
+
+def process_scanpaths(input_format='csv', jobs=1, force=False, paths=None, max_n=MAX_NGRAM, report=None):
+    """
+    Build the scanpath of every participant's image viewings, their AOI
+    transition matrices and an inverted n-gram index over the whole cohort,
+    saved to Output_Files/Scanpaths (see save_scanpath_index).
+    input_format: format written by Processing_4 ('csv' or 'parquet')
+    max_n: longest n-gram indexed
+    jobs: number of participant files processed in parallel
+    force: rebuild even if the build manifest says the index is up to date
+    report: a run_report.RunReport to record per-file timings in (optional)
+    """
+    paths = paths or get_pipeline_paths()
+    input_path = paths.aoi_hit if input_format == 'csv' else paths.aoi_samples
+    output_path = paths.scanpaths
+
+    print("\nStarting scanpath indexing...")
+
+    try:
+        aoi_names = get_aoi_vocabulary(read_aois(paths.aois))
+    except Exception as e:
+        print(f"Error reading AOIs file: {e}")
+        return
+
+    all_files = list_participant_files(input_path, '.' + input_format)
+    if not all_files:
+        print("No labelled gaze files found in the input directory")
+        return
+
+    # The index covers the whole cohort, so any changed file rebuilds it
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {'aois': hash_file(paths.aois), 'input_format': input_format, 'max_n': max_n,
+                    'code': code_version(__file__)}
+    if not force and not manifest.stale_files('scanpaths', input_path, all_files, dependencies) \
+            and set(manifest.entries.get('scanpaths', {})) == set(all_files):
+        print(f"{INDEX_FILE} is up to date")
+        return
+
+    results = run_participant_files(
+        build_participant_scanpaths, all_files, jobs=jobs, report=report,
+        input_path=input_path, trials_path=paths.aoi_trials, input_format=input_format, aoi_names=aoi_names
+    )
+    read_files = [file for file, result in zip(all_files, results) if result is not None]
+    results = [result for result in results if result is not None]
+    if not results:
+        print("No data was successfully processed")
+        return
+
+    trials_df = pd.concat([groups_df for groups_df, _, _ in results], ignore_index=True)
+    codes = np.concatenate([codes for _, codes, _ in results])
+    lengths = np.concatenate([lengths for _, _, lengths in results])
+    save_scanpath_index(output_path, aoi_names, trials_df, codes, lengths, max_n)
+
+    print(f"Indexed {len(trials_df)} scanpaths of {len(read_files)} of {len(all_files)} participants "
+          f"({len(codes)} AOI visits)")
+    print(f"Saved {INDEX_FILE}, {TRIALS_FILE} and {TRANSITIONS_FILE} to {output_path}")
+
+    manifest.entries.pop('scanpaths', None)
+    for file in read_files:
+        manifest.record('scanpaths', os.path.join(input_path, file), dependencies,
+                        os.path.join(output_path, INDEX_FILE))
+    manifest.save()
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('scanpaths')
@@ -1,66 +1,338 @@
 import os
-from pathlib import Path
 import pandas as pd
+from Processing_5_AOI_hits_per_image import get_all_possible_aois, get_hits_columns
+from participant_runner import list_participant_files, run_participant_files
+from participant_io import PREFETCH_DEPTH, AsyncWriter, prefetch_reads
+from build_manifest import BuildManifest, code_version
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase, add_count
+from cohort_store import CohortStore, HITS_TABLE, INDEX_COLUMNS
 
-def combine_aoi_hits():
+# Text columns of the combined table; Dwell_Time_* columns are float, the rest integer
+TEXT_COLUMNS = ['pid', 'Image', 'HOO_Position']
+
+def read_participant_hits(file, input_path):
+    """Read one participant's AOI hits per image, or None if it cannot be read"""
+    try:
+        print(f"Processing {file}")
+        
+        # Read the CSV file
+        file_path = os.path.join(input_path, file)
+        with timed_phase('read'):
+            df = pd.read_csv(file_path, dtype={'Image': str, 'HOO_Position': str})
+        add_count('rows', len(df))
+        
+        # Add participant ID (filename without .csv extension)
+        df['pid'] = os.path.splitext(file)[0]
+        return df
+        
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        return None
+
+def check_fixation_columns(file_path, fixations):
+    """
+    Check that a per-image file has fixation columns exactly when they are
+    expected, so running with the wrong fixations setting fails once
+    instead of rejecting every file.
+    Returns a problem message, or None if the file matches or cannot be read.
+    """
+    try:
+        columns = pd.read_csv(file_path, nrows=0).columns
+    except Exception:
+        return None
+    has_fixations = any(column.startswith('Fixation_Count_') for column in columns)
+    if fixations and not has_fixations:
+        return "per-image files lack fixation columns; rerun hits --fixations"
+    if not fixations and has_fixations:
+        return "per-image files have fixation columns; run combine with --fixations"
+    return None
+
+def combine_participant_hits(all_data):
+    """
+    Combine per-participant hit tables into one table with pid first.
+    all_data: the tables with their pid column, or the paths of
+    AOI_hit_per_image files (the pid taken from the file name)
+    """
+    all_data = [read_participant_hits(os.path.basename(data), os.path.dirname(data))
+                if isinstance(data, (str, os.PathLike)) else data for data in all_data]
+    combined_df = pd.concat(all_data, ignore_index=True)
+    
+    # Reorder columns to put Participant_ID first
+    cols = combined_df.columns.tolist()
+    cols.remove('pid')
+    cols = ['pid'] + cols
+    return combined_df[cols]
+
+def get_combined_schema(all_possible_aois, fixations=False):
+    """
+    Declare the combined table's columns and their dtypes.
+    fixations: expect the fixation columns added by Processing_5 --fixations
+    Returns a dict mapping each column, in output order, to its dtype.
+    """
+    columns = ['pid'] + get_hits_columns(all_possible_aois, fixations=fixations)
+    return {column: 'str' if column in TEXT_COLUMNS else 'float64' if column.startswith('Dwell_Time_') else 'int64'
+            for column in columns}
+
+def check_schema(df, schema):
+    """
+    Compare a participant table with the declared schema.
+    Returns a list of problems (missing, unexpected or mistyped columns),
+    empty if the table can be written as it is.
+    """
+    problems = []
+    missing = [column for column in schema if column not in df.columns]
+    unexpected = [column for column in df.columns if column not in schema]
+    if missing:
+        problems.append(f"missing columns {missing}")
+    if unexpected:
+        problems.append(f"unexpected columns {unexpected}")
+    for column, dtype in schema.items():
+        if column not in df.columns or dtype == 'str':
+            continue
+        values = df[column]
+        if not pd.api.types.is_numeric_dtype(values) or values.isna().any():
+            problems.append(f"column {column} is not {dtype}")
+        elif dtype == 'int64' and not (values == values.round()).all():
+            problems.append(f"column {column} is not {dtype}")
+    return problems
+
+class CombinedHitsWriter:
+    """
+    Append participant tables to the combined file in the declared schema.
+    Rows go to a temporary file that replaces the output only on close, so
+    the previous combined file stays readable while it is being spliced.
+    max_pending: append on a background thread, with at most this many
+    participants queued (0 appends right away)
+    """
+
+    def __init__(self, output_format, output_file, schema, max_pending=0):
+        self.output_format = output_format
+        self.output_file = output_file
+        self.schema = schema
+        self.temp_file = output_file + '.partial'
+        self.rows = 0
+        self.writer = None
+        self.background = AsyncWriter(max_pending) if max_pending else None
+        if output_format == 'csv':
+            pd.DataFrame(columns=list(schema)).to_csv(self.temp_file, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            types = {'str': pa.string(), 'float64': pa.float64(), 'int64': pa.int64()}
+            self.arrow_schema = pa.schema([(column, types[dtype]) for column, dtype in schema.items()])
+            self.writer = pq.ParquetWriter(self.temp_file, self.arrow_schema)
+
+    def write(self, df):
+        """Append one participant's rows"""
+        with timed_phase('write'):
+            df = df[list(self.schema)].astype(self.schema)
+            if self.background is not None:
+                self.background.submit(self._append, df)
+            else:
+                self._append(df)
+        self.rows += len(df)
+
+    def _append(self, df):
+        if self.output_format == 'csv':
+            df.to_csv(self.temp_file, mode='a', header=False, index=False)
+        else:
+            import pyarrow as pa
+            self.writer.write_table(pa.Table.from_pandas(df, schema=self.arrow_schema, preserve_index=False))
+
+    def close(self):
+        """Finish the file and move it into place"""
+        if self.background is not None:
+            self.background.close()
+            if self.background.failed:
+                raise OSError(f"could not append {list(self.background.failed.values())[0]}")
+        if self.writer is not None:
+            self.writer.close()
+        os.replace(self.temp_file, self.output_file)
+
+    def abort(self):
+        """Discard the partial file, leaving the previous output untouched"""
+        if self.background is not None:
+            self.background.close()
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+def read_combined_participants(combined_file, output_format, chunk_size=100000):
+    """
+    Read an existing combined file in chunks of rows.
+    Yields (pid, rows) for each participant, in file order.
+    """
+    if output_format == 'csv':
+        chunks = pd.read_csv(combined_file, dtype={column: str for column in TEXT_COLUMNS}, chunksize=chunk_size)
+    else:
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(combined_file).iter_batches(batch_size=chunk_size))
+    
+    # A participant's rows may span two chunks, so hold back the last one
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        pids = chunk['pid'].to_numpy()
+        starts = [0] + [i for i in range(1, len(pids)) if pids[i] != pids[i - 1]]
+        for start, end in zip(starts[:-1], starts[1:]):
+            yield pids[start], chunk.iloc[start:end]
+        pending = chunk.iloc[starts[-1]:] if len(chunk) else None
+    if pending is not None and len(pending):
+        yield pending['pid'].iloc[0], pending
+
+def combine_aoi_hits(jobs=1, force=False, paths=None, output_format='csv', fixations=False, report=None,
+                     prefetch=PREFETCH_DEPTH):
+    """
+    Combine the AOI hits per image of all participants into one file,
+    streaming one participant at a time (jobs at a time when reading in
+    parallel) so memory does not grow with the cohort.
+    Every participant must match the schema declared from AOIs.csv; files
+    that do not are reported and left out rather than padded with NaN.
+    Participants whose per-image file is unchanged since the last run are
+    copied from the existing combined file; only changed ones are read.
+    The same rows are kept in the cohort store's aoi_hits table, indexed
+    by pid, condition and image prefix.
+    output_format: 'csv' writes AOI_hits_combined.csv, 'parquet' AOI_hits_combined.parquet
+    fixations: expect the fixation columns added by Processing_5 --fixations
+    report: a run_report.RunReport to record per-file timings in (optional)
+    prefetch: when jobs is 1, number of changed files read ahead and of
+    participants queued for appending on a background thread (0 to not overlap)
+    """
     # Set up paths
-    parent_path = str(Path(os.path.dirname(__file__)).parent)  # Go up one level to Code directory
-    input_path = os.path.join(parent_path, 'Output_files', 'AOI_hit_per_image')
-    output_file = os.path.join(parent_path, 'Output_files', 'AOI_hits_combined.csv')
+    paths = paths or get_pipeline_paths()
+    input_path = paths.aoi_hit_per_image
+    output_file = paths.aoi_hits_combined
+    if output_format == 'parquet':
+        output_file = os.path.splitext(output_file)[0] + '.parquet'
     
     print("\nStarting to combine AOI hits data...")
     
     # Get list of CSV files
-    csv_files = [f for f in os.listdir(input_path) if f.endswith('.csv')]
+    csv_files = list_participant_files(input_path)
     
     if not csv_files:
         print("No CSV files found in the input directory")
         return
     
-    # Initialize list to store all dataframes
-    all_data = []
+    try:
+        schema = get_combined_schema(get_all_possible_aois(paths.aois), fixations)
+    except Exception as e:
+        print(f"Error reading AOIs file: {e}")
+        return
     
-    # Process each file
-    for file in csv_files:
-        try:
-            print(f"Processing {file}")
-            
-            # Read the CSV file
-            file_path = os.path.join(input_path, file)
-            df = pd.read_csv(file_path)
-            
-            # Add participant ID (filename without .csv extension)
-            df['pid'] = os.path.splitext(file)[0]
-            
-            # Add to list
-            all_data.append(df)
-            
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-            continue
+    problem = check_fixation_columns(os.path.join(input_path, csv_files[0]), fixations)
+    if problem:
+        print(f"Error: {problem}")
+        return
     
-    if not all_data:
-        print("No data was successfully processed")
+    # Find participants that changed since the combined file was written
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {'code': code_version(__file__), 'output_format': output_format, 'schema': schema}
+    recorded_files = set(manifest.entries.get('combine', {}))
+    splice = not force and os.path.exists(output_file) and bool(recorded_files)
+    stale_files = manifest.stale_files('combine', input_path, csv_files, dependencies) if splice else csv_files
+    
+    # The store is rebuilt along with the combined file, or when its columns changed
+    store = CohortStore(paths.cohort_store)
+    store_columns = INDEX_COLUMNS + [column for column in schema if column != 'pid']
+    rebuild_store = not splice or store.columns(HITS_TABLE) != store_columns
+    if rebuild_store:
+        store.drop(HITS_TABLE)
+    
+    if splice and not stale_files and recorded_files == set(csv_files) and not rebuild_store:
+        store.close()
+        print(f"{os.path.basename(output_file)} is up to date")
         return
     
+    previous = read_combined_participants(output_file, output_format) if splice else iter(())
+    previous_pid, previous_rows = next(previous, (None, None))
+    file_order = {os.path.splitext(f)[0]: i for i, f in enumerate(csv_files)}
+    stale_files = set(stale_files)
+    
+    # Serial runs read changed files ahead instead of in batches
+    overlap = jobs == 1 and prefetch > 0
+    read_ahead = prefetch_reads(read_participant_hits, [f for f in csv_files if f in stale_files], prefetch,
+                                report=report, input_path=input_path) if overlap else None
+    
+    writer = CombinedHitsWriter(output_format, output_file, schema, max_pending=prefetch if overlap else 0)
+    read_files = []
+    mismatched_files = []
+    written_pids = []
+    kept = 0
     try:
-        # Combine all dataframes
-        combined_df = pd.concat(all_data, ignore_index=True)
-        
-        # Reorder columns to put Participant_ID first
-        cols = combined_df.columns.tolist()
-        cols.remove('pid')
-        cols = ['pid'] + cols
-        combined_df = combined_df[cols]
-        
-        # Save combined data
-        combined_df.to_csv(output_file, index=False)
-        print(f"\nSuccessfully combined {len(csv_files)} files")
-        print(f"Total rows in combined file: {len(combined_df)}")
-        print(f"Saved combined data to: {os.path.basename(output_file)}")
+        # Walk the participants in sorted file order, reading changed files
+        # jobs at a time and copying unchanged ones from the previous output
+        batch_size = max(jobs, 1) if jobs else os.cpu_count() or 1
+        for batch_start in range(0, len(csv_files), batch_size):
+            batch = csv_files[batch_start:batch_start + batch_size]
+            to_read = [f for f in batch if f in stale_files] if read_ahead is None else []
+            read_data = dict(zip(to_read, run_participant_files(
+                read_participant_hits, to_read, jobs=jobs, report=report, input_path=input_path)))
+            
+            for file in batch:
+                pid = os.path.splitext(file)[0]
+                if file not in stale_files:
+                    # Skip participants that were removed since the last run
+                    while previous_pid is not None and previous_pid != pid and \
+                            file_order.get(previous_pid, -1) < file_order[pid]:
+                        previous_pid, previous_rows = next(previous, (None, None))
+                    if previous_pid == pid and not check_schema(previous_rows, schema):
+                        writer.write(previous_rows)
+                        if rebuild_store:
+                            store.replace_participant(HITS_TABLE, pid, previous_rows[list(schema)])
+                        written_pids.append(pid)
+                        kept += 1
+                        continue
+                    df = read_participant_hits(file, input_path)
+                elif read_ahead is not None:
+                    df = next(read_ahead)[1].result()
+                else:
+                    df = read_data[file]
+                
+                if df is None:
+                    continue
+                problems = check_schema(df, schema)
+                if problems:
+                    print(f"Schema mismatch in {file}: {'; '.join(problems)}")
+                    mismatched_files.append(file)
+                    continue
+                writer.write(df)
+                store.replace_participant(HITS_TABLE, pid, df[list(schema)])
+                written_pids.append(pid)
+                read_files.append(file)
         
+        if kept + len(read_files) == 0:
+            writer.abort()
+            store.abort()
+            print("No data was successfully processed")
+            return
+        store.retain_participants(HITS_TABLE, written_pids)
+        writer.close()
+        store.close()
     except Exception as e:
+        writer.abort()
+        store.abort()
         print(f"Error combining data: {e}")
+        return
+    
+    print(f"\nSuccessfully combined {kept + len(read_files)} of {len(csv_files)} files")
+    if splice:
+        print(f"Kept {kept} unchanged participants, re-read {len(read_files)} files")
+    if mismatched_files:
+        print(f"Left out {len(mismatched_files)} files that do not match the schema: {mismatched_files}")
+    print(f"Total rows in combined file: {writer.rows}")
+    print(f"Saved combined data to: {os.path.basename(output_file)}")
+    
+    if not splice:
+        manifest.entries.pop('combine', None)
+    for file in read_files:
+        manifest.record('combine', os.path.join(input_path, file), dependencies, output_file)
+    manifest.forget_missing('combine', [f for f in csv_files if f not in mismatched_files])
+    manifest.save()
 
 if __name__ == "__main__":
-    combine_aoi_hits()
+    from pipeline_cli import run_script
+    run_script('combine')
@@ -0,0 +1,60 @@
+"""
+Eye-tracking and response processing of the fractions study.
+
+The stage modules import each other by their own names, as when they are
+run as scripts, so importing the package puts this directory on sys.path.
+Stage functions are looked up lazily: importing the package does not import
+pandas or any stage, and each stage module is imported on first use, e.g.
+
+    import Processing_Files as pipeline
+    paths = pipeline.get_pipeline_paths('/data/fractions')
+    pipeline.process_gaze_data(paths=paths, jobs=4)
+    samples_df, trials_df, counters = pipeline.label_participant(trials_df, paths.aois)
+
+The command line runs the same stages: python -m Processing_Files <stage> ...
+"""
+import os
+import sys
+
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.append(_here)
+
+# Public names -> module they are defined in
+_EXPORTS = {
+    'get_pipeline_paths': 'pipeline_paths',
+    'PipelinePaths': 'pipeline_paths',
+    'RunReport': 'run_report',
+    'main': 'pipeline_cli',
+    'validate_raw_exports': 'Processing_0_Validating_inputs',
+    'check_raw_export': 'Processing_0_Validating_inputs',
+    'generate_eye_tracking_data': 'Processing_1_Cleaning_trials',
+    'clean_participant': 'Processing_1_Cleaning_trials',
+    'score_responses': 'Processing_2_Response_data_Combining_participants',
+    'score_trials': 'Processing_2_Response_data_Combining_participants',
+    'process_gaze_data': 'Processing_4_Eyes_to_AOIs',
+    'label_participant': 'Processing_4_Eyes_to_AOIs',
+    'build_aoi_bounds': 'Processing_4_Eyes_to_AOIs',
+    'process_fixations': 'Processing_4b_Fixations',
+    'detect_fixations': 'Processing_4b_Fixations',
+    'process_aoi_hits': 'Processing_5_AOI_hits_per_image',
+    'calculate_aoi_hits_vectorized': 'Processing_5_AOI_hits_per_image',
+    'process_scanpaths': 'Processing_5b_AOI_scanpaths',
+    'ScanpathIndex': 'Processing_5b_AOI_scanpaths',
+    'combine_aoi_hits': 'Processing_6_AOI_Combining_participants',
+    'combine_participant_hits': 'Processing_6_AOI_Combining_participants',
+    'process_ef_data': 'EF_Processing',
+    'read_store': 'cohort_store',
+    'run_pipeline': 'run_pipeline',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
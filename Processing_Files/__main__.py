@@ -0,0 +1,4 @@
+from pipeline_cli import main
+
+if __name__ == "__main__":
+    main(prog='python -m Processing_Files')
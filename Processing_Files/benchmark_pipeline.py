@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import queue
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+from synthetic_cohort import generate_synthetic_cohort
+from pipeline_paths import get_pipeline_paths
+from run_report import peak_rss_mb, describe_environment
+
+# Stages in pipeline order: (report name, module, function)
+BENCHMARK_STAGES = [
+    ('generate_eye_tracking_data', 'Processing_1_Cleaning_trials', 'generate_eye_tracking_data'),
+    ('process_gaze_data', 'Processing_4_Eyes_to_AOIs', 'process_gaze_data'),
+    ('process_fixations', 'Processing_4b_Fixations', 'process_fixations'),
+    ('process_aoi_hits', 'Processing_5_AOI_hits_per_image', 'process_aoi_hits'),
+    ('combine_aoi_hits', 'Processing_6_AOI_Combining_participants', 'combine_aoi_hits'),
+]
+
+def _run_stage(module_name, function_name, root, jobs, verbose, results):
+    """
+    Run one stage in a fresh process and report its wall time and peak RSS,
+    or the error it raised
+    """
+    try:
+        import importlib
+        stage = getattr(importlib.import_module(module_name), function_name)
+        if not verbose:
+            # Silence the stage at the file descriptor level, so its workers are quiet too
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+        start = time.perf_counter()
+        stage(jobs=jobs, force=True, paths=get_pipeline_paths(root))
+        seconds = time.perf_counter() - start
+    except Exception as e:
+        results.put({'error': f"{type(e).__name__}: {e}"})
+        return
+    results.put({'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+def time_stage(module_name, function_name, root, jobs=1, verbose=False):
+    """
+    Time one stage in its own spawned process, so peak RSS is measured for
+    that stage alone and not inherited from earlier stages.
+    Returns {'seconds', 'peak_rss_mb'}, or {'error'} if the stage raised or
+    its process died without reporting.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(module_name, function_name, root, jobs, verbose, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if process.exitcode is not None:
+                # The result may have been sent just before the process exited
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    result = {'error': f"stage process exited with code {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+def run_benchmark(n_participants=20, n_trials=24, sampling_rate=30.0, trial_duration=20.0,
+                  jobs=1, seed=0, root=None, verbose=False):
+    """
+    Generate a synthetic cohort and time every pipeline stage on it.
+    root: directory for the synthetic cohort (a temporary directory if None)
+    Returns the benchmark result as a dict.
+    """
+    with tempfile.TemporaryDirectory(prefix='fractions_benchmark_') as temp_root:
+        root = root or temp_root
+        start = time.perf_counter()
+        cohort = generate_synthetic_cohort(root, n_participants, n_trials, sampling_rate, trial_duration, seed)
+        print(f"Generated {cohort['participants']} participants with {cohort['samples']} gaze samples "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        stages = {}
+        for name, module_name, function_name in BENCHMARK_STAGES:
+            timing = time_stage(module_name, function_name, root, jobs, verbose)
+            if 'error' in timing:
+                stages[name] = {'failed': timing['error']}
+                print(f"  {name}: failed ({timing['error']})")
+                continue
+            seconds = timing['seconds']
+            stages[name] = {
+                'seconds': round(seconds, 4),
+                'samples_per_sec': round(cohort['samples'] / seconds, 1) if seconds else None,
+                'files_per_sec': round(cohort['participants'] / seconds, 2) if seconds else None,
+                'peak_rss_mb': round(timing['peak_rss_mb'], 1),
+            }
+            print(f"  {name}: {seconds:.2f}s, {stages[name]['samples_per_sec']} samples/s, "
+                  f"{stages[name]['files_per_sec']} files/s, peak RSS {stages[name]['peak_rss_mb']} MB")
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {'participants': n_participants, 'trials': n_trials, 'sampling_rate': sampling_rate,
+                   'trial_duration': trial_duration, 'jobs': jobs, 'seed': seed,
+                   'samples': cohort['samples']},
+        'environment': describe_environment(),
+        'stages': stages,
+    }
+
+def compare_benchmarks(baseline, result):
+    """Print the speed-up of every stage in result relative to baseline"""
+    print("\n=== Comparison with baseline ===")
+    if baseline.get('config') != result.get('config'):
+        print("Warning: benchmark configurations differ")
+    for name, timing in result['stages'].items():
+        baseline_timing = baseline.get('stages', {}).get(name)
+        if 'failed' in timing:
+            print(f"{name}: failed")
+            continue
+        if not baseline_timing or 'failed' in baseline_timing:
+            print(f"{name}: not in baseline")
+            continue
+        speedup = baseline_timing['seconds'] / timing['seconds'] if timing['seconds'] else float('inf')
+        print(f"{name}: {baseline_timing['seconds']:.2f}s -> {timing['seconds']:.2f}s ({speedup:.2f}x), "
+              f"peak RSS {baseline_timing['peak_rss_mb']} -> {timing['peak_rss_mb']} MB")
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('benchmark')
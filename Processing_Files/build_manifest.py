@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+
+def hash_file(path, chunk_size=1 << 20):
+    """Get the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def code_version(*source_files):
+    """Hash the source files a stage depends on into one code-version hash"""
+    digest = hashlib.sha256()
+    for source_file in source_files:
+        digest.update(os.path.basename(source_file).encode())
+        digest.update(hash_file(source_file).encode())
+    return digest.hexdigest()
+
+class BuildManifest:
+    """
+    Record of what every output file was built from.
+    For each stage and input file it stores the input content hash, the
+    hashes of shared dependencies (e.g. AOIs.csv), the stage's code-version
+    hash and the output file, so unchanged participants can be skipped.
+    Input files the stage deliberately skipped are recorded without an
+    output, so they are not reconsidered until they or a dependency change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read build manifest, rebuilding everything: {e}")
+                self.entries = {}
+
+    def input_hash(self, stage, input_file):
+        """
+        Hash an input file, reusing the recorded hash when its size and
+        modification time are unchanged.
+        """
+        stat = os.stat(input_file)
+        entry = self.entries.get(stage, {}).get(os.path.basename(input_file), {})
+        if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry['input_hash']
+        return hash_file(input_file)
+
+    def is_fresh(self, stage, input_file, dependencies):
+        """
+        Check whether the output built from input_file is up to date.
+        dependencies: dict of shared dependency hashes, including the code version
+        """
+        entry = self.entries.get(stage, {}).get(os.path.basename(input_file))
+        if entry is None or entry.get('dependencies') != dependencies:
+            return False
+        if entry.get('skipped'):
+            return entry['input_hash'] == self.input_hash(stage, input_file)
+        if not entry.get('output') or not os.path.exists(entry['output']):
+            return False
+        return entry['input_hash'] == self.input_hash(stage, input_file)
+
+    def stale_files(self, stage, input_path, files, dependencies):
+        """Get the files of input_path whose outputs are missing or out of date"""
+        return [f for f in files if not self.is_fresh(stage, os.path.join(input_path, f), dependencies)]
+
+    def record(self, stage, input_file, dependencies, output_file, skipped=False):
+        """
+        Record that output_file was built from input_file with the given dependencies.
+        skipped: the stage skipped input_file on purpose (output_file is None)
+        """
+        stat = os.stat(input_file)
+        self.entries.setdefault(stage, {})[os.path.basename(input_file)] = {
+            'input_hash': self.input_hash(stage, input_file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'dependencies': dependencies,
+            'output': output_file,
+            'skipped': skipped,
+        }
+
+    def forget_missing(self, stage, files):
+        """Drop entries of input files that no longer exist"""
+        stage_entries = self.entries.get(stage, {})
+        for name in set(stage_entries) - set(files):
+            del stage_entries[name]
+
+    def save(self):
+        """Write the manifest atomically"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
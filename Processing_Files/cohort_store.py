@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import pandas as pd
+from Processing_1_Cleaning_trials import get_condition
+from participant_runner import list_participant_files
+from build_manifest import BuildManifest, code_version
+from pipeline_paths import get_pipeline_paths
+
+# Tables of the store: AOI hits per image (written by Processing_6) and
+# AOI-labelled gaze samples (loaded from Processing_4's output by ingest_samples)
+HITS_TABLE = 'aoi_hits'
+SAMPLES_TABLE = 'aoi_samples'
+
+# Columns added to every table so subsets can be read through an index
+INDEX_COLUMNS = ['pid', 'condition', 'image_prefix']
+
+# Sample columns loaded into the store
+SAMPLE_COLUMNS = ['Image', 'HOO_Position', 'time_point', 'x', 'y', 'AOI']
+
+def _sql_type(dtype):
+    """SQLite column type of a pandas dtype, as DataFrame.to_sql maps it"""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def _sql_rows(df):
+    """Rows of df as tuples of Python values, with None for missing values"""
+    columns = [values.astype(object).where(values.notna(), None).tolist() for _, values in df.items()]
+    return zip(*columns)
+
+def get_image_prefix(images):
+    """Get the image type of each image name: P (pretest), CC or IC"""
+    return images.astype(str).str.extract(r'^([A-Za-z]+)', expand=False)
+
+class CohortStore:
+    """
+    SQLite file holding the pipeline's participant tables with indexes on
+    pid, condition (Congruent/Incongruent) and image prefix (P/CC/IC), so
+    analysts can load one participant or image type without re-reading the
+    combined CSV files. R can read it directly with RSQLite.
+    Changes, including dropping and creating tables, are made in one
+    transaction, committed by close() and rolled back by abort(). Rows are
+    inserted through the store's own connection rather than to_sql, which
+    commits on its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode, so the transaction is only the explicit BEGIN ... COMMIT
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('BEGIN')
+
+    def columns(self, table):
+        """Get the columns of a table, or None if it does not exist"""
+        rows = self.connection.execute(f'PRAGMA table_info("{table}")').fetchall()
+        return [row[1] for row in rows] or None
+
+    def drop(self, table):
+        """Remove a table and its indexes"""
+        self.connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+    def pids(self, table):
+        """Get the participants stored in a table"""
+        if self.columns(table) is None:
+            return set()
+        return {row[0] for row in self.connection.execute(f'SELECT DISTINCT pid FROM "{table}"')}
+
+    def replace_participant(self, table, pid, df, condition=None):
+        """
+        Store one participant's rows, replacing any rows stored for them.
+        condition: the participant's condition (derived from the images if None)
+        """
+        df = df.drop(columns=[c for c in INDEX_COLUMNS if c in df.columns])
+        images = df['Image'] if 'Image' in df.columns else pd.Series([], dtype=str)
+        df.insert(0, 'image_prefix', get_image_prefix(images).to_numpy() if len(images) else None)
+        df.insert(0, 'condition', condition or get_condition(images.drop_duplicates()))
+        df.insert(0, 'pid', pid)
+
+        if self.columns(table) is not None:
+            self.connection.execute(f'DELETE FROM "{table}" WHERE pid = ?', (pid,))
+        else:
+            definitions = ', '.join(f'"{column}" {_sql_type(dtype)}' for column, dtype in df.dtypes.items())
+            self.connection.execute(f'CREATE TABLE "{table}" ({definitions})')
+        names = ', '.join(f'"{column}"' for column in df.columns)
+        self.connection.executemany(f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(df.columns))})',
+                                    _sql_rows(df))
+        for columns in (['pid'], ['condition', 'pid'], ['image_prefix', 'pid']):
+            name = f"{table}_{'_'.join(columns)}"
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({", ".join(columns)})')
+
+    def retain_participants(self, table, pids):
+        """Delete the rows of participants not in pids"""
+        for pid in self.pids(table) - set(pids):
+            self.connection.execute(f'DELETE FROM "{table}" WHERE pid = ?', (pid,))
+
+    def read(self, table, pids=None, condition=None, image_prefix=None, columns=None):
+        """
+        Load the rows of a table matching every given filter.
+        pids: participant ID or list of IDs
+        condition: 'Congruent' or 'Incongruent'
+        image_prefix: 'P', 'CC' or 'IC' (or a list of them)
+        columns: columns to load (all if None)
+        """
+        clauses = []
+        parameters = []
+        for column, values in (('pid', pids), ('condition', condition), ('image_prefix', image_prefix)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            parameters += values
+        selected = ', '.join(f'"{c}"' for c in columns) if columns else '*'
+        query = f'SELECT {selected} FROM "{table}"'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        return pd.read_sql_query(query, self.connection, params=parameters)
+
+    def close(self):
+        """Commit the changes and close the file"""
+        self.connection.execute('COMMIT')
+        self.connection.close()
+
+    def abort(self):
+        """Discard the uncommitted changes and close the file"""
+        self.connection.execute('ROLLBACK')
+        self.connection.close()
+
+def read_store(pids=None, condition=None, image_prefix=None, columns=None, table=HITS_TABLE, paths=None):
+    """
+    Load a subset of a cohort store table, e.g.
+    read_store(condition='Congruent', image_prefix='CC') for the AOI hits of
+    the congruent experimental problems.
+    Raises ValueError if the store or the table has not been built yet.
+    """
+    paths = paths or get_pipeline_paths()
+    if not os.path.exists(paths.cohort_store):
+        raise ValueError(f"no cohort store at {paths.cohort_store}; run the combine stage first")
+    store = CohortStore(paths.cohort_store)
+    try:
+        if store.columns(table) is None:
+            loaded_by = 'store ingest-samples' if table == SAMPLES_TABLE else 'the combine stage'
+            raise ValueError(f"the cohort store has no {table} table; run {loaded_by} first")
+        return store.read(table, pids, condition, image_prefix, columns)
+    finally:
+        store.close()
+
+def ingest_samples(input_format='csv', force=False, paths=None):
+    """
+    Load the AOI-labelled gaze samples written by Processing_4 into the
+    store's aoi_samples table, one participant at a time; participants whose
+    file is unchanged since the last load are kept as they are.
+    input_format: format written by Processing_4 ('csv' or 'parquet')
+    """
+    from Processing_4_Eyes_to_AOIs import load_labelled_gaze
+
+    paths = paths or get_pipeline_paths()
+    input_path = paths.aoi_hit if input_format == 'csv' else paths.aoi_samples
+    all_files = list_participant_files(input_path, '.' + input_format)
+
+    manifest = BuildManifest(paths.manifest)
+    dependencies = {'code': code_version(__file__), 'input_format': input_format}
+    store = CohortStore(paths.cohort_store)
+    if force or store.columns(SAMPLES_TABLE) is None:
+        store.drop(SAMPLES_TABLE)
+        manifest.entries.pop('store_samples', None)
+    files = manifest.stale_files('store_samples', input_path, all_files, dependencies)
+    print(f"Loading samples of {len(files)} participants ({len(all_files) - len(files)} up to date)")
+
+    loaded = []
+    try:
+        for file in files:
+            pid = os.path.splitext(file)[0]
+            input_file = os.path.join(input_path, file)
+            if input_format == 'csv':
+                df = pd.read_csv(input_file, usecols=SAMPLE_COLUMNS + ['Condition'])
+            else:
+                trials_file = os.path.join(paths.aoi_trials, pid + '.parquet')
+                df = load_labelled_gaze(input_file, trials_file, trial_columns=['Image', 'HOO_Position', 'Condition'])
+            condition = df['Condition'].iloc[0] if len(df) else None
+            store.replace_participant(SAMPLES_TABLE, pid, df[SAMPLE_COLUMNS], str(condition) if condition else None)
+            loaded.append(file)
+            print(f"  {pid}: {len(df)} samples")
+        store.retain_participants(SAMPLES_TABLE, [os.path.splitext(f)[0] for f in all_files])
+    except Exception as e:
+        store.abort()
+        print(f"Error loading samples into the cohort store: {e}")
+        return
+    store.close()
+
+    for file in loaded:
+        manifest.record('store_samples', os.path.join(input_path, file), dependencies, paths.cohort_store)
+    manifest.forget_missing('store_samples', all_files)
+    manifest.save()
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('store')
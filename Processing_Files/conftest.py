@@ -0,0 +1,29 @@
+"""Shared fixtures of the pipeline tests: a small synthetic cohort run through the stages"""
+import os
+import shutil
+import pytest
+from synthetic_cohort import generate_synthetic_cohort
+from pipeline_paths import get_pipeline_paths
+
+@pytest.fixture(scope='session')
+def _built_cohort(tmp_path_factory):
+    from Processing_1_Cleaning_trials import generate_eye_tracking_data
+    from Processing_4_Eyes_to_AOIs import process_gaze_data
+    from Processing_5_AOI_hits_per_image import process_aoi_hits
+    from Processing_6_AOI_Combining_participants import combine_aoi_hits
+
+    root = str(tmp_path_factory.mktemp('cohort'))
+    generate_synthetic_cohort(root, n_participants=4, n_trials=6, trial_duration=4.0, seed=1)
+    paths = get_pipeline_paths(root)
+    generate_eye_tracking_data(paths=paths)
+    process_gaze_data(paths=paths, use_gaze_cache=False)
+    process_aoi_hits(paths=paths)
+    combine_aoi_hits(paths=paths)
+    return root
+
+@pytest.fixture
+def cohort(_built_cohort, tmp_path):
+    """PipelinePaths of a private copy of a cohort cleaned, labelled, counted and combined"""
+    root = os.path.join(tmp_path, 'cohort')
+    shutil.copytree(_built_cohort, root)
+    return get_pipeline_paths(root)
@@ -0,0 +1,91 @@
+import numpy as np
+
+# Characters removed before parsing the flattened [[t, x, y], ...] text
+_BRACKETS = str.maketrans('', '', '[]')
+
+class GazeArrayError(ValueError):
+    """Raised when a TaskGazeArray cell is malformed or truncated."""
+
+def decode_gaze_array(text):
+    """
+    Parse a TaskGazeArray cell ("[[t, x, y], ...]") into float64 arrays.
+    Returns contiguous (time, x, y) arrays of equal length.
+    Raises GazeArrayError if the text is not a complete array of finite
+    [t, x, y] triples.
+    """
+    if not isinstance(text, str):
+        raise GazeArrayError(f"expected text, got {type(text).__name__}")
+
+    gaze_array_str = text.strip().strip('"').strip()  # Remove outer quotes
+    if not (gaze_array_str.startswith('[') and gaze_array_str.endswith(']')):
+        raise GazeArrayError("array is not enclosed in brackets (truncated?)")
+
+    inner = gaze_array_str[1:-1].strip()
+    if not inner:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty.copy(), empty.copy()
+
+    # Parse all numbers at once; an empty or unparseable token fails the conversion
+    try:
+        values = np.array(inner.translate(_BRACKETS).split(','), dtype=np.float64)
+    except ValueError:
+        raise GazeArrayError("array contains a value that is not a number") from None
+
+    # Every point must be its own [t, x, y] triple: two commas up to the
+    # first point's closing bracket, then three (with the separator) per point
+    n_points = len(values) // 3
+    if len(values) % 3 != 0 or inner.count('[') != n_points or inner.count(']') != n_points:
+        raise GazeArrayError(f"{len(values)} values do not form complete [t, x, y] points")
+    characters = np.frombuffer(inner.encode(), dtype=np.uint8)
+    commas_per_point = np.diff(np.searchsorted(np.flatnonzero(characters == ord(',')),
+                                               np.flatnonzero(characters == ord(']'))), prepend=-1)
+    if (commas_per_point != 3).any():
+        raise GazeArrayError(f"{len(values)} values do not form complete [t, x, y] points")
+    if not np.isfinite(values).all():
+        raise GazeArrayError("array contains non-finite values")
+
+    time_points, x, y = values.reshape(n_points, 3).T.copy()
+    return time_points, x, y
+
+def find_malformed_gaze_arrays(gaze_arrays):
+    """
+    Check a sequence of TaskGazeArray cells.
+    Returns a list of (position, error message) for every cell that cannot
+    be decoded, in input order.
+    """
+    errors = []
+    for position, text in enumerate(gaze_arrays):
+        try:
+            decode_gaze_array(text)
+        except GazeArrayError as e:
+            errors.append((position, str(e)))
+    return errors
+
+# Longest interval (ms) between recorded samples that resampling
+# interpolates across; grid points inside longer gaps (tracking lost) are dropped
+MAX_RESAMPLE_GAP = 250.0
+
+def resample_gaze(time_points, x, y, rate, max_gap=MAX_RESAMPLE_GAP):
+    """
+    Interpolate one trial's gaze samples onto a uniform time grid.
+    time_points: sample times in ms (any order; NaN times are dropped)
+    rate: samples per second of the grid, which starts at the first sample
+    and ends at or before the last one
+    max_gap: leave out grid points between samples more than this many ms apart
+    Returns (time, x, y) float64 arrays on the grid, linearly interpolated.
+    """
+    keep = ~np.isnan(time_points)
+    time_points, order = np.unique(time_points[keep], return_index=True)  # sorted, first of tied times
+    x = x[keep][order]
+    y = y[keep][order]
+    if len(time_points) < 2:
+        return time_points, x, y
+
+    step = 1000.0 / rate
+    grid = time_points[0] + step * np.arange(int(np.floor((time_points[-1] - time_points[0]) / step)) + 1)
+
+    # Drop grid points that fall in a gap between two distant samples
+    before = np.searchsorted(time_points, grid, side='right') - 1
+    gaps = time_points[np.minimum(before + 1, len(time_points) - 1)] - time_points[before]
+    grid = grid[(gaps <= max_gap) | (time_points[before] == grid)]
+    return grid, np.interp(grid, time_points, x), np.interp(grid, time_points, y)
@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import gaze_arrays
+from gaze_arrays import decode_gaze_array, GazeArrayError
+from build_manifest import hash_file, code_version
+
+# Sample arrays of a cached participant, one float64 value per gaze point
+SAMPLE_ARRAYS = ['time_point', 'x', 'y']
+
+def _source_stamp(source_file):
+    """Size and modification time of a source file"""
+    stat = os.stat(source_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _cache_code():
+    """
+    Version of the decoding code the cached arrays were made with, and of the
+    pandas and numpy that wrote them (trials.pkl may not load in another)
+    """
+    return f"{code_version(__file__, gaze_arrays.__file__)}-pandas{pd.__version__}-numpy{np.__version__}"
+
+class GazeCache:
+    """
+    Decoded TaskGazeArray samples of one Pavlovia_Data file, saved once as
+    .npy arrays (time_point, x, y of every trial, concatenated) with an
+    offsets index, and memory-mapped when read back, so relabelling runs
+    skip reading and parsing the gaze text.
+    A cache directory holds time_point.npy, x.npy, y.npy, offsets.npy
+    (trial i's samples are [offsets[i], offsets[i + 1])), trials.pkl (the
+    trial rows without TaskGazeArray) and meta.json, written last, with
+    the source file's hash and the trials that could not be decoded.
+    """
+
+    def __init__(self, cache_dir, meta):
+        self.cache_dir = cache_dir
+        self.meta = meta
+        self.errors = {int(position): error for position, error in meta['errors'].items()}
+        self.offsets = np.load(os.path.join(cache_dir, 'offsets.npy'))
+        self.trials_df = pd.read_pickle(os.path.join(cache_dir, 'trials.pkl'))
+        self.arrays = [np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') if self.offsets[-1] else
+                       np.empty(0, dtype=np.float64) for name in SAMPLE_ARRAYS]
+
+        # A cache whose files disagree with meta.json was damaged after it was written
+        if len(self.offsets) - 1 != meta['n_trials'] or len(self.trials_df) != meta['n_trials'] or \
+                self.offsets[-1] != meta['n_samples'] or any(len(array) != meta['n_samples'] for array in self.arrays):
+            raise ValueError("cache files do not match meta.json")
+
+    @classmethod
+    def open(cls, cache_dir, source_file):
+        """
+        Open the cache of source_file, or return None if there is none, it
+        was made from a different version of the file or with other code, or
+        it cannot be read (the caller then rebuilds it).
+        """
+        meta_file = os.path.join(cache_dir, 'meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if meta.get('code') != _cache_code():
+                return None
+            stamp = _source_stamp(source_file)
+            if meta['source'] != stamp:
+                # Touched or copied but unchanged files keep their cache
+                if meta['source_hash'] != hash_file(source_file):
+                    return None
+                meta['source'] = stamp
+                with open(meta_file, 'w') as f:
+                    json.dump(meta, f)
+            return cls(cache_dir, meta)
+        except Exception as e:
+            # Includes unpickling errors, whatever their type
+            print(f"  Ignoring unreadable gaze cache {cache_dir}: {e}")
+            return None
+
+    @property
+    def n_trials(self):
+        return len(self.offsets) - 1
+
+    def trials(self):
+        """Get the trial rows of the source file, without TaskGazeArray"""
+        return self.trials_df
+
+    def decode(self, position):
+        """
+        Get trial position's (time, x, y) arrays as read-only views of the
+        mapped files, like decode_gaze_array does for the gaze text.
+        Raises GazeArrayError if the trial's text could not be decoded.
+        """
+        if position in self.errors:
+            raise GazeArrayError(self.errors[position])
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return tuple(array[start:end] for array in self.arrays)
+
+class GazeCacheWriter:
+    """
+    Decode a file's gaze text one trial at a time while saving the samples
+    into a GazeCache, keeping memory bounded: samples are appended to
+    temporary raw files and turned into .npy files by close().
+    """
+
+    def __init__(self, cache_dir, source_file, trials_df):
+        self.cache_dir = cache_dir
+        self.source_file = source_file
+        self.stamp = _source_stamp(source_file)
+        self.errors = {}
+        self.offsets = [0]
+
+        # Remove any stale cache first, so a partly written one is never used
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
+        trials_df.to_pickle(os.path.join(cache_dir, 'trials.pkl'))
+        self.raw_files = [open(os.path.join(cache_dir, name + '.raw'), 'wb') for name in SAMPLE_ARRAYS]
+
+    def decode(self, gaze_array):
+        """Decode the next trial's gaze text (see decode_gaze_array) and cache the samples"""
+        try:
+            arrays = decode_gaze_array(gaze_array)
+        except GazeArrayError as e:
+            self.errors[len(self.offsets) - 1] = str(e)
+            self.offsets.append(self.offsets[-1])
+            raise
+        for raw_file, array in zip(self.raw_files, arrays):
+            raw_file.write(array.astype('<f8', copy=False).tobytes())
+        self.offsets.append(self.offsets[-1] + len(arrays[0]))
+        return arrays
+
+    def close(self):
+        """Write the .npy files and meta.json, making the cache usable"""
+        n_samples = self.offsets[-1]
+        for name, raw_file in zip(SAMPLE_ARRAYS, self.raw_files):
+            raw_file.close()
+            raw_path = os.path.join(self.cache_dir, name + '.raw')
+            with open(os.path.join(self.cache_dir, name + '.npy'), 'wb') as npy_file, open(raw_path, 'rb') as raw:
+                np.lib.format.write_array_header_1_0(
+                    npy_file, {'descr': '<f8', 'fortran_order': False, 'shape': (n_samples,)})
+                shutil.copyfileobj(raw, npy_file)
+            os.remove(raw_path)
+        np.save(os.path.join(self.cache_dir, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+
+        meta = {
+            'source': self.stamp,
+            'source_hash': hash_file(self.source_file),
+            'code': _cache_code(),
+            'n_trials': len(self.offsets) - 1,
+            'n_samples': n_samples,
+            'errors': self.errors,
+        }
+        with open(os.path.join(self.cache_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
@@ -0,0 +1,151 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from run_report import collect_timings, merge_timings, instrumented_call, timed_phase
+
+# Number of participant files read ahead, and of writes queued behind, by default
+PREFETCH_DEPTH = 2
+
+# Writers started by async_writes; write_behind uses the innermost one
+_writers = []
+
+class PrefetchedRead:
+    """A participant file's input being read on a background thread"""
+
+    def __init__(self, future, report=None, file=None):
+        self.future = future
+        self.report = report
+        self.file = file
+
+    def result(self):
+        """
+        Wait for the read and return its result, raising its error if it
+        failed, and add its timings to the current file (or, with a report,
+        record it as a file of its own).
+        """
+        result, timings = self.future.result()
+        if self.report is not None:
+            self.report.record_file(self.file, timings)
+        else:
+            merge_timings(timings)
+        return result
+
+def prefetch_reads(read_file, files, depth=PREFETCH_DEPTH, report=None, **kwargs):
+    """
+    Read participant files ahead of the one being processed: read_file(file,
+    **kwargs) runs on depth background threads, so at most depth reads are
+    in flight (and in memory) besides the file handed out.
+    report: run each read as its own file of this run_report.RunReport
+    instead of adding its timings to the file being processed
+    Yields (file, PrefetchedRead) in the order of files.
+    """
+    files = iter(files)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(depth, 1)) as executor:
+        def submit():
+            file = next(files, None)
+            if file is None:
+                return
+            if report is not None:
+                future = executor.submit(instrumented_call, read_file, report.profile_file(file), file, **kwargs)
+            else:
+                future = executor.submit(collect_timings, _background_read, read_file, file, **kwargs)
+            pending.append((file, PrefetchedRead(future, report, file)))
+
+        for _ in range(max(depth, 1)):
+            submit()
+        while pending:
+            file, read = pending.popleft()
+            submit()
+            yield file, read
+
+def _background_read(read_file, file, **kwargs):
+    with timed_phase('background_read'):
+        return read_file(file, **kwargs)
+
+class AsyncWriter:
+    """
+    Run writes on one background thread, in the order they were queued, so
+    the next file is processed while the last one is written. At most
+    max_pending writes (and the data they hold) wait in the queue; queueing
+    more blocks until one is done.
+    Writes that fail are reported and recorded in failed, by the tag that
+    was current when they were queued (the participant file).
+    """
+
+    def __init__(self, max_pending=PREFETCH_DEPTH):
+        self.queue = queue.Queue(maxsize=max(max_pending, 1))
+        self.tag = None
+        self.failed = {}
+        self.seconds = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, write, *args, **kwargs):
+        """Queue write(*args, **kwargs)"""
+        self.queue.put((self.tag, write, args, kwargs))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            tag, write, args, kwargs = item
+            start = time.perf_counter()
+            try:
+                write(*args, **kwargs)
+            except Exception as e:
+                print(f"Error writing output of {tag}: {e}")
+                self.failed.setdefault(tag, str(e))
+            self.seconds[tag] = self.seconds.get(tag, 0) + time.perf_counter() - start
+
+    def close(self):
+        """Wait for every queued write to finish"""
+        self.queue.put(None)
+        self.thread.join()
+
+@contextmanager
+def async_writes(max_pending=PREFETCH_DEPTH):
+    """Send the write_behind calls of the with block to an AsyncWriter, finished on exit"""
+    writer = AsyncWriter(max_pending)
+    _writers.append(writer)
+    try:
+        yield writer
+    finally:
+        _writers.remove(writer)
+        writer.close()
+
+def write_behind(write, *args, **kwargs):
+    """
+    Write a participant's output on the background writer of async_writes,
+    or right away when there is none (e.g. in a worker process).
+    The data passed must not be changed afterwards.
+    """
+    if _writers:
+        _writers[-1].submit(write, *args, **kwargs)
+    else:
+        write(*args, **kwargs)
+
+def read_input_file(read, input_path, file):
+    """Call read on a participant file's path; partial(read_input_file, read, input_path) makes a read_file"""
+    return read(os.path.join(input_path, file))
+
+def read_if_path(data, read):
+    """
+    Get a stage's input table from either a DataFrame, returned as it is, or
+    a file path, read with read, so stage functions can be called in-process
+    by other tooling with whichever it has.
+    """
+    if isinstance(data, (str, os.PathLike)):
+        return read(data)
+    return data
+
+def mark_failed(result):
+    """Turn a stage's per-file result into a failed one (see run_report.file_failed)"""
+    if isinstance(result, dict):
+        return dict(result, processed=False)
+    return None
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from participant_io import PREFETCH_DEPTH, prefetch_reads, async_writes, mark_failed
+
+def list_participant_files(input_path, extension='.csv'):
+    """Get the participant files of a stage's input directory in a fixed (sorted) order"""
+    return sorted(f for f in os.listdir(input_path) if f.endswith(extension))
+
+def run_participant_files(process_file, files, jobs=1, report=None, read_file=None, prefetch=PREFETCH_DEPTH,
+                          **kwargs):
+    """
+    Run process_file(file, **kwargs) for every participant file.
+    process_file must be a module-level function that handles its own
+    errors, so one bad file never stops the others.
+    jobs: number of worker processes (1 runs serially, 0 uses all cores)
+    report: a run_report.RunReport to record every file's timings in (optional)
+    read_file: a function reading one file's input; when files run serially,
+    the next prefetch files are read on background threads while the current
+    one is processed, and passed to process_file as prefetched=
+    (a participant_io.PrefetchedRead), and the write_behind calls of
+    process_file are written on a background thread, at most prefetch queued
+    prefetch: number of files read ahead and writes queued (0 overlaps nothing)
+    Returns the results in the order of files, whatever the number of workers.
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if report is not None:
+        from run_report import instrumented_call
+        calls = [partial(instrumented_call, process_file, report.profile_file(file)) for file in files]
+    else:
+        calls = [process_file] * len(files)
+
+    write_seconds = {}
+    if jobs == 1 and read_file is not None and prefetch > 0 and len(files) > 1:
+        results, write_seconds = _run_overlapped(calls, files, read_file, prefetch, kwargs)
+    elif jobs == 1 or len(files) <= 1:
+        results = [call(file, **kwargs) for call, file in zip(calls, files)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+            results = list(executor.map(partial(_call_with_kwargs, kwargs=kwargs), calls, files))
+
+    if report is None:
+        return results
+    for file, (_, file_report) in zip(files, results):
+        if write_seconds.get(file):
+            file_report['phases']['background_write'] = round(write_seconds[file], 4)
+        report.record_file(file, file_report)
+    return [result for result, _ in results]
+
+def _run_overlapped(calls, files, read_file, prefetch, kwargs):
+    """
+    Run the calls serially with their input read ahead and their outputs
+    written behind (see run_participant_files).
+    Returns (results, background write seconds by file); files whose
+    writes failed get a failed result.
+    """
+    results = []
+    with async_writes(prefetch) as writer:
+        for call, (file, prefetched) in zip(calls, prefetch_reads(read_file, files, prefetch)):
+            writer.tag = file
+            results.append(call(file, prefetched=prefetched, **kwargs))
+    for i, file in enumerate(files):
+        if file in writer.failed:
+            result = results[i]
+            results[i] = (mark_failed(result[0]), dict(result[1], failed=True)) \
+                if isinstance(result, tuple) else mark_failed(result)
+    return results, writer.seconds
+
+def _call_with_kwargs(call, file, kwargs):
+    """Run call(file, **kwargs) in a worker process"""
+    return call(file, **kwargs)
+
+def add_jobs_argument(parser):
+    """Add the shared --jobs option to a stage's command line parser"""
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of participant files processed in parallel (0 = all cores)")
+
+def add_force_argument(parser):
+    """Add the shared --force option that ignores the build manifest"""
+    parser.add_argument('--force', action='store_true',
+                        help="reprocess every participant file, even if it is up to date")
+
+def add_prefetch_argument(parser):
+    """Add the shared --prefetch option that overlaps reads and writes with processing"""
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_DEPTH,
+                        help="number of participant files read ahead and writes queued behind "
+                             "when files run serially (0 = read, process and write in turn)")
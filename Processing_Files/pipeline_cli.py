@@ -0,0 +1,313 @@
+import sys
+import argparse
+import importlib
+from participant_runner import add_jobs_argument, add_force_argument, add_prefetch_argument
+from pipeline_paths import get_pipeline_paths, add_root_argument
+from run_report import RunReport, add_report_arguments
+
+# This module only imports the standard library and the pipeline's light
+# helpers; a stage's module (and pandas with it) is imported when it runs,
+# so --help and argument errors are immediate.
+
+def _stage_function(module_name, function_name):
+    """Import a stage module on first use and get one of its functions"""
+    return getattr(importlib.import_module(module_name), function_name)
+
+def _run_stage(args, report_name, module_name, function_name, **kwargs):
+    """Run a stage function under a run report built from the report options"""
+    report = RunReport.from_arguments(args)
+    with report.stage(report_name):
+        _stage_function(module_name, function_name)(paths=get_pipeline_paths(args.root), report=report, **kwargs)
+    report.save()
+
+def _given(**kwargs):
+    """Keep the options that were given, so the stage's own defaults apply to the others"""
+    return {name: value for name, value in kwargs.items() if value is not None}
+
+def add_validate_arguments(parser):
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only report problems, without moving files")
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_validate(args):
+    _run_stage(args, 'validate', 'Processing_0_Validating_inputs', 'validate_raw_exports',
+               jobs=args.jobs, force=args.force, dry_run=args.dry_run)
+
+def add_clean_arguments(parser):
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_prefetch_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_clean(args):
+    _run_stage(args, 'clean', 'Processing_1_Cleaning_trials', 'generate_eye_tracking_data',
+               jobs=args.jobs, force=args.force, prefetch=args.prefetch)
+
+def add_score_arguments(parser):
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_score(args):
+    _run_stage(args, 'score', 'Processing_2_Response_data_Combining_participants', 'score_responses',
+               jobs=args.jobs, force=args.force)
+
+def add_label_arguments(parser):
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="csv: denormalized AOI_hit files; parquet: AOI_samples + AOI_trials tables")
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_prefetch_argument(parser)
+    add_root_argument(parser)
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="stream each file, writing batches of this many samples")
+    parser.add_argument('--resample-rate', type=float, default=None,
+                        help="interpolate each trial onto a uniform grid of this many samples per second")
+    parser.add_argument('--no-gaze-cache', action='store_true',
+                        help="parse the gaze text every time instead of using Processing_Files/Gaze_Cache")
+    add_report_arguments(parser)
+
+def run_label(args):
+    _run_stage(args, 'label', 'Processing_4_Eyes_to_AOIs', 'process_gaze_data',
+               output_format=args.format, jobs=args.jobs, force=args.force, chunk_size=args.chunk_size,
+               use_gaze_cache=not args.no_gaze_cache, resample_rate=args.resample_rate, prefetch=args.prefetch)
+
+def add_fixations_arguments(parser):
+    parser.add_argument('--method', choices=['ivt', 'idt'], default='ivt',
+                        help="velocity (I-VT) or dispersion (I-DT) threshold detection")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="format written by Processing_4")
+    parser.add_argument('--velocity-threshold', type=float, default=None,
+                        help="I-VT threshold in height units per second (default: VELOCITY_THRESHOLD)")
+    parser.add_argument('--dispersion-threshold', type=float, default=None,
+                        help="I-DT threshold in height units (default: DISPERSION_THRESHOLD)")
+    parser.add_argument('--min-duration', type=float, default=None,
+                        help="shortest fixation in ms (default: MIN_FIXATION_DURATION)")
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_fixations(args):
+    _run_stage(args, 'fixations', 'Processing_4b_Fixations', 'process_fixations',
+               method=args.method, input_format=args.format, jobs=args.jobs, force=args.force,
+               **_given(velocity_threshold=args.velocity_threshold,
+                        dispersion_threshold=args.dispersion_threshold, min_duration=args.min_duration))
+
+def add_hits_arguments(parser):
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="format written by Processing_4")
+    parser.add_argument('--fixations', action='store_true',
+                        help="add fixation count and dwell time columns from the fixations stage's output")
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_prefetch_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_hits(args):
+    _run_stage(args, 'hits', 'Processing_5_AOI_hits_per_image', 'process_aoi_hits',
+               input_format=args.format, jobs=args.jobs, force=args.force,
+               fixations=args.fixations, prefetch=args.prefetch)
+
+def add_scanpaths_arguments(parser):
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="build the index from Processing_4's labelled samples")
+    build_parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                              help="format written by Processing_4")
+    build_parser.add_argument('--max-n', type=int, default=None, help="longest n-gram indexed (default: MAX_NGRAM)")
+    add_jobs_argument(build_parser)
+    add_force_argument(build_parser)
+    add_root_argument(build_parser)
+    add_report_arguments(build_parser)
+
+    query_parser = subparsers.add_parser('query', help="list the viewings whose scanpath contains a pattern")
+    query_parser.add_argument('pattern', help="AOIs visited in a row, e.g. 'H_N1>H_D1>H_O'")
+    query_parser.add_argument('--output', default=None, help="CSV file for the matches (default: print them)")
+    add_root_argument(query_parser)
+
+def run_scanpaths(args):
+    if args.command == 'build':
+        _run_stage(args, 'scanpaths', 'Processing_5b_AOI_scanpaths', 'process_scanpaths',
+                   input_format=args.format, jobs=args.jobs, force=args.force, **_given(max_n=args.max_n))
+        return
+    import time
+    index = _stage_function('Processing_5b_AOI_scanpaths', 'ScanpathIndex')(get_pipeline_paths(args.root).scanpaths)
+    start = time.perf_counter()
+    matches_df = index.query(args.pattern)
+    elapsed = time.perf_counter() - start
+    if args.output:
+        matches_df.to_csv(args.output, index=False)
+    else:
+        print(matches_df.to_string(index=False))
+    print(f"{len(matches_df)} viewings match ({elapsed * 1000:.2f} ms)")
+
+def add_combine_arguments(parser):
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="format of the combined output file")
+    parser.add_argument('--fixations', action='store_true',
+                        help="expect the fixation columns added by Processing_5 --fixations")
+    add_jobs_argument(parser)
+    add_force_argument(parser)
+    add_prefetch_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_combine(args):
+    _run_stage(args, 'combine', 'Processing_6_AOI_Combining_participants', 'combine_aoi_hits',
+               jobs=args.jobs, force=args.force, output_format=args.format, fixations=args.fixations,
+               prefetch=args.prefetch)
+
+def add_ef_arguments(parser):
+    parser.add_argument('--input', default=None,
+                        help="directory of the ACE exports (default: EF ACE raw files)")
+    parser.add_argument('--replace', action='store_true',
+                        help="overwrite an EF_data_combined.csv not written by this stage even if the scores differ")
+    add_force_argument(parser)
+    add_root_argument(parser)
+    add_report_arguments(parser)
+
+def run_ef(args):
+    report = RunReport.from_arguments(args)
+    with report.stage('ef'):
+        _stage_function('EF_Processing', 'process_ef_data')(
+            force=args.force, paths=get_pipeline_paths(args.root), input_path=args.input, replace=args.replace)
+    report.save()
+
+def add_store_arguments(parser):
+    # Table names of cohort_store, which imports pandas
+    tables = ['aoi_hits', 'aoi_samples']
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest-samples', help="load Processing_4's labelled samples")
+    ingest_parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                               help="format written by Processing_4")
+    add_force_argument(ingest_parser)
+    add_root_argument(ingest_parser)
+
+    query_parser = subparsers.add_parser('query', help="save a subset of a table as CSV")
+    query_parser.add_argument('--table', choices=tables, default=tables[0])
+    query_parser.add_argument('--pid', nargs='+', default=None)
+    query_parser.add_argument('--condition', choices=['Congruent', 'Incongruent'], default=None)
+    query_parser.add_argument('--image-prefix', nargs='+', choices=['P', 'CC', 'IC'], default=None)
+    query_parser.add_argument('--output', required=True, help="CSV file for the subset")
+    add_root_argument(query_parser)
+
+def run_store(args):
+    if args.command == 'ingest-samples':
+        _stage_function('cohort_store', 'ingest_samples')(
+            input_format=args.format, force=args.force, paths=get_pipeline_paths(args.root))
+        return
+    try:
+        subset = _stage_function('cohort_store', 'read_store')(
+            args.pid, args.condition, args.image_prefix, table=args.table, paths=get_pipeline_paths(args.root))
+    except ValueError as e:
+        print(f"Error reading the cohort store: {e}")
+        return
+    subset.to_csv(args.output, index=False)
+    print(f"Saved {len(subset)} rows to {args.output}")
+
+def add_run_arguments(parser):
+    add_jobs_argument(parser)
+    add_root_argument(parser)
+    parser.add_argument('--keep-intermediate', action='store_true',
+                        help="also write Pavlovia_Data and AOI_hit files for debugging")
+    parser.add_argument('--fixations', choices=['ivt', 'idt'], default=None,
+                        help="add fixation count and dwell time columns using this detection method")
+    parser.add_argument('--resample-rate', type=float, default=None,
+                        help="interpolate each trial onto a uniform grid of this many samples per second")
+    parser.add_argument('--skip-validation', action='store_true',
+                        help="do not check and quarantine malformed raw exports first")
+    add_report_arguments(parser)
+
+def run_run(args):
+    report = RunReport.from_arguments(args)
+    if not args.skip_validation:
+        with report.stage('validate'):
+            _stage_function('Processing_0_Validating_inputs', 'validate_raw_exports')(
+                jobs=args.jobs, paths=get_pipeline_paths(args.root), report=report)
+    with report.stage('pipeline'):
+        _stage_function('run_pipeline', 'run_pipeline')(
+            paths=get_pipeline_paths(args.root), jobs=args.jobs, keep_intermediate=args.keep_intermediate,
+            fixations=args.fixations, report=report, resample_rate=args.resample_rate)
+    report.save()
+
+def add_benchmark_arguments(parser):
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--trials', type=int, default=24, help="trials per participant (at most 24)")
+    parser.add_argument('--sampling-rate', type=float, default=30.0, help="mean gaze samples per second")
+    parser.add_argument('--trial-duration', type=float, default=20.0, help="mean trial length in seconds")
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--root', default=None, help="keep the synthetic cohort in this directory")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', default=None, help="earlier JSON result to compare against")
+    parser.add_argument('--verbose', action='store_true', help="show the stages' own output")
+
+def run_benchmark(args):
+    import json
+    result = _stage_function('benchmark_pipeline', 'run_benchmark')(
+        args.participants, args.trials, args.sampling_rate, args.trial_duration,
+        args.jobs, args.seed, args.root, args.verbose)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _stage_function('benchmark_pipeline', 'compare_benchmarks')(json.load(f), result)
+
+# Subcommands in pipeline order: name -> (script, description, add_arguments, run)
+COMMANDS = {
+    'validate': ('Processing_0_Validating_inputs.py', "Check raw Pavlovia exports and quarantine the malformed ones",
+                 add_validate_arguments, run_validate),
+    'clean': ('Processing_1_Cleaning_trials.py', "Clean raw Pavlovia exports into per-participant trial files",
+              add_clean_arguments, run_clean),
+    'score': ('Processing_2_Response_data_Combining_participants.py', "Score the fraction answers of all participants",
+              add_score_arguments, run_score),
+    'label': ('Processing_4_Eyes_to_AOIs.py', "Label gaze samples with AOIs", add_label_arguments, run_label),
+    'fixations': ('Processing_4b_Fixations.py', "Detect fixations in the AOI-labelled gaze samples",
+                  add_fixations_arguments, run_fixations),
+    'hits': ('Processing_5_AOI_hits_per_image.py', "Count AOI hits per image", add_hits_arguments, run_hits),
+    'scanpaths': ('Processing_5b_AOI_scanpaths.py', "Index AOI scanpaths and transitions, or query the index",
+                  add_scanpaths_arguments, run_scanpaths),
+    'combine': ('Processing_6_AOI_Combining_participants.py', "Combine AOI hits per image of all participants",
+                add_combine_arguments, run_combine),
+    'ef': ('EF_Processing.py', "Score the ACE executive-function tasks", add_ef_arguments, run_ef),
+    'store': ('cohort_store.py', "Load samples into, or read subsets from, the cohort store",
+              add_store_arguments, run_store),
+    'run': ('run_pipeline.py', "Run the eye-tracking pipeline end to end", add_run_arguments, run_run),
+    'benchmark': ('benchmark_pipeline.py', "Benchmark the pipeline on a synthetic cohort",
+                  add_benchmark_arguments, run_benchmark),
+}
+
+def build_parser(prog=None):
+    """Build the command line parser with one subcommand per stage"""
+    parser = argparse.ArgumentParser(prog=prog, description="Process the fractions eye-tracking study")
+    subparsers = parser.add_subparsers(dest='stage', required=True, metavar='stage')
+    for name, (_, description, add_arguments, run) in COMMANDS.items():
+        stage_parser = subparsers.add_parser(name, help=description, description=description)
+        add_arguments(stage_parser)
+        stage_parser.set_defaults(run=run)
+    return parser
+
+def run_script(stage):
+    """Run one stage's subcommand with the arguments of its own script (e.g. Processing_4 --force)"""
+    script, description, add_arguments, run = COMMANDS[stage]
+    parser = argparse.ArgumentParser(prog=script, description=description)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+def main(argv=None, prog=None):
+    """Run the subcommand given on the command line (python -m Processing_Files <stage> ...)"""
+    args = build_parser(prog).parse_args(sys.argv[1:] if argv is None else argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
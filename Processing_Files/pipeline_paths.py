@@ -0,0 +1,78 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+# Environment variable that points the pipeline at another project root
+PROJECT_ROOT_VARIABLE = 'FRACTIONS_PROJECT_ROOT'
+
+@dataclass(frozen=True)
+class PipelinePaths:
+    """Every input, intermediate and output location of the pipeline"""
+    root: str
+    raw_data: str
+    quarantine: str
+    participant_ids: str
+    aois: str
+    pavlovia_data: str
+    gaze_cache: str
+    aoi_hit: str
+    aoi_samples: str
+    aoi_trials: str
+    fixations: str
+    aoi_hit_per_image: str
+    aoi_hits_combined: str
+    scanpaths: str
+    math_data: str
+    math_summary: str
+    response_data: str
+    ef_raw_data: str
+    ef_sessions: str
+    ef_combined: str
+    ef_candidate: str
+    cohort_store: str
+    manifest: str
+
+def get_pipeline_paths(root=None):
+    """
+    Resolve all pipeline paths from one project root.
+    root defaults to $FRACTIONS_PROJECT_ROOT, or else the directory above
+    Processing_Files. Folder names follow the repository's casing
+    (Input_Files, Processing_Files, Output_Files) on every platform.
+    """
+    if root is None:
+        root = os.environ.get(PROJECT_ROOT_VARIABLE) or Path(__file__).resolve().parent.parent
+    root = str(Path(root).resolve())
+
+    input_files = os.path.join(root, 'Input_Files')
+    processing_files = os.path.join(root, 'Processing_Files')
+    output_files = os.path.join(root, 'Output_Files')
+    return PipelinePaths(
+        root=root,
+        raw_data=os.path.join(input_files, 'Raw_di-data'),
+        quarantine=os.path.join(input_files, 'Quarantine'),
+        participant_ids=os.path.join(input_files, 'participant_ids.csv'),
+        aois=os.path.join(input_files, 'AOIs.csv'),
+        pavlovia_data=os.path.join(processing_files, 'Pavlovia_Data'),
+        gaze_cache=os.path.join(processing_files, 'Gaze_Cache'),
+        aoi_hit=os.path.join(processing_files, 'AOI_hit'),
+        aoi_samples=os.path.join(processing_files, 'AOI_samples'),
+        aoi_trials=os.path.join(processing_files, 'AOI_trials'),
+        fixations=os.path.join(processing_files, 'Fixations'),
+        aoi_hit_per_image=os.path.join(output_files, 'AOI_hit_per_image'),
+        aoi_hits_combined=os.path.join(output_files, 'AOI_hits_combined.csv'),
+        scanpaths=os.path.join(output_files, 'Scanpaths'),
+        math_data=os.path.join(output_files, 'Math_data.csv'),
+        math_summary=os.path.join(output_files, 'Math_summary.csv'),
+        response_data=os.path.join(output_files, 'Response_data.csv'),
+        ef_raw_data=os.path.join(root, 'EF ACE raw files'),
+        ef_sessions=os.path.join(processing_files, 'EF_sessions.csv'),
+        ef_combined=os.path.join(output_files, 'EF_data_combined.csv'),
+        ef_candidate=os.path.join(processing_files, 'EF_data_combined_candidate.csv'),
+        cohort_store=os.path.join(output_files, 'cohort_store.sqlite'),
+        manifest=os.path.join(processing_files, 'build_manifest.json'),
+    )
+
+def add_root_argument(parser):
+    """Add the shared --root option to a stage's command line parser"""
+    parser.add_argument('--root', default=None,
+                        help=f"project root (default: ${PROJECT_ROOT_VARIABLE} or the repository)")
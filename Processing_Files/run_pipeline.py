@@ -0,0 +1,118 @@
+import os
+from Processing_1_Cleaning_trials import read_raw_export, clean_participant, read_participant_ids
+from Processing_4_Eyes_to_AOIs import read_aois, build_aoi_bounds, label_participant, build_labelled_table
+from vocabulary_registry import build_vocabularies, encode_categoricals
+from Processing_4b_Fixations import TRIAL_COLUMNS, detect_fixations
+from Processing_5_AOI_hits_per_image import get_all_possible_aois, calculate_aoi_hits_vectorized, add_fixation_metrics
+from Processing_6_AOI_Combining_participants import combine_participant_hits
+from participant_runner import list_participant_files, run_participant_files
+from pipeline_paths import get_pipeline_paths
+from run_report import timed_phase
+
+def run_participant(filename, paths, all_IDs, aoi_bounds, vocabularies, all_possible_aois, keep_intermediate=False,
+                    fixations=None, resample_rate=None):
+    """
+    Run cleaning, AOI labelling and per-image hit counting for one raw
+    export, handing DataFrames from stage to stage in memory, with AOI,
+    Image, HOO_Position and Condition encoded over the shared vocabularies.
+    keep_intermediate: also save the Pavlovia_Data and AOI_hit files
+    fixations: also add fixation metrics detected with this method ('ivt' or 'idt')
+    resample_rate: resample each trial to this many samples per second before labelling
+    Returns (hits per image with pid, point counters), or None if the
+    participant was skipped or failed.
+    """
+    print(f"\nProcessing file: {filename}")
+    try:
+        with timed_phase('read'):
+            df = read_raw_export(os.path.join(paths.raw_data, filename))
+        with timed_phase('clean'):
+            cleaned = clean_participant(df, all_IDs)
+        if cleaned is None:
+            return None
+        PID, trials_df = cleaned
+        if keep_intermediate:
+            trials_df.to_csv(os.path.join(paths.pavlovia_data, PID + '.csv'), index=False)
+
+        samples_df, trials_df, counters = label_participant(trials_df, aoi_bounds, resample_rate=resample_rate)
+        if keep_intermediate:
+            build_labelled_table(samples_df, trials_df).to_csv(
+                os.path.join(paths.aoi_hit, PID + '.csv'), index=False)
+
+        labelled_df = build_labelled_table(samples_df, encode_categoricals(trials_df, vocabularies),
+                                           trial_columns=TRIAL_COLUMNS)
+        with timed_phase('hits'):
+            hits_df = calculate_aoi_hits_vectorized(labelled_df, all_possible_aois)
+        if fixations:
+            with timed_phase('fixations'):
+                hits_df = add_fixation_metrics(hits_df, detect_fixations(labelled_df, fixations),
+                                               all_possible_aois)
+        with timed_phase('write'):
+            hits_df.to_csv(os.path.join(paths.aoi_hit_per_image, PID + '.csv'), index=False)
+        print(f"  {PID}: {counters['points']} points, {len(hits_df)} images")
+
+        hits_df['pid'] = PID
+        return hits_df, counters
+    except Exception as e:
+        print(f"  Error processing file {filename}: {e}")
+        return None
+
+def run_pipeline(paths=None, jobs=1, keep_intermediate=False, fixations=None, report=None, resample_rate=None):
+    """
+    Run the whole eye-tracking pipeline (Processing_1, 4, 5 and 6) in one go.
+    Each participant goes from raw export to AOI hits per image without
+    intermediate CSV round-trips; only AOI_hit_per_image and
+    AOI_hits_combined.csv are written, unless keep_intermediate is set.
+    Unlike the separate stages, every participant is always reprocessed, and
+    the cohort store is not updated: run the combine stage afterwards to
+    load the hits into it for read_store.
+    fixations: also add fixation count and dwell time columns ('ivt' or 'idt')
+    report: a run_report.RunReport to record per-file timings in (optional)
+    resample_rate: interpolate each trial onto a uniform grid of this many
+    samples per second before labelling (None keeps the recorded samples)
+    """
+    paths = paths or get_pipeline_paths()
+    print("\nStarting pipeline...")
+
+    output_paths = [paths.aoi_hit_per_image]
+    if keep_intermediate:
+        output_paths += [paths.pavlovia_data, paths.aoi_hit]
+    for output_path in output_paths:
+        os.makedirs(output_path, exist_ok=True)
+
+    try:
+        all_IDs = read_participant_ids(paths.participant_ids)
+        aois_df = read_aois(paths.aois)
+        aoi_bounds = build_aoi_bounds(aois_df)
+        vocabularies = build_vocabularies(aois_df)
+        all_possible_aois = get_all_possible_aois(paths.aois)
+    except Exception as e:
+        print(f"Error reading pipeline inputs: {e}")
+        return
+
+    files = list_participant_files(paths.raw_data)
+    results = run_participant_files(
+        run_participant, files, jobs=jobs, report=report,
+        paths=paths, all_IDs=all_IDs, aoi_bounds=aoi_bounds, vocabularies=vocabularies,
+        all_possible_aois=all_possible_aois, keep_intermediate=keep_intermediate,
+        fixations=fixations, resample_rate=resample_rate
+    )
+    results = [result for result in results if result is not None]
+
+    if not results:
+        print("No data was successfully processed")
+        return
+
+    combined_df = combine_participant_hits([hits_df for hits_df, _ in results])
+    with timed_phase('write'):
+        combined_df.to_csv(paths.aoi_hits_combined, index=False)
+
+    total_points = sum(counters['points'] for _, counters in results)
+    print("\n=== Pipeline Summary ===")
+    print(f"Participants processed: {len(results)}/{len(files)}")
+    print(f"Total points processed: {total_points}")
+    print(f"Total rows in combined file: {len(combined_df)}")
+    print("========================")
+
+if __name__ == "__main__":
+    from pipeline_cli import run_script
+    run_script('run')
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import subprocess
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Phase times and counts of the work in progress, kept per thread so reads
+# prefetched on background threads do not mix with the file being
+# processed; instrumented_call pushes a fresh entry for every participant
+# file so its numbers stay separate
+_local = threading.local()
+
+def _new_timings():
+    return {'phases': defaultdict(float), 'counts': defaultdict(int)}
+
+def _timings():
+    """Get the current thread's stack of timing entries"""
+    if not hasattr(_local, 'timings'):
+        _local.timings = [_new_timings()]
+    return _local.timings
+
+@contextmanager
+def timed_phase(name):
+    """Add the time spent in the with block to the named phase (e.g. 'parse')"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings()[-1]['phases'][name] += time.perf_counter() - start
+
+def add_count(name, n):
+    """Add n to a named count of the current file, e.g. 'samples'"""
+    _timings()[-1]['counts'][name] += int(n)
+
+def collect_timings(call, *args, **kwargs):
+    """
+    Run call(*args, **kwargs) under a fresh timing entry, e.g. on a
+    background thread.
+    Returns (result, timings), to be added to a file with merge_timings.
+    """
+    _timings().append(_new_timings())
+    try:
+        result = call(*args, **kwargs)
+    finally:
+        timings = _timings().pop()
+    return result, timings
+
+def merge_timings(timings):
+    """Add the phases and counts of collect_timings to the current file"""
+    current = _timings()[-1]
+    for name, value in timings['phases'].items():
+        current['phases'][name] += value
+    for name, value in timings['counts'].items():
+        current['counts'][name] += value
+
+def peak_rss_mb(children=True):
+    """Get the peak resident set size of this process (or its workers) in MB"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def describe_environment():
+    """Collect version information stored with every report"""
+    import numpy as np
+    import pandas as pd
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def file_failed(result):
+    """
+    Tell from a stage's per-file result whether the file failed (or was
+    skipped): stages return None or False, or a dict (counters, or
+    validation results) with 'processed' False.
+    """
+    if isinstance(result, dict):
+        return not result.get('processed', True)
+    return result is None or result is False
+
+def instrumented_call(process_file, profile_file, file, **kwargs):
+    """
+    Run process_file(file, **kwargs) and measure it.
+    profile_file: save a cProfile dump of this call there (None to skip)
+    Returns (result, file report with seconds, phases, counts and peak RSS).
+    """
+    _timings().append(_new_timings())
+    profiler = None
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        result = process_file(file, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+        timings = _timings().pop()
+    return result, {
+        'seconds': round(seconds, 4),
+        'failed': file_failed(result),
+        'phases': {name: round(value, 4) for name, value in timings['phases'].items()},
+        'counts': dict(timings['counts']),
+        # High-water mark of the process that ran the file (a worker when jobs > 1)
+        'peak_rss_mb': round(peak_rss_mb(children=False), 1),
+        'profile': profile_file,
+    }
+
+class RunReport:
+    """
+    Collect wall time, per-file timings, phase breakdowns, counts, peak
+    memory and failures of the stages run by one command, and save them
+    as a JSON run report.
+    """
+
+    def __init__(self, path=None, profile=None, profile_dir='profiles'):
+        self.path = path
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.stages = {}
+        self.current_stage = None
+        self.current_name = None
+        self.started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    @classmethod
+    def from_arguments(cls, args):
+        """Create the report requested by the options of add_report_arguments"""
+        return cls(args.report, args.profile, args.profile_dir)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; participant files run inside it are recorded under it"""
+        self.current_name = name
+        self.current_stage = self.stages[name] = {
+            'seconds': None, 'files': 0, 'failed': 0, 'counts': {}, 'phases': {}, 'per_file': {}}
+        _timings().append(_new_timings())
+        start = time.perf_counter()
+        try:
+            yield self.current_stage
+        finally:
+            seconds = time.perf_counter() - start
+            timings = _timings().pop()
+            stage = self.current_stage
+            self.current_stage = None
+            self.current_name = None
+            for phase, value in timings['phases'].items():
+                stage['phases'][phase] = stage['phases'].get(phase, 0) + value
+            for count, value in timings['counts'].items():
+                stage['counts'][count] = stage['counts'].get(count, 0) + value
+            stage['seconds'] = round(seconds, 4)
+            stage['phases'] = {phase: round(value, 4) for phase, value in stage['phases'].items()}
+            stage['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            stage['files_per_sec'] = round(stage['files'] / seconds, 2) if seconds else None
+            samples = stage['counts'].get('samples')
+            stage['samples_per_sec'] = round(samples / seconds, 1) if samples and seconds else None
+
+    def profile_file(self, file):
+        """Where to save the cProfile dump of file, or None if it is not profiled"""
+        if self.profile is None or self.profile not in (file, os.path.splitext(file)[0]):
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return os.path.join(self.profile_dir, f"{self.current_name or 'run'}_{os.path.splitext(file)[0]}.prof")
+
+    def record_file(self, file, file_report):
+        """Add one participant file's measurements to the current stage"""
+        stage = self.current_stage
+        if stage is None:
+            stage = self.stages.setdefault('run', {'seconds': None, 'files': 0, 'failed': 0,
+                                                   'counts': {}, 'phases': {}, 'per_file': {}})
+        stage['files'] += 1
+        stage['failed'] += int(file_report['failed'])
+        for phase, value in file_report['phases'].items():
+            stage['phases'][phase] = stage['phases'].get(phase, 0) + value
+        for count, value in file_report['counts'].items():
+            stage['counts'][count] = stage['counts'].get(count, 0) + value
+        samples = file_report['counts'].get('samples')
+        if samples and file_report['seconds']:
+            file_report['samples_per_sec'] = round(samples / file_report['seconds'], 1)
+        stage['per_file'][file] = file_report
+
+    def to_dict(self):
+        """The report as a JSON-serializable dict"""
+        return {
+            'started': self.started,
+            'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'command': sys.argv,
+            'environment': describe_environment(),
+            'stages': self.stages,
+        }
+
+    def save(self):
+        """Write the report to its JSON file (nothing to do without a path)"""
+        if not self.path:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"Saved run report to {self.path}")
+
+def add_report_arguments(parser):
+    """Add the shared --report, --profile and --profile-dir options"""
+    parser.add_argument('--report', default=None,
+                        help="save a JSON run report (stage and per-file timings) to this file")
+    parser.add_argument('--profile', default=None,
+                        help="save a cProfile dump of this participant's file (name or PID)")
+    parser.add_argument('--profile-dir', default='profiles',
+                        help="directory for --profile dumps")
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pandas as pd
+from pipeline_paths import get_pipeline_paths
+
+# AOI names used in the study, laid out on the original 3456x2156 design screen
+SYNTHETIC_AOIS = ['Instruction', 'Timer', 'H_N1', 'H_N2', 'H_D1', 'H_D2', 'H_O',
+                  'L_N1', 'L_D1', 'L_O', 'R_N', 'R_D', 'Button']
+
+# Arousal/valence questions are answered after these trial positions (0-based)
+RATING_TRIALS = (2, 6, 11, 13, 23)
+
+def make_synthetic_aois():
+    """
+    Build an AOIs.csv-style table with a Left and a Right HOO layout.
+    Rectangles are in original screen pixels (3456x2156).
+    """
+    rows = []
+    for hoo_position, shift in [('Left', 0), ('Right', 1400)]:
+        boxes = {
+            'Instruction': (300, 3156, 100, 300),
+            'Timer': (3000, 3356, 1900, 2056),
+            'H_N1': (500 + shift, 750 + shift, 700, 950),
+            'H_N2': (900 + shift, 1150 + shift, 700, 950),
+            'H_D1': (500 + shift, 750 + shift, 1050, 1300),
+            'H_D2': (900 + shift, 1150 + shift, 1050, 1300),
+            'H_O': (780 + shift, 870 + shift, 900, 1100),
+            'L_N1': (1900 - shift, 2150 - shift, 700, 950),
+            'L_D1': (1900 - shift, 2150 - shift, 1050, 1300),
+            'L_O': (2200 - shift, 2300 - shift, 900, 1100),
+            'R_N': (2500 - shift, 2750 - shift, 700, 950),
+            'R_D': (2500 - shift, 2750 - shift, 1050, 1300),
+            'Button': (1500, 1956, 1700, 1850),
+        }
+        for aoi in SYNTHETIC_AOIS:
+            left, right, top, bottom = boxes[aoi]
+            rows.append({'AOI': aoi, 'HOO_position': hoo_position, 'left_x_min': left,
+                         'right_x_max': right, 'top_y_min': top, 'bottom_y_max': bottom})
+    return pd.DataFrame(rows)
+
+def make_gaze_array(rng, duration, sampling_rate, win_width, win_height):
+    """
+    Simulate one trial's webcam gaze stream as TaskGazeArray text.
+    Samples arrive at irregular intervals around 1/sampling_rate and drift
+    between fixation targets, with some samples off screen.
+    Returns the text and its number of samples.
+    """
+    n_samples = max(1, int(duration * sampling_rate))
+    intervals = rng.gamma(4.0, 1000.0 / sampling_rate / 4.0, n_samples)
+    time_points = np.round(np.cumsum(intervals)).astype(np.int64)
+
+    n_targets = max(1, n_samples // max(1, int(sampling_rate / 3)))
+    targets_x = rng.uniform(-0.05, 1.05, n_targets) * win_width
+    targets_y = rng.uniform(-0.05, 1.05, n_targets) * win_height
+    target = np.minimum(np.arange(n_samples) * n_targets // n_samples, n_targets - 1)
+    x = np.round(targets_x[target] + rng.normal(0, 25, n_samples), 2)
+    y = np.round(targets_y[target] + rng.normal(0, 25, n_samples), 2)
+
+    return '[' + ','.join(f'[{t},{a},{b}]' for t, a, b in zip(time_points, x, y)) + ']', n_samples
+
+def make_raw_export(rng, pid, condition, n_trials, sampling_rate, trial_duration):
+    """
+    Build one Pavlovia-style raw export for a synthetic participant.
+    Returns the export and its number of gaze samples.
+    """
+    win_width, win_height = [(1440.0, 900.0), (1920.0, 1080.0), (1536.0, 864.0)][rng.integers(3)]
+    prefix = 'CC' if condition == 'Congruent' else 'IC'
+    images = [f'P{i}.png' for i in range(1, 13)] + [f'{prefix}{i}.png' for i in range(1, 13)]
+
+    rows = [{'win_height': win_height, 'win_width': win_width}]
+    rows += [{'key_MA.keys': float(rng.integers(1, 6))} for _ in range(11)]
+    rows.append({'key_Pretest_Arousal.keys': float(rng.integers(1, 10)), 'key_Pretest_Arousal.rt': rng.uniform(0.5, 5),
+                 'key_Pretest_Valence.keys': float(rng.integers(1, 10)), 'key_Pretest_Valence.rt': rng.uniform(0.5, 5)})
+
+    n_samples = 0
+    rating_trials = [min(position, n_trials - 1) for position in RATING_TRIALS]
+    for position, image in enumerate(images[:n_trials]):
+        duration = rng.uniform(0.5, 1.5) * trial_duration
+        gaze_array, trial_samples = make_gaze_array(rng, duration, sampling_rate, win_width, win_height)
+        n_samples += trial_samples
+        rows.append({'Image': image, 'finalNumerator': float(rng.integers(1, 100)),
+                     'finalDenominator': float(rng.integers(1, 40)),
+                     'trialElapsedTime': duration, 'TaskGazeArray': gaze_array})
+        for _ in range(rating_trials.count(position)):
+            rows.append({'key_Arousal.keys': float(rng.integers(1, 10)), 'key_Arousal.rt': rng.uniform(0.5, 5),
+                         'key_Valence.keys': float(rng.integers(1, 10)), 'key_Valence.rt': rng.uniform(0.5, 5)})
+    rows += [{'DemoResp': str(rng.integers(18, 30))}, {'DemoResp': 'Female'}, {'DemoResp': 'Asian'}]
+
+    df = pd.DataFrame(rows)
+    df.insert(0, 'pid', pid)
+    df.insert(1, 'date', '2024-10-01_10h00.00.000')
+    df.insert(2, 'OS', 'MacIntel')
+    df.insert(3, 'frameRate', round(sampling_rate, 2))
+    return df, n_samples
+
+def generate_synthetic_cohort(root, n_participants=10, n_trials=24, sampling_rate=30.0,
+                              trial_duration=20.0, seed=0):
+    """
+    Write a synthetic cohort under root in the pipeline's input layout:
+    raw exports in Input_Files/Raw_di-data, participant_ids.csv and AOIs.csv.
+    n_trials: trials per participant (at most 24: 12 pretest + 12 condition)
+    sampling_rate: mean gaze samples per second
+    trial_duration: mean trial length in seconds
+    Returns the number of participants and gaze samples written.
+    """
+    if not 1 <= n_trials <= 24:
+        raise ValueError("n_trials must be between 1 and 24")
+
+    paths = get_pipeline_paths(root)
+    os.makedirs(paths.raw_data, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    pids = []
+    total_samples = 0
+    for participant in range(n_participants):
+        pid = f'synthetic{participant:05d}'
+        condition = 'Congruent' if participant % 2 == 0 else 'Incongruent'
+        df, n_samples = make_raw_export(rng, pid, condition, n_trials, sampling_rate, trial_duration)
+        df.to_csv(os.path.join(paths.raw_data, pid + '_fractions.csv'), index=False)
+        pids.append(pid)
+        total_samples += n_samples
+
+    pd.DataFrame({'pid': pids}).to_csv(paths.participant_ids, index=False)
+    make_synthetic_aois().to_csv(paths.aois, index=False)
+    return {'participants': n_participants, 'samples': total_samples}
@@ -0,0 +1,308 @@
+"""
+Differential tests: calculate_aoi_hits_vectorized must give the same counts
+as the row-by-row calculate_aoi_hits for every image viewing, and
+classify_gaze_points the same labels as the point-by-point find_aoi_for_point.
+Run with: python -m pytest Processing_Files
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import Processing_4_Eyes_to_AOIs
+from Processing_4_Eyes_to_AOIs import (AOITransformCache, find_aoi_for_point, build_aoi_bounds, build_aoi_grid, find_aoi_indices,
+                                       classify_gaze_codes, classify_gaze_points, layout_to_pixels)
+from Processing_5_AOI_hits_per_image import calculate_aoi_hits, calculate_aoi_hits_vectorized, get_hits_columns
+from synthetic_cohort import make_synthetic_aois
+
+ALL_POSSIBLE_AOIS = ['H_N1', 'H_N2', 'H_D1', 'H_D2', 'H_Bar']
+OFF_AOIS = ['Outside_of_AOIs', 'Outside_of_Screen']
+
+def make_samples(groups):
+    """Build labelled gaze samples from {image: [(time_point, AOI), ...]}"""
+    rows = [{'Image': image, 'HOO_Position': 'left', 'time_point': time_point, 'AOI': aoi}
+            for image, samples in groups.items() for time_point, aoi in samples]
+    return pd.DataFrame(rows, columns=['Image', 'HOO_Position', 'time_point', 'AOI'])
+
+def check_aoi_hits_against_reference(df, all_possible_aois=ALL_POSSIBLE_AOIS):
+    """Compare calculate_aoi_hits_vectorized with calculate_aoi_hits on every image of df"""
+    reference_rows = [calculate_aoi_hits(image_df, all_possible_aois)
+                      for _, image_df in df.groupby('Image', observed=True)]
+    reference_df = pd.DataFrame(reference_rows, columns=get_hits_columns(all_possible_aois))
+    vectorized_df = calculate_aoi_hits_vectorized(df, all_possible_aois)
+    pd.testing.assert_frame_equal(vectorized_df.reset_index(drop=True), reference_df,
+                                  check_dtype=False, check_index_type=False)
+    return vectorized_df
+
+def test_runs_and_transitions():
+    df = make_samples({'img_a': [(0, 'H_N1'), (1, 'H_N1'), (2, 'H_D1'), (3, 'H_Bar'), (4, 'H_N2'), (5, 'H_D2')]})
+    hits = check_aoi_hits_against_reference(df)
+    assert hits['Numerator_Denominator_Transitions'].tolist() == [3]
+
+def test_reentry_into_same_aoi_after_gap():
+    # Leaving for an off-AOI label and coming back to the same AOI is not a new hit
+    df = make_samples({'img_a': [(0, 'H_N1'), (1, 'Outside_of_AOIs'), (2, 'Outside_of_Screen'), (3, 'H_N1')]})
+    hits = check_aoi_hits_against_reference(df)
+    assert hits['New_Hits_H_N1'].tolist() == [1]
+
+def test_reentry_into_different_aoi_after_gap():
+    df = make_samples({'img_a': [(0, 'H_N1'), (1, 'Outside_of_AOIs'), (2, 'H_D1'), (3, 'Outside_of_Screen'),
+                                 (4, 'H_D1'), (5, 'Outside_of_AOIs'), (6, 'H_N1')]})
+    hits = check_aoi_hits_against_reference(df)
+    assert hits[['New_Hits_H_N1', 'New_Hits_H_D1']].values.tolist() == [[2, 1]]
+
+def test_group_starting_off_aoi():
+    df = make_samples({'img_a': [(0, 'Outside_of_Screen'), (1, 'Outside_of_AOIs'), (2, 'H_D2'), (3, 'H_D2')]})
+    check_aoi_hits_against_reference(df)
+
+def test_single_sample_groups():
+    df = make_samples({'img_a': [(0, 'H_N1')], 'img_b': [(5, 'Outside_of_AOIs')], 'img_c': [(7, 'H_Bar')]})
+    hits = check_aoi_hits_against_reference(df)
+    assert hits['New_AOI_Hits_All'].tolist() == [1, 0, 1]
+
+def test_ties_in_time_point():
+    # Enough tied samples that the sort is not an insertion sort, so the tie
+    # order depends on matching the reference's quicksort
+    rng = np.random.default_rng(0)
+    labels = ALL_POSSIBLE_AOIS + OFF_AOIS
+    samples = [(int(t), labels[i]) for t, i in zip(rng.integers(0, 8, 200), rng.integers(0, len(labels), 200))]
+    df = make_samples({'img_a': samples, 'img_b': samples[:20], 'img_c': [(3, 'H_N1'), (3, 'H_D1'), (3, 'H_N2')]})
+    check_aoi_hits_against_reference(df)
+
+def test_random_groups():
+    rng = np.random.default_rng(1)
+    labels = ALL_POSSIBLE_AOIS + OFF_AOIS
+    groups = {f'img_{g}': [(int(t), labels[i]) for t, i in
+                           zip(rng.permutation(n), rng.integers(0, len(labels), n))]
+              for g, n in enumerate(rng.integers(1, 60, 30))}
+    check_aoi_hits_against_reference(make_samples(groups))
+
+def test_categorical_aoi_and_image():
+    df = make_samples({'img_a': [(0, 'H_N1'), (1, 'Outside_of_AOIs'), (2, 'H_N2')], 'img_b': [(0, 'H_D1')]})
+    df['AOI'] = pd.Categorical(df['AOI'], categories=ALL_POSSIBLE_AOIS + OFF_AOIS)
+    df['Image'] = pd.Categorical(df['Image'], categories=['img_a', 'img_b', 'img_unused'])
+    hits = check_aoi_hits_against_reference(df)
+    assert hits['Image'].tolist() == ['img_a', 'img_b']
+
+@pytest.mark.parametrize('df', [
+    make_samples({}),
+    make_samples({'img_a': [(0, 'H_N1')]}).iloc[:0],
+    make_samples({'img_a': [(0, 'H_N1')]}).assign(Image=None),
+])
+def test_empty_groups(df):
+    hits = calculate_aoi_hits_vectorized(df, ALL_POSSIBLE_AOIS)
+    assert len(hits) == 0
+    assert list(hits.columns) == get_hits_columns(ALL_POSSIBLE_AOIS)
+
+# Participant windows: the design screen, common laptop sizes and odd sizes
+# whose height-unit conversion does not round trip exactly
+WINDOW_SIZES = [(3456, 2156), (1920, 1080), (1366, 768), (1279, 719), (1001, 667)]
+
+def check_labels_against_reference(x, y, aois_df, win_width, win_height, hoo_position):
+    """Compare classify_gaze_points with find_aoi_for_point on every point"""
+    aoi_bounds = build_aoi_bounds(aois_df)
+    labels = classify_gaze_points(x, y, aoi_bounds, win_width, win_height, hoo_position)
+    reference = [find_aoi_for_point(px, py, aois_df, win_width, win_height, hoo_position)
+                 for px, py in zip(x, y)]
+    mismatches = [(px, py, label, expected) for px, py, label, expected in zip(x, y, labels, reference)
+                  if label != expected]
+    assert mismatches == []
+    return labels
+
+def around(values):
+    """Each value and the floats one ULP below and above it"""
+    values = np.asarray(values, dtype=float)
+    return np.concatenate([np.nextafter(values, -np.inf), values, np.nextafter(values, np.inf)])
+
+def edge_points(aois_df, win_width, win_height, hoo_position):
+    """
+    Points one ULP either side of, and exactly on, every AOI edge and the
+    screen edges, both as layout_to_pixels places the edges and as the
+    algebraic inverse of the height-unit conversion does.
+    """
+    layout = build_aoi_bounds(aois_df)['layouts'][hoo_position.lower()]
+    pixel_layout = layout_to_pixels(layout, float(win_width), float(win_height))
+    half_height = win_height / 2.0
+    x_edges = np.concatenate([pixel_layout['x_min'], pixel_layout['x_max'],
+                              layout['left'] * half_height + win_width / 2,
+                              layout['right'] * half_height + win_width / 2, [0.0, win_width]])
+    y_edges = np.concatenate([pixel_layout['y_min'], pixel_layout['y_max'],
+                              half_height - layout['top'] * half_height,
+                              half_height - layout['bottom'] * half_height, [0.0, win_height]])
+    x_middles = (pixel_layout['x_min'] + pixel_layout['x_max']) / 2
+    y_middles = (pixel_layout['y_min'] + pixel_layout['y_max']) / 2
+
+    # Cross each AOI's edges with the middle of that AOI and with its other edges
+    n = len(x_middles)
+    x_near, y_near = around(x_edges), around(y_edges)
+    x_on_x_edges, y_on_x_edges = x_near, np.tile(np.concatenate([y_middles, y_middles, y_middles, y_middles,
+                                                                 [half_height, half_height]]), 3)
+    y_on_y_edges, x_on_y_edges = y_near, np.tile(np.concatenate([x_middles, x_middles, x_middles, x_middles,
+                                                                 [win_width / 2, win_width / 2]]), 3)
+    corners = [(x, y) for i in range(n)
+               for x in around([pixel_layout['x_min'][i], pixel_layout['x_max'][i]])
+               for y in around([pixel_layout['y_min'][i], pixel_layout['y_max'][i]])]
+    x_corners, y_corners = np.array(corners).T
+    return (np.concatenate([x_on_x_edges, x_on_y_edges, x_corners]),
+            np.concatenate([y_on_x_edges, y_on_y_edges, y_corners]))
+
+@pytest.mark.parametrize('win_width, win_height', WINDOW_SIZES)
+@pytest.mark.parametrize('hoo_position', ['Left', 'Right'])
+def test_labels_one_ulp_around_edges(win_width, win_height, hoo_position):
+    aois_df = make_synthetic_aois()
+    x, y = edge_points(aois_df, win_width, win_height, hoo_position)
+    labels = check_labels_against_reference(x, y, aois_df, win_width, win_height, hoo_position)
+    # The points straddle the edges, so every label occurs
+    assert {'H_N1', 'Button', 'Outside_of_AOIs', 'Outside_of_Screen'} <= set(labels)
+
+@pytest.mark.parametrize('win_width, win_height', WINDOW_SIZES)
+def test_labels_at_negative_coordinates(win_width, win_height):
+    # AOIs reaching past the design screen's top-left corner, and gaze points
+    # left of and above the participant's screen
+    aois_df = pd.DataFrame([
+        {'AOI': 'Corner', 'HOO_position': 'Left', 'left_x_min': -200, 'right_x_max': 400,
+         'top_y_min': -150, 'bottom_y_max': 300},
+        {'AOI': 'Edge', 'HOO_position': 'Left', 'left_x_min': -50.5, 'right_x_max': 0,
+         'top_y_min': 0, 'bottom_y_max': 2156},
+        {'AOI': 'Inside', 'HOO_position': 'Left', 'left_x_min': 1000, 'right_x_max': 1200,
+         'top_y_min': 1000, 'bottom_y_max': 1200},
+    ])
+    x_edge, y_edge = edge_points(aois_df, win_width, win_height, 'Left')
+    rng = np.random.default_rng(win_width)
+    x_random = rng.uniform(-win_width, win_width / 4, 300)
+    y_random = rng.uniform(-win_height, win_height / 4, 300)
+    zeros = around([0.0, -0.0])
+    x = np.concatenate([x_edge, x_random, zeros, np.full(len(zeros), 1.0), [-np.inf, -1e300]])
+    y = np.concatenate([y_edge, y_random, np.full(len(zeros), 1.0), zeros, [1.0, -1e300]])
+    labels = check_labels_against_reference(x, y, aois_df, win_width, win_height, 'Left')
+    assert {'Corner', 'Outside_of_Screen'} <= set(labels)
+
+@pytest.mark.parametrize('hoo_position', ['LEFT', 'lEfT'])
+def test_labels_with_case_mixed_layout_names(hoo_position):
+    # AOIs.csv spells the layout differently per row; all rows still belong to it
+    aois_df = make_synthetic_aois()
+    aois_df['HOO_position'] = [position.upper() if i % 3 == 0 else position.lower() if i % 3 == 1
+                               else position.capitalize() for i, position in enumerate(aois_df['HOO_position'])]
+    win_width, win_height = 1920, 1080
+    x, y = edge_points(aois_df, win_width, win_height, hoo_position)
+    rng = np.random.default_rng(0)
+    x = np.concatenate([x, rng.uniform(0, win_width, 300)])
+    y = np.concatenate([y, rng.uniform(0, win_height, 300)])
+    labels = check_labels_against_reference(x, y, aois_df, win_width, win_height, hoo_position)
+    layout_aois = set(aois_df.loc[aois_df['HOO_position'].str.lower() == 'left', 'AOI'])
+    assert set(labels) - {'Outside_of_AOIs', 'Outside_of_Screen'} <= layout_aois
+    assert 'H_N1' in set(labels)
+
+def first_containing_aoi(x, y, layout):
+    """Index of the first AOI (in AOIs.csv order) containing each point, testing every AOI"""
+    inside = (layout['x_min'][None, :] <= x[:, None]) & (x[:, None] <= layout['x_max'][None, :]) & \
+             (layout['y_min'][None, :] <= y[:, None]) & (y[:, None] <= layout['y_max'][None, :])
+    return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+def random_overlapping_layout(rng, n_aois):
+    """Pixel-space rectangles that overlap, nest and share edges"""
+    x_min = np.round(rng.uniform(0, 900, n_aois), int(rng.integers(0, 3)))
+    y_min = np.round(rng.uniform(0, 600, n_aois), int(rng.integers(0, 3)))
+    x_max = x_min + np.round(rng.uniform(0, 400, n_aois))
+    y_max = y_min + np.round(rng.uniform(0, 300, n_aois))
+    # Copies of earlier rectangles, and rectangles nested in them
+    copies = rng.integers(0, n_aois, n_aois // 3)
+    x_min[-len(copies):], x_max[-len(copies):] = x_min[copies], x_max[copies]
+    y_min[-len(copies):], y_max[-len(copies):] = y_min[copies] + 10, y_max[copies]
+    return {'names': np.array([f'AOI_{i}' for i in range(n_aois)], dtype=object),
+            'x_min': x_min, 'x_max': x_max, 'y_min': y_min, 'y_max': y_max}
+
+def grid_border_points(layout, grid):
+    """Points on, and one ULP either side of, every grid line and AOI edge"""
+    x_lines = grid['x0'] + grid['cell_width'] * np.arange(grid['nx'] + 1)
+    y_lines = grid['y0'] + grid['cell_height'] * np.arange(grid['ny'] + 1)
+    x_values = around(np.concatenate([x_lines, layout['x_min'], layout['x_max']]))
+    y_values = around(np.concatenate([y_lines, layout['y_min'], layout['y_max']]))
+    x, y = np.meshgrid(x_values, y_values)
+    return x.ravel(), y.ravel()
+
+@pytest.mark.parametrize('seed', range(12))
+def test_grid_keeps_first_match_of_overlapping_aois(seed):
+    rng = np.random.default_rng(seed)
+    layout = random_overlapping_layout(rng, int(rng.integers(1, 25)))
+    for cells_per_axis in [None, 1, 3, 7, 64]:
+        layout['grid'] = build_aoi_grid(layout, cells_per_axis)
+        x, y = grid_border_points(layout, layout['grid'])
+        x = np.concatenate([x, rng.uniform(-100, 1400, 2000)])
+        y = np.concatenate([y, rng.uniform(-100, 1000, 2000)])
+        np.testing.assert_array_equal(find_aoi_indices(x, y, layout), first_containing_aoi(x, y, layout))
+
+def test_grid_with_degenerate_and_missing_aois():
+    # Zero-width, zero-height, inverted and NaN rectangles, and a single line of AOIs
+    layout = {'names': np.array(['A', 'B', 'C', 'D', 'E'], dtype=object),
+              'x_min': np.array([10.0, 50.0, 80.0, np.nan, 10.0]),
+              'x_max': np.array([10.0, 90.0, 70.0, 100.0, 90.0]),
+              'y_min': np.array([5.0, 5.0, 5.0, 5.0, 5.0]),
+              'y_max': np.array([20.0, 5.0, 20.0, 20.0, 5.0])}
+    layout['grid'] = build_aoi_grid(layout)
+    x, y = grid_border_points(layout, layout['grid'])
+    found = find_aoi_indices(x, y, layout)
+    np.testing.assert_array_equal(found, first_containing_aoi(x, y, layout))
+    # The inverted and NaN rectangles contain no point
+    assert set(found) == {-1, 0, 1, 4}
+
+@pytest.mark.parametrize('win_width, win_height', [(3456, 2156), (1366, 768)])
+def test_overlapping_aois_labelled_in_aois_csv_order(win_width, win_height):
+    # Later rows overlap, contain or repeat earlier ones; the first row listed wins
+    boxes = [('Outer', 400, 2400, 400, 1600), ('Inner', 800, 1200, 800, 1200), ('Crossing', 1000, 3000, 1000, 1100),
+             ('Same_as_inner', 800, 1200, 800, 1200), ('Touching', 2400, 2600, 1600, 1800)]
+    rows = [{'AOI': aoi, 'HOO_position': 'Left', 'left_x_min': left, 'right_x_max': right,
+             'top_y_min': top, 'bottom_y_max': bottom} for aoi, left, right, top, bottom in boxes]
+    for aois_df, hidden in [(pd.DataFrame(rows), 'Same_as_inner'), (pd.DataFrame(rows[::-1]), 'Inner')]:
+        x, y = edge_points(aois_df, win_width, win_height, 'Left')
+        rng = np.random.default_rng(win_width)
+        x = np.concatenate([x, rng.uniform(0, win_width, 500)])
+        y = np.concatenate([y, rng.uniform(0, win_height, 500)])
+        labels = check_labels_against_reference(x, y, aois_df, win_width, win_height, 'Left')
+        codes = classify_gaze_codes(x, y, build_aoi_bounds(aois_df), win_width, win_height, 'Left')
+        np.testing.assert_array_equal(build_aoi_bounds(aois_df)['categories'][codes], labels)
+        assert hidden not in set(labels)
+
+def assert_same_pixel_layout(actual, expected):
+    for key in ['names', 'x_min', 'x_max', 'y_min', 'y_max']:
+        np.testing.assert_array_equal(actual[key], expected[key])
+    for key in expected['grid']:
+        np.testing.assert_array_equal(actual['grid'][key], expected['grid'][key])
+
+def test_transform_cache_evicts_least_recently_used():
+    layouts = build_aoi_bounds(make_synthetic_aois())['layouts']
+    left, right = layouts['left'], layouts['right']
+    cache = AOITransformCache(maxsize=2)
+    first = cache.get(left, 1920, 1080)
+    cache.get(right, 1920, 1080)
+    assert cache.get(left, 1920.0, 1080.0) is first
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0, 'size': 2}
+
+    # Right at 1920x1080 is now the least recently used entry
+    cache.get(left, 1366, 768)
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2}
+    assert cache.get(left, 1920, 1080) is first
+    rebuilt = cache.get(right, 1920, 1080)
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'evictions': 2, 'size': 2}
+    assert_same_pixel_layout(rebuilt, layout_to_pixels(right, 1920.0, 1080.0))
+
+    # Left at 1366x768 was evicted by the rebuild, and is rebuilt the same way
+    assert [key[1:] for key in cache.layouts] == [(1920.0, 1080.0), (1920.0, 1080.0)]
+    assert_same_pixel_layout(cache.get(left, 1366, 768), layout_to_pixels(left, 1366.0, 768.0))
+    assert cache.stats() == {'hits': 2, 'misses': 5, 'evictions': 3, 'size': 2}
+
+def test_labels_unchanged_when_transform_cache_evicts(monkeypatch):
+    aois_df = make_synthetic_aois()
+    aoi_bounds = build_aoi_bounds(aois_df)
+    rng = np.random.default_rng(0)
+    trials = [(hoo_position, win_width, win_height, rng.uniform(-50, win_width + 50, 200),
+               rng.uniform(-50, win_height + 50, 200))
+              for hoo_position in ['Left', 'Right'] for win_width, win_height in WINDOW_SIZES]
+    monkeypatch.setattr(Processing_4_Eyes_to_AOIs, 'transform_cache', AOITransformCache(maxsize=len(trials)))
+    expected = [classify_gaze_points(x, y, aoi_bounds, w, h, hoo) for hoo, w, h, x, y in trials]
+
+    # Cycling through more window sizes than the cache holds misses on every trial
+    cache = AOITransformCache(maxsize=3)
+    monkeypatch.setattr(Processing_4_Eyes_to_AOIs, 'transform_cache', cache)
+    for _ in range(2):
+        for (hoo, w, h, x, y), labels in zip(trials, expected):
+            np.testing.assert_array_equal(classify_gaze_points(x, y, aoi_bounds, w, h, hoo), labels)
+    assert cache.stats() == {'hits': 0, 'misses': 2 * len(trials), 'evictions': 2 * len(trials) - 3, 'size': 3}
@@ -0,0 +1,64 @@
+"""The cohort store keeps its tables unchanged unless a whole update is committed"""
+import pandas as pd
+import Processing_6_AOI_Combining_participants
+from Processing_6_AOI_Combining_participants import combine_aoi_hits
+from cohort_store import CohortStore, HITS_TABLE, read_store
+
+def read_table(path, table=HITS_TABLE):
+    store = CohortStore(path)
+    try:
+        return store.read(table).sort_values(['pid', 'Image']).reset_index(drop=True)
+    finally:
+        store.abort()
+
+def test_abort_discards_inserts_and_drops(tmp_path):
+    path = str(tmp_path / 'store.sqlite')
+    rows = pd.DataFrame({'Image': ['P1.png', 'CC1.png'], 'HOO_Position': ['Left', 'Left'], 'Total': [1, 2]})
+    store = CohortStore(path)
+    store.replace_participant('hits', 'a', rows, condition='Congruent')
+    store.close()
+
+    store = CohortStore(path)
+    store.replace_participant('hits', 'b', rows, condition='Incongruent')
+    store.abort()
+    assert sorted(read_table(path, 'hits')['pid'].unique()) == ['a']
+
+    store = CohortStore(path)
+    store.drop('hits')
+    store.abort()
+    assert len(read_table(path, 'hits')) == 2
+
+def test_values_round_trip(tmp_path):
+    path = str(tmp_path / 'store.sqlite')
+    rows = pd.DataFrame({'Image': ['P1.png', None], 'count': [1, 2], 'dwell': [0.5, float('nan')]})
+    store = CohortStore(path)
+    store.replace_participant('hits', 'a', rows, condition='Congruent')
+    store.close()
+    stored = read_table(path, 'hits')
+    assert stored['count'].tolist() == [1, 2]
+    assert stored['Image'].isna().tolist() == [False, True]
+    assert stored['dwell'].isna().tolist() == [False, True]
+
+def test_failed_combine_leaves_store_unchanged(cohort, monkeypatch):
+    before = read_table(cohort.cohort_store)
+    assert before['pid'].nunique() > 2
+
+    # Fail after the table was dropped and some participants were stored again
+    calls = []
+    replace_participant = CohortStore.replace_participant
+    def failing_replace(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return replace_participant(self, *args, **kwargs)
+    monkeypatch.setattr(Processing_6_AOI_Combining_participants.CohortStore, 'replace_participant',
+                        failing_replace)
+    combine_aoi_hits(force=True, paths=cohort)
+    monkeypatch.undo()
+
+    pd.testing.assert_frame_equal(read_table(cohort.cohort_store), before)
+
+    # The next incremental run finds the store complete
+    combine_aoi_hits(paths=cohort)
+    pd.testing.assert_frame_equal(read_table(cohort.cohort_store), before)
+    assert read_store(paths=cohort)['pid'].nunique() == before['pid'].nunique()
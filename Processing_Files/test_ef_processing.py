@@ -0,0 +1,83 @@
+"""
+The EF stage scores the ACE exports as the R script did, and does not
+replace the R script's EF_data_combined.csv with scores that differ.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import shutil
+import pandas as pd
+import pytest
+from EF_Processing import process_ef_data, compare_ef_scores, OUTPUT_COLUMNS
+from pipeline_paths import get_pipeline_paths
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+REFERENCE = os.path.join(REPO_ROOT, 'Output_Files', 'EF_data_combined.csv')
+
+def read_scores(file):
+    return pd.read_csv(file, dtype={'pid': str, 'bid': str})
+
+@pytest.fixture
+def ef_root(tmp_path):
+    """A project root with the full ACE export, participant_ids.csv and the R script's EF_data_combined.csv"""
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'Input_Files'))
+    os.makedirs(os.path.join(root, 'Output_Files'))
+    shutil.copy(os.path.join(REPO_ROOT, 'Input_Files', 'participant_ids.csv'), os.path.join(root, 'Input_Files'))
+    shutil.copytree(os.path.join(REPO_ROOT, 'EF ACE raw files'), os.path.join(root, 'EF ACE raw files'))
+    shutil.copy(REFERENCE, os.path.join(root, 'Output_Files'))
+    return get_pipeline_paths(root)
+
+def test_sessions_in_both_score_as_in_r(ef_root):
+    process_ef_data(paths=ef_root)
+    scores_df = read_scores(ef_root.ef_candidate)
+    reference_df = read_scores(REFERENCE)
+    common = set(scores_df['bid']) & set(reference_df['bid'])
+    assert len(common) > 70
+    assert compare_ef_scores(scores_df[scores_df['bid'].isin(common)].drop_duplicates(),
+                             reference_df[reference_df['bid'].isin(common)].drop_duplicates()) == []
+
+    # Every scored participant is in participant_ids.csv
+    participant_ids = pd.read_csv(ef_root.participant_ids, dtype=str)['pid']
+    assert set(scores_df['pid']) <= set(participant_ids)
+
+def test_reference_kept_until_scores_match(ef_root, capsys):
+    with open(REFERENCE, 'rb') as f:
+        reference = f.read()
+    process_ef_data(paths=ef_root)
+    assert "do not match" in capsys.readouterr().out
+    with open(ef_root.ef_combined, 'rb') as f:
+        assert f.read() == reference
+
+    # Not recorded as up to date, so the next run reports the differences again
+    process_ef_data(paths=ef_root)
+    assert "do not match" in capsys.readouterr().out
+
+    # A reference the scores match is kept as it is, whatever its formatting
+    pd.read_csv(ef_root.ef_candidate).to_csv(ef_root.ef_combined, index=False, quoting=1)
+    with open(ef_root.ef_combined, 'rb') as f:
+        quoted = f.read()
+    process_ef_data(paths=ef_root)
+    assert "Scores match" in capsys.readouterr().out
+    with open(ef_root.ef_combined, 'rb') as f:
+        assert f.read() == quoted
+
+def test_replace_overwrites_reference(ef_root):
+    process_ef_data(paths=ef_root, replace=True)
+    scores_df = read_scores(ef_root.ef_combined)
+    assert list(scores_df.columns) == OUTPUT_COLUMNS
+    assert compare_ef_scores(scores_df, read_scores(REFERENCE))
+
+    # Once this stage wrote the file, later runs update it without a check
+    with open(ef_root.participant_ids, 'a') as f:
+        f.write('"notaparticipant","2024-01-01"\n')
+    process_ef_data(paths=ef_root)
+    assert not os.path.exists(ef_root.ef_candidate)
+    pd.testing.assert_frame_equal(read_scores(ef_root.ef_combined), scores_df)
+
+def test_compare_reports_value_differences():
+    reference_df = read_scores(REFERENCE).drop_duplicates('bid').head(3).reset_index(drop=True)
+    scores_df = reference_df.copy()
+    assert compare_ef_scores(scores_df, reference_df) == []
+    scores_df.loc[1, 'TASKSWITCH.rcs.overall'] *= 1 + 1e-6
+    differences = compare_ef_scores(scores_df, reference_df)
+    assert len(differences) == 1 and 'TASKSWITCH.rcs.overall' in differences[0]
@@ -0,0 +1,85 @@
+"""
+Fixation detection, and the hits stage's use of the fixations stage output.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from Processing_4b_Fixations import _idt_trial, process_fixations, read_fixations
+from Processing_5_AOI_hits_per_image import process_aoi_hits, get_all_possible_aois
+from build_manifest import BuildManifest
+
+def idt_reference(time_points, x, y, dispersion_threshold, min_duration):
+    """I-DT as described by Salvucci & Goldberg, growing each window one sample at a time"""
+    starts, ends = [], []
+    n = len(time_points)
+    i = 0
+    while i < n:
+        last = np.searchsorted(time_points, time_points[i] + min_duration)
+        if last >= n:
+            break
+        end = i
+        while end < n and (x[i:end + 1].max() - x[i:end + 1].min() + y[i:end + 1].max() - y[i:end + 1].min()
+                           <= dispersion_threshold):
+            end += 1
+        if end > last:
+            starts.append(i)
+            ends.append(end)
+            i = end
+        else:
+            i += 1
+    return starts, ends
+
+@pytest.mark.parametrize('seed', range(40))
+def test_idt_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(0, 250))
+    time_points = np.cumsum(rng.integers(0, 60, n)).astype(float)
+    step = rng.choice([0.001, 0.02, 0.1])
+    x = np.cumsum(rng.normal(0, step, n))
+    y = np.cumsum(rng.normal(0, step, n))
+    if seed % 4 == 0:
+        # Repeated positions give dispersions exactly at the threshold
+        x, y = np.round(x, 1), np.round(y, 1)
+    threshold = float(rng.choice([0.05, 0.1, 0.3]))
+    min_duration = float(rng.choice([1, 50, 100, 300]))
+    starts, ends = _idt_trial(time_points, x, y, threshold, min_duration)
+    assert (list(starts), list(ends)) == idt_reference(time_points, x, y, threshold, min_duration)
+
+def read_hits(paths):
+    return pd.concat([pd.read_csv(os.path.join(paths.aoi_hit_per_image, f))
+                      for f in sorted(os.listdir(paths.aoi_hit_per_image))], ignore_index=True)
+
+def fixations_in_aois(paths):
+    all_possible_aois = get_all_possible_aois(paths.aois)
+    fixations_df = pd.concat([read_fixations(os.path.join(paths.fixations, f))
+                              for f in sorted(os.listdir(paths.fixations))], ignore_index=True)
+    return fixations_df[fixations_df['AOI'].isin(all_possible_aois)]
+
+def test_hits_use_fixations_stage_thresholds(cohort):
+    process_fixations(paths=cohort)
+    process_aoi_hits(paths=cohort, fixations=True)
+    default_counts = read_hits(cohort)['Fixation_Count_All']
+    assert default_counts.sum() == len(fixations_in_aois(cohort)) > 0
+
+    # New thresholds make the hits stale, and their fixations are the ones counted
+    process_fixations(paths=cohort, method='idt', dispersion_threshold=0.02, min_duration=200)
+    process_aoi_hits(paths=cohort, fixations=True)
+    hits_df = read_hits(cohort)
+    fixations_df = fixations_in_aois(cohort)
+    assert hits_df['Fixation_Count_All'].sum() == len(fixations_df)
+    assert hits_df['Dwell_Time_All'].sum() == pytest.approx(fixations_df['duration'].sum())
+    assert not hits_df['Fixation_Count_All'].equals(default_counts)
+
+def test_hits_skip_files_with_outdated_fixations(cohort):
+    process_fixations(paths=cohort)
+    files = sorted(os.listdir(cohort.aoi_hit))
+    with open(os.path.join(cohort.aoi_hit, files[0]), 'a') as f:
+        f.write('\n')
+    for file in os.listdir(cohort.aoi_hit_per_image):
+        os.remove(os.path.join(cohort.aoi_hit_per_image, file))
+
+    process_aoi_hits(paths=cohort, fixations=True)
+    assert sorted(os.listdir(cohort.aoi_hit_per_image)) == files[1:]
+    assert 'fixations' not in BuildManifest(cohort.manifest).entries['hits'][files[0]]['dependencies']
@@ -0,0 +1,36 @@
+"""
+decode_gaze_array parses well-formed TaskGazeArray text and rejects
+malformed or truncated cells.
+Run with: python -m pytest Processing_Files
+"""
+import warnings
+import numpy as np
+import pytest
+from gaze_arrays import decode_gaze_array, find_malformed_gaze_arrays, GazeArrayError
+
+@pytest.mark.parametrize('text, expected', [
+    ('[[1,2.5,3],[4,-5e-1,.5]]', [[1, 4], [2.5, -0.5], [3, 0.5]]),
+    ('"[[ 10 , 20.25 , 30 ], [ 11 , 21 , 31 ]]"', [[10, 11], [20.25, 21], [30, 31]]),
+    ('[]', [[], [], []]),
+    (' [ ] ', [[], [], []]),
+])
+def test_decodes_points(text, expected):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        arrays = decode_gaze_array(text)
+    for array, values in zip(arrays, expected):
+        assert array.dtype == np.float64 and array.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(array, values)
+
+@pytest.mark.parametrize('text', [
+    float('nan'), None, '', '[[1,2,3],[4,5',  '[[1,2,3],[4,5,6]', '[[1,2,3],[4,5]]', '[[1,2,3,4]]',
+    '[[1,2],[3,4,5,6]]', '[[1,,3]]', '[[1, ,3]]', '[[1,2,3],]', '[[1,x,3]]', '[[1,2,nan]]', '[[inf,2,3]]',
+    '[[1 2,3,4]]', '[[1,2,3][4,5,6]]',
+])
+def test_rejects_malformed_text(text):
+    with pytest.raises(GazeArrayError):
+        decode_gaze_array(text)
+
+def test_find_malformed_gaze_arrays_reports_positions():
+    errors = find_malformed_gaze_arrays(['[[1,2,3]]', '[[1,2', '[]', '[[1,a,3]]'])
+    assert [position for position, _ in errors] == [1, 3]
@@ -0,0 +1,91 @@
+"""
+The gaze cache is used only while it matches its source file and the
+decoding code, and is rebuilt otherwise.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import gaze_cache
+from gaze_cache import GazeCache
+from Processing_4_Eyes_to_AOIs import process_gaze_data
+
+def read_labelled(paths):
+    outputs = {}
+    for file in sorted(os.listdir(paths.aoi_hit)):
+        with open(os.path.join(paths.aoi_hit, file), 'rb') as f:
+            outputs[file] = f.read()
+    return outputs
+
+@pytest.fixture
+def cached(cohort):
+    """The cohort with gaze caches, and its first Pavlovia_Data file and cache directory"""
+    process_gaze_data(force=True, paths=cohort)
+    file = sorted(os.listdir(cohort.pavlovia_data))[0]
+    source_file = os.path.join(cohort.pavlovia_data, file)
+    cache_dir = os.path.join(cohort.gaze_cache, os.path.splitext(file)[0])
+    assert uses_cache(source_file, cache_dir)
+    return cohort, source_file, cache_dir
+
+def uses_cache(source_file, cache_dir):
+    """Whether labelling source_file would read its cache rather than decode the text"""
+    return GazeCache.open(cache_dir, source_file) is not None
+
+def check_rebuilt(paths, source_file, cache_dir):
+    """Relabel with the cache, and compare with labelling without it"""
+    process_gaze_data(force=True, paths=paths)
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta['code'] == gaze_cache._cache_code()
+    assert meta['source_hash'] == gaze_cache.hash_file(source_file)
+    cached_outputs = read_labelled(paths)
+    process_gaze_data(force=True, paths=paths, use_gaze_cache=False)
+    assert read_labelled(paths) == cached_outputs
+    return cached_outputs
+
+def test_changed_source_rebuilds_cache(cached):
+    cohort, source_file, cache_dir = cached
+    before = read_labelled(cohort)
+    df = pd.read_csv(source_file)
+    first = df['TaskGazeArray'].first_valid_index()
+    df.loc[first, 'TaskGazeArray'] = df.loc[first, 'TaskGazeArray'].replace('[[', '[[1,2,3],[', 1)
+    stat = os.stat(source_file)
+    df.to_csv(source_file, index=False)
+    # Even with the old size and modification time, the content hash differs
+    os.utime(source_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert not uses_cache(source_file, cache_dir)
+    after = check_rebuilt(cohort, source_file, cache_dir)
+    assert after[os.path.basename(source_file)] != before[os.path.basename(source_file)]
+    assert uses_cache(source_file, cache_dir)
+
+def test_touched_source_keeps_cache(cached):
+    cohort, source_file, cache_dir = cached
+    os.utime(source_file, ns=(0, 10 ** 18))
+    assert uses_cache(source_file, cache_dir)
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        assert json.load(f)['source']['mtime_ns'] == 10 ** 18
+
+def test_changed_code_rebuilds_cache(cached, monkeypatch):
+    cohort, source_file, cache_dir = cached
+    monkeypatch.setattr(gaze_cache, '_cache_code', lambda: 'other decoding code')
+    assert not uses_cache(source_file, cache_dir)
+    check_rebuilt(cohort, source_file, cache_dir)
+    assert uses_cache(source_file, cache_dir)
+
+@pytest.mark.parametrize('damage', [
+    lambda cache_dir: open(os.path.join(cache_dir, 'meta.json'), 'w').write('{"source": '),
+    lambda cache_dir: open(os.path.join(cache_dir, 'meta.json'), 'w').write('[]'),
+    lambda cache_dir: open(os.path.join(cache_dir, 'trials.pkl'), 'wb').write(b'not a pickle'),
+    lambda cache_dir: np.save(os.path.join(cache_dir, 'offsets.npy'), np.array([0])),
+    lambda cache_dir: os.remove(os.path.join(cache_dir, 'x.npy')),
+])
+def test_unreadable_cache_falls_back_to_decoding(cached, damage):
+    cohort, source_file, cache_dir = cached
+    before = read_labelled(cohort)
+    damage(cache_dir)
+    assert not uses_cache(source_file, cache_dir)
+    assert check_rebuilt(cohort, source_file, cache_dir) == before
+    assert uses_cache(source_file, cache_dir)
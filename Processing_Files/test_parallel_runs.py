@@ -0,0 +1,86 @@
+"""
+Running participant files in worker processes must not change the outputs,
+and a failing participant must not stop the others.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import time
+import pandas as pd
+from participant_runner import run_participant_files
+from Processing_1_Cleaning_trials import generate_eye_tracking_data
+from Processing_4_Eyes_to_AOIs import process_gaze_data
+from Processing_5_AOI_hits_per_image import process_aoi_hits
+from Processing_6_AOI_Combining_participants import combine_aoi_hits
+
+def read_outputs(paths):
+    """Bytes of every per-participant and combined output, by path relative to the root"""
+    outputs = {}
+    for directory in [paths.pavlovia_data, paths.aoi_hit, paths.aoi_hit_per_image]:
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), 'rb') as f:
+                outputs[os.path.relpath(os.path.join(directory, file), paths.root)] = f.read()
+    with open(paths.aoi_hits_combined, 'rb') as f:
+        outputs[os.path.relpath(paths.aoi_hits_combined, paths.root)] = f.read()
+    return outputs
+
+def run_stages(paths, jobs):
+    generate_eye_tracking_data(jobs=jobs, force=True, paths=paths)
+    process_gaze_data(jobs=jobs, force=True, paths=paths, use_gaze_cache=False)
+    process_aoi_hits(jobs=jobs, force=True, paths=paths)
+    combine_aoi_hits(jobs=jobs, force=True, paths=paths)
+
+def slow_square(file, delay):
+    """Finish the first files last, so worker completion order differs from file order"""
+    time.sleep(delay / (1 + file))
+    return file * file
+
+def test_results_follow_file_order():
+    files = list(range(8))
+    assert run_participant_files(slow_square, files, jobs=4, delay=0.2) == [file * file for file in files]
+
+def test_jobs_give_byte_identical_outputs(cohort):
+    # The shared cohort was built with jobs=1
+    expected = read_outputs(cohort)
+    assert len(expected) > 4
+    for jobs in [3, 0]:
+        run_stages(cohort, jobs)
+        assert read_outputs(cohort) == expected
+
+def test_failing_participant_reported_while_others_finish(cohort, capfd):
+    expected = read_outputs(cohort)
+    files = sorted(os.listdir(cohort.pavlovia_data))
+    bad_file = files[1]
+    with open(os.path.join(cohort.pavlovia_data, bad_file), 'w') as f:
+        f.write('pid\nnot a trial\n')
+    capfd.readouterr()
+
+    process_gaze_data(jobs=3, force=True, paths=cohort, use_gaze_cache=False)
+    out = capfd.readouterr().out
+    assert f"Error processing file {bad_file}" in out
+    assert f"Total files processed: {len(files) - 1}/{len(files)}" in out
+    assert "Failed files: 1" in out
+
+    # The other participants were labelled as before
+    outputs = read_outputs(cohort)
+    for file in files:
+        if file != bad_file:
+            key = os.path.relpath(os.path.join(cohort.aoi_hit, file), cohort.root)
+            assert outputs[key] == expected[key]
+
+def test_failing_export_reported_while_others_are_cleaned(cohort, capfd):
+    expected = read_outputs(cohort)
+    files = sorted(os.listdir(cohort.raw_data))
+    bad_file = files[0]
+    raw_df = pd.read_csv(os.path.join(cohort.raw_data, bad_file), encoding='latin-1')
+    raw_df.drop(columns=['win_height']).to_csv(os.path.join(cohort.raw_data, bad_file), index=False)
+    for file in os.listdir(cohort.pavlovia_data):
+        os.remove(os.path.join(cohort.pavlovia_data, file))
+    capfd.readouterr()
+
+    generate_eye_tracking_data(jobs=3, force=True, paths=cohort)
+    assert f"Error cleaning file {bad_file}" in capfd.readouterr().out
+    cleaned = {os.path.relpath(os.path.join(cohort.pavlovia_data, file), cohort.root)
+               for file in os.listdir(cohort.pavlovia_data)}
+    assert len(cleaned) == len(files) - 1
+    outputs = read_outputs(cohort)
+    assert all(outputs[key] == expected[key] for key in cleaned)
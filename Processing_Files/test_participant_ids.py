@@ -0,0 +1,83 @@
+"""
+The validating and cleaning stages normalize participant IDs the same way,
+so a participant the validator keeps is never skipped by cleaning, and
+cleaning records the participants it skips so they are not reread.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import pandas as pd
+import pytest
+from Processing_0_Validating_inputs import validate_raw_exports
+from Processing_1_Cleaning_trials import generate_eye_tracking_data, normalize_participant_id
+from build_manifest import BuildManifest, hash_file
+
+@pytest.mark.parametrize('pid, normalized', [
+    ('wpi61abc', 'wpi61abc'),
+    ('  wpi61abc\t', 'wpi61abc'),
+    ('\nwpi61abc ', 'wpi61abc'),
+    ('   ', None),
+    (float('nan'), None),
+    (None, None),
+])
+def test_normalize_participant_id(pid, normalized):
+    assert normalize_participant_id(pid) == normalized
+
+def set_raw_pid(paths, filename, pid):
+    """Set the PID Processing_1 reads (the second row) of a raw export"""
+    input_file = os.path.join(paths.raw_data, filename)
+    df = pd.read_csv(input_file, encoding='latin-1')
+    df['pid'] = df['pid'].astype(object)
+    df.at[1, 'pid'] = pid
+    df.to_csv(input_file, index=False)
+
+def test_stages_agree_on_padded_ids(cohort, capfd):
+    files = sorted(os.listdir(cohort.raw_data))
+    ids_df = pd.read_csv(cohort.participant_ids, dtype=str)
+    pids = ids_df['pid'].tolist()
+
+    # Whitespace around IDs in participant_ids.csv, in the raw exports, or both
+    ids_df['pid'] = [f" {pid}\t" if i % 2 else pid for i, pid in enumerate(pids)]
+    ids_df.to_csv(cohort.participant_ids, index=False)
+    for filename in files[:3]:
+        raw_df = pd.read_csv(os.path.join(cohort.raw_data, filename), encoding='latin-1')
+        set_raw_pid(cohort, filename, f"  {normalize_participant_id(raw_df.at[1, 'pid'])} ")
+    # And an export whose PID is only whitespace
+    set_raw_pid(cohort, files[3], '   ')
+
+    assert validate_raw_exports(paths=cohort, dry_run=True) == [files[3]]
+    for filename in os.listdir(cohort.pavlovia_data):
+        os.remove(os.path.join(cohort.pavlovia_data, filename))
+    generate_eye_tracking_data(force=True, paths=cohort)
+    out = capfd.readouterr().out
+    assert out.count("not in participant_ids.csv, skipping") == 1
+
+    # Cleaned files are named by the normalized PID
+    cleaned = sorted(os.listdir(cohort.pavlovia_data))
+    assert all(name == name.strip() for name in cleaned)
+    assert len(cleaned) == len(files) - 1
+
+def test_skipped_participants_recorded(cohort, capfd):
+    files = sorted(os.listdir(cohort.raw_data))
+    generate_eye_tracking_data(paths=cohort)
+    set_raw_pid(cohort, files[0], 'notaparticipant')
+    generate_eye_tracking_data(paths=cohort)
+    assert "PID notaparticipant not in participant_ids.csv" in capfd.readouterr().out
+
+    input_file = os.path.join(cohort.raw_data, files[0])
+    entry = BuildManifest(cohort.manifest).entries['clean'][files[0]]
+    assert entry['skipped'] and entry['output'] is None
+    assert entry['input_hash'] == hash_file(input_file)
+
+    # An unchanged skipped file is not read again
+    generate_eye_tracking_data(paths=cohort)
+    out = capfd.readouterr().out
+    assert f"{len(files)} of {len(files)} files are up to date" in out
+    assert "Processing file" not in out
+
+    # Once the participant is added to participant_ids.csv, it is cleaned
+    ids_df = pd.read_csv(cohort.participant_ids, dtype=str)
+    pd.concat([ids_df, pd.DataFrame({'pid': ['notaparticipant']})]).to_csv(cohort.participant_ids, index=False)
+    generate_eye_tracking_data(paths=cohort)
+    assert "skipping" not in capfd.readouterr().out
+    assert os.path.exists(os.path.join(cohort.pavlovia_data, 'notaparticipant.csv'))
+    assert not BuildManifest(cohort.manifest).entries['clean'][files[0]]['skipped']
@@ -0,0 +1,68 @@
+"""
+Fraction answers are scored as equivalent fractions, and the scoring stage
+writes Math_data.csv and Response_data.csv in the committed layout.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import shutil
+import pandas as pd
+import pytest
+from Processing_2_Response_data_Combining_participants import (score_answers, parse_answers, normalize_answers,
+                                                                score_responses, EXCLUDED_FILES)
+
+COMMITTED_OUTPUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Output_Files')
+
+@pytest.mark.parametrize('answer, normalized, value', [
+    ('79', '79', (79, 0)),
+    (' 79.0 ', '79', (79, 0)),
+    ('31.50', '31.5', (315, 1)),
+    ('.5', '0.5', (5, 1)),
+    ('-.25', '-0.25', (-25, 2)),
+    ('.0', '0', (0, 0)),
+    ('5.', '5', (5, 0)),
+])
+def test_parses_plain_numbers(answer, normalized, value):
+    answers = pd.Series([answer])
+    assert normalize_answers(answers.astype('string')).tolist() == [normalized]
+    digits, decimals, _, valid = parse_answers(answers)
+    assert valid.tolist() == [True]
+    assert (int(digits[0]), int(decimals[0])) == value
+
+@pytest.mark.parametrize('answer', ['.', '-', '-.', '', '1/2', '3+4', '1.2.3', '..5', None])
+def test_rejects_other_answers(answer):
+    _, _, _, valid = parse_answers(pd.Series([answer], dtype='string'))
+    assert valid.tolist() == [False]
+
+def test_scores_equivalent_fractions():
+    numerators = pd.Series(['28', '112', '.5', '0.50', '1', '2', '28', 'x', '3'])
+    denominators = pd.Series(['15', '60', '1', '1', '2', '4', '16', '15', '0'])
+    true_numerators = [28, 28, 1, 1, 1, 1, 28, 28, 3]
+    true_denominators = [15, 15, 2, 2, 2, 2, 15, 15, 1]
+    correct, simplified = score_answers(numerators, denominators, true_numerators, true_denominators)
+    assert correct.tolist() == [True, True, True, True, True, True, False, False, False]
+    assert simplified.tolist() == [True, False, False, False, True, False, False, False, False]
+
+def test_stage_writes_committed_layout(cohort):
+    # One participant under a file name the R script excludes
+    first = sorted(os.listdir(cohort.pavlovia_data))[0]
+    excluded = EXCLUDED_FILES[0]
+    shutil.copy(os.path.join(cohort.pavlovia_data, first), os.path.join(cohort.pavlovia_data, excluded))
+
+    score_responses(paths=cohort)
+    math_df = pd.read_csv(cohort.math_data, dtype={'pid': str})
+    response_df = pd.read_csv(cohort.response_data, dtype={'pid': str})
+    committed_columns = list(pd.read_csv(os.path.join(COMMITTED_OUTPUTS, 'Math_data.csv'), nrows=0).columns)
+    assert list(math_df.columns) == committed_columns
+    assert list(response_df.columns) == committed_columns
+    assert set(math_df['Correct']) <= {True, False}
+
+    excluded_pid = os.path.splitext(excluded)[0]
+    assert excluded_pid in set(math_df['pid'])
+    pd.testing.assert_frame_equal(response_df, math_df[math_df['pid'] != excluded_pid].reset_index(drop=True))
+    summary_df = pd.read_csv(cohort.math_summary)
+    assert {'n_correct', 'n_simplified', 'accuracy', 'rcs'} <= set(summary_df.columns)
+
+    # A missing Response_data.csv is rewritten even when the inputs are unchanged
+    os.remove(cohort.response_data)
+    score_responses(paths=cohort)
+    assert os.path.exists(cohort.response_data)
@@ -0,0 +1,66 @@
+"""
+Streaming a participant file in batches (--chunk-size) must write the same
+output as labelling the whole file in memory.
+Run with: python -m pytest Processing_Files
+"""
+import os
+import pandas as pd
+import pytest
+from Processing_4_Eyes_to_AOIs import process_gaze_data
+
+def read_labelled(paths, output_format):
+    """Every participant's labelled output: file bytes for CSV, tables for Parquet"""
+    if output_format == 'csv':
+        outputs = {}
+        for file in sorted(os.listdir(paths.aoi_hit)):
+            with open(os.path.join(paths.aoi_hit, file), 'rb') as f:
+                outputs[file] = f.read()
+        return outputs
+    return {file: (pd.read_parquet(os.path.join(paths.aoi_samples, file)),
+                   pd.read_parquet(os.path.join(paths.aoi_trials, file)))
+            for file in sorted(os.listdir(paths.aoi_samples))}
+
+def assert_same_outputs(streamed, expected, output_format):
+    assert sorted(streamed) == sorted(expected)
+    if output_format == 'csv':
+        for file in expected:
+            assert streamed[file] == expected[file], file
+        return
+    for file, (samples_df, trials_df) in expected.items():
+        pd.testing.assert_frame_equal(streamed[file][0], samples_df)
+        pd.testing.assert_frame_equal(streamed[file][1], trials_df)
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+@pytest.mark.parametrize('use_gaze_cache', [False, True])
+def test_streaming_matches_in_memory(cohort, output_format, use_gaze_cache):
+    process_gaze_data(output_format, force=True, paths=cohort, use_gaze_cache=use_gaze_cache)
+    expected = read_labelled(cohort, output_format)
+    assert expected
+
+    # Batches of one sample, of a few trials, and of the whole file; the
+    # second pass of each reads the gaze cache written by the first
+    for chunk_size in [1, 1, 500, 10 ** 9]:
+        process_gaze_data(output_format, force=True, paths=cohort, chunk_size=chunk_size,
+                          use_gaze_cache=use_gaze_cache)
+        assert_same_outputs(read_labelled(cohort, output_format), expected, output_format)
+
+def test_streaming_with_fractional_time_points(cohort):
+    # Only some trials have fractional time points, so batches differ in
+    # whether their time points are whole numbers
+    file = sorted(os.listdir(cohort.pavlovia_data))[0]
+    input_file = os.path.join(cohort.pavlovia_data, file)
+    df = pd.read_csv(input_file)
+    df.loc[1, 'TaskGazeArray'] = df.loc[1, 'TaskGazeArray'].replace(',', '.5,', 1)
+    df.to_csv(input_file, index=False)
+
+    process_gaze_data(force=True, paths=cohort, use_gaze_cache=False)
+    expected = read_labelled(cohort, 'csv')
+    for chunk_size in [1, 500]:
+        process_gaze_data(force=True, paths=cohort, chunk_size=chunk_size, use_gaze_cache=False)
+        assert_same_outputs(read_labelled(cohort, 'csv'), expected, 'csv')
+
+def test_streaming_with_resampling(cohort):
+    process_gaze_data(force=True, paths=cohort, use_gaze_cache=False, resample_rate=30)
+    expected = read_labelled(cohort, 'csv')
+    process_gaze_data(force=True, paths=cohort, chunk_size=1, use_gaze_cache=False, resample_rate=30)
+    assert_same_outputs(read_labelled(cohort, 'csv'), expected, 'csv')
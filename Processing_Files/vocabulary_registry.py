@@ -0,0 +1,63 @@
+import pandas as pd
+from Processing_1_Cleaning_trials import IMAGE_METADATA
+
+# Labels for gaze samples that fall on no AOI
+OFF_AOI_LABELS = ['Outside_of_AOIs', 'Outside_of_Screen']
+
+# Conditions assigned by Processing_1
+CONDITIONS = ['Congruent', 'Incongruent']
+
+# Columns carried as Categoricals between stages
+CATEGORICAL_COLUMNS = ['AOI', 'Image', 'HOO_Position', 'Condition']
+
+def get_aoi_vocabulary(aois_df):
+    """
+    Get the fixed AOI vocabulary used for the categorical AOI column:
+    AOIs in AOIs.csv order followed by the two off-AOI labels.
+    """
+    aoi_names = list(dict.fromkeys(aois_df['AOI']))
+    return aoi_names + OFF_AOI_LABELS
+
+def build_vocabularies(aois_df, image_metadata=IMAGE_METADATA):
+    """
+    Build the shared vocabularies of the categorical columns from AOIs.csv
+    and Processing_1's image metadata.
+    Image, HOO_Position and Condition are sorted, so ordering rows by their
+    codes gives the same order as ordering them by name.
+    Returns a dict mapping each column in CATEGORICAL_COLUMNS to its values.
+    """
+    hoo_positions = set(image_metadata['HOO_Position']) | set(aois_df['HOO_position'].dropna())
+    return {
+        'AOI': get_aoi_vocabulary(aois_df),
+        'Image': sorted(image_metadata['Image']),
+        'HOO_Position': sorted(hoo_positions),
+        'Condition': sorted(CONDITIONS),
+    }
+
+def to_categorical(values, categories):
+    """
+    Encode values as a Categorical over a vocabulary.
+    Values missing from the vocabulary are added to it rather than turned
+    into NaN (in sorted position if the vocabulary is sorted).
+    """
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        observed = values.cat.categories[pd.unique(values.cat.codes[values.cat.codes >= 0])]
+    else:
+        observed = pd.unique(values.dropna())
+    known = set(categories)
+    unknown = [value for value in observed if value not in known]
+    if unknown:
+        is_sorted = list(categories) == sorted(categories)
+        categories = list(categories) + unknown
+        if is_sorted and all(isinstance(value, str) for value in unknown):
+            categories = sorted(categories)
+    return pd.Categorical(values, categories=categories)
+
+def encode_categoricals(df, vocabularies):
+    """Convert the vocabulary columns present in df to Categoricals (returns a copy)"""
+    df = df.copy()
+    for column, categories in vocabularies.items():
+        if column in df.columns:
+            df[column] = to_categorical(df[column], categories)
+    return df